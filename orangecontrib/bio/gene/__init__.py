@@ -2,8 +2,10 @@ from __future__ import absolute_import
 import sys
 import os
 import time
+import gc
+import threading
 
-from ..utils import serverfiles
+from ..utils import serverfiles, arraycache
 
 from .. import taxonomy as obiTaxonomy
 from .. import kegg as obiKEGG
@@ -36,6 +38,8 @@ except ImportError:
 
 from functools import reduce
 
+import numpy
+
 default_database_path = serverfiles.localpath("NCBI_geneinfo")
 
 class GeneInfo(object):
@@ -81,14 +85,167 @@ class GeneHistory(object):
             setattr(self, attr, value)
 
 
+def _text(line):
+    """ Decode a line read from a binary file (a no-op on Python 2). """
+    if str is bytes:
+        return line
+    return line.decode("utf-8")
+
+class GeneInfoIndex(object):
+    """
+    An on disk index of a NCBI gene_info file. Gene ids and symbols are
+    stored as sorted arrays together with the offsets and lengths of the
+    lines in the file; :obj:`GeneInfo` objects are parsed on access.
+    """
+
+    #: Version of the cache format.
+    version = 1
+
+    def __init__(self, filename, arrays):
+        self.filename = filename
+        self.arrays = arrays
+        self.ids = arrays["ids"]
+        self._file = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, filename):
+        ids = []
+        symbols = []
+        offsets = []
+        offset = 0
+        with open(filename, "rb") as f:
+            for line in f:
+                if line.strip() and not line.startswith(b"#"):
+                    fields = line.split(b"\t", 3)
+                    ids.append(fields[1])
+                    symbols.append(fields[2])
+                    offsets.append(offset)
+                offset += len(line)
+        offsets.append(offset)
+        offsets = numpy.array(offsets, dtype=numpy.int64)
+        lengths = numpy.diff(offsets)
+        offsets = offsets[:-1]
+
+        ids = numpy.array(ids, dtype=bytes)
+        # Sort by id; the last line of a duplicated id wins
+        order = numpy.argsort(ids, kind="mergesort")
+        last = numpy.ones(len(order), dtype=bool)
+        last[:-1] = ids[order][1:] != ids[order][:-1]
+        order = order[last]
+
+        symbols = numpy.array(symbols, dtype=bytes)[order]
+        symorder = numpy.argsort(symbols, kind="mergesort")
+        symnames, counts = numpy.unique(symbols[symorder], return_counts=True)
+        symindptr = numpy.zeros(len(symnames) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=symindptr[1:])
+
+        arrays = {
+            "ids": ids[order],
+            "offsets": offsets[order],
+            "lengths": lengths[order],
+            "symbols": symnames,
+            "symbol_indptr": symindptr,
+            "symbol_genes": symorder.astype(numpy.int64)
+        }
+        return cls(filename, arrays)
+
+    @classmethod
+    def cached(cls, filename):
+        """
+        Load the index of filename from its cache or build (and cache) it.
+        """
+        path = arraycache.cache_path(filename)
+        revision = arraycache.file_revision(filename)
+        loaded = arraycache.load(path, version=cls.version, revision=revision)
+        if loaded is not None:
+            return cls(filename, loaded[1])
+        index = cls.build(filename)
+        try:
+            arraycache.save(path, {"version": cls.version,
+                                   "revision": revision}, index.arrays)
+        except (IOError, OSError):
+            pass
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def keys(self):
+        return [_text(key) for key in self.ids.tolist()]
+
+    def _find(self, array, key):
+        if not isinstance(key, bytes):
+            if not isinstance(key, basestring):
+                return None
+            key = key.encode("utf-8")
+        i = numpy.searchsorted(array, key)
+        if i < len(array) and array[i] == key:
+            return int(i)
+        return None
+
+    def position(self, gene_id):
+        """ Return the position of gene_id or None. """
+        return self._find(self.ids, gene_id)
+
+    def positions_by_symbol(self, symbol):
+        """ Return positions of genes with the symbol. """
+        i = self._find(self.arrays["symbols"], symbol)
+        if i is None:
+            return []
+        indptr = self.arrays["symbol_indptr"]
+        return self.arrays["symbol_genes"][indptr[i]:indptr[i + 1]].tolist()
+
+    def line(self, position):
+        """ Return the line of the gene at position. """
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.filename, "rb")
+            self._file.seek(int(self.arrays["offsets"][position]))
+            line = self._file.read(int(self.arrays["lengths"][position]))
+        return _text(line).rstrip("\r\n")
+
+    def lines(self):
+        """ Iterate over (gene id, line) pairs in the file order. """
+        order = numpy.argsort(self.arrays["offsets"])
+        offsets = self.arrays["offsets"][order].tolist()
+        ids = self.ids[order].tolist()
+        i = 0
+        offset = 0
+        with open(self.filename, "rb") as f:
+            for line in f:
+                if i < len(offsets) and offset == offsets[i]:
+                    yield _text(ids[i]), _text(line).rstrip("\r\n")
+                    i += 1
+                offset += len(line)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_file"], state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, _file=None, _lock=threading.Lock())
+
+
 class NCBIGeneInfo(dict):
+    """
+    A dictionary like object for accessing NCBI gene info. Gene
+    information is parsed on access from an index of the gene info
+    file (see :obj:`GeneInfoIndex`).
+    """
     TAX_MAP = {
             "2104": "272634",  # Mycoplasma pneumoniae
             "4530": "39947",  # Oryza sativa
             "5833": "36329",  # Plasmodium falciparum
             "4932": "559292",  # Saccharomyces cerevisiae
             }
-       
+
+    #: Default gene matches (with the gene ids set as targets) shared by
+    #: all instances, by (taxid, gene info file revision)
+    _default_matches = {}
+    _default_matches_lock = threading.Lock()
+
     def __init__(self, organism, genematcher=None):
         """ An dictionary like object for accessing NCBI gene info
         Arguments::
@@ -102,19 +259,49 @@ class NCBIGeneInfo(dict):
 
 
         fname = serverfiles.localpath_download("NCBI_geneinfo", "gene_info.%s.db" % self.taxid)
-        file = open(fname, "rt")
-        self.update(dict([(line.split("\t", 3)[1], line) for line in file.read().splitlines() if line.strip() and not line.startswith("#")]))
+        self.index = GeneInfoIndex.cached(fname)
+        self._revision = arraycache.file_revision(fname)
+
+        self._matcher = genematcher
+        self._matcher_ready = False
 
-        self.matcher = genematcher
-        if self.matcher == None:
-            if self.taxid == '352472':
-                self.matcher = matcher([GMNCBI(self.taxid), GMDicty(), [GMNCBI(self.taxid), GMDicty()]])
+    def _default_matcher(self):
+        if self.taxid == '352472':
+            return matcher([GMNCBI(self.taxid), GMDicty(), [GMNCBI(self.taxid), GMDicty()]])
+        else:
+            return matcher([GMNCBI(self.taxid)])
+
+    def get_matcher(self):
+        """
+        The gene matcher with the target names set (on the first use).
+        The targets of the default matcher are set only once for each
+        organism and gene info file and shared by all (unmodified)
+        instances, each with its own :obj:`MatcherFixed` wrapper.
+        """
+        if not self._matcher_ready:
+            if self._matcher is None and not dict.__len__(self):
+                key = (self.taxid, self._revision)
+                with NCBIGeneInfo._default_matches_lock:
+                    match = NCBIGeneInfo._default_matches.get(key)
+                    if match is None:
+                        match = self._default_matcher().set_targets(
+                            self.keys())
+                        NCBIGeneInfo._default_matches[key] = match
+                self._matcher = MatcherFixed(match, self._default_matcher)
             else:
-                self.matcher = matcher([GMNCBI(self.taxid)])
+                if self._matcher is None:
+                    self._matcher = self._default_matcher()
+                #if this is done with a gene matcher, pool target names
+                self._matcher.set_targets(self.keys())
+            self._matcher_ready = True
+        return self._matcher
+
+    def set_matcher(self, matcher):
+        self._matcher = matcher
+        self._matcher_ready = False
+
+    matcher = property(get_matcher, set_matcher)
 
-        #if this is done with a gene matcher, pool target names
-        self.matcher.set_targets(self.keys())
-        
     def history(self):
         if getattr(self, "_history", None) is None:
             fname = serverfiles.localpath_download("NCBI_geneinfo", "gene_history.%s.db" % self.taxid)
@@ -175,9 +362,18 @@ class NCBIGeneInfo(dict):
         id = self.matcher.umatch(name)
         return self[id]
 
+    def _line(self, key):
+        # Lines set with __setitem__ override the indexed file
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        position = self.index.position(key)
+        if position is None:
+            raise KeyError(key)
+        return self.index.line(position)
+
     def __getitem__(self, key):
 #        return self.get(gene_id, self.matcher[gene_id])
-        return GeneInfo(dict.__getitem__(self, key))
+        return GeneInfo(self._line(key))
 
     def __setitem__(self, key, value):
         if type(value) == str:
@@ -185,19 +381,50 @@ class NCBIGeneInfo(dict):
         else:
             dict.__setitem__(self, key, repr(value))
 
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or \
+            self.index.position(key) is not None
+
+    def __len__(self):
+        if not dict.__len__(self):
+            return len(self.index)
+        return len(self.keys())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        keys = self.index.keys()
+        if dict.__len__(self):
+            keys = keys + [key for key in dict.keys(self)
+                           if self.index.position(key) is None]
+        return keys
+
+    def iterkeys(self):
+        return iter(self.keys())
+
     def get(self, key, def_=None):
         try:
             return self[key]
         except KeyError:
             return def_
 
-    def itervalues(self):
-        for val in dict.itervalues(self):
-            yield GeneInfo(val)
+    def get_by_symbol(self, symbol):
+        """ Return a list of GeneInfo objects of genes with the symbol.
+        """
+        return [GeneInfo(self.index.line(position))
+                for position in self.index.positions_by_symbol(symbol)]
 
     def iteritems(self):
-        for key, val in zip(self.iterkeys(), self.itervalues()):
-            yield key, val
+        for key, line in self.index.lines():
+            if not dict.__contains__(self, key):
+                yield key, GeneInfo(line)
+        for key in dict.keys(self):
+            yield key, self[key]
+
+    def itervalues(self):
+        for _, val in self.iteritems():
+            yield val
 
     if sys.version_info < (3, ):
         def values(self):
@@ -207,10 +434,10 @@ class NCBIGeneInfo(dict):
             return list(self.iteritems())
     else:
         def values(self):
-            return map(GeneInfo, super().values())
+            return self.itervalues()
 
         def items(self):
-            return ((key, GeneInfo(value)) for key, value in super().items())
+            return self.iteritems()
 
     @staticmethod
     def get_geneinfo_from_ncbi(file, progressCallback=None):
@@ -386,6 +613,206 @@ def create_mapping(groups, lower=False):
 
     return togroup
 
+def _alias_key(alias, lower=False):
+    """ Return the (utf-8 encoded) key of alias in an AliasIndex. """
+    if lower:
+        alias = alias.lower()
+    if not isinstance(alias, bytes):
+        alias = alias.encode("utf-8")
+    return alias
+
+def _alias_string(key):
+    """ Return an alias from its AliasIndex key. """
+    if str is bytes:
+        return key
+    return key.decode("utf-8")
+
+def _alias_keys(aliases, lower=False):
+    """ Return a list of AliasIndex keys of aliases. """
+    if lower:
+        aliases = [alias.lower() for alias in aliases]
+    try:
+        # Encode all at once if possible
+        keys = u"\0".join(aliases).encode("utf-8").split(b"\0")
+        if len(keys) == len(aliases):
+            return keys
+    except (UnicodeError, TypeError):
+        pass
+    return [_alias_key(alias) for alias in aliases]
+
+def _csr_take(indptr, data, rows):
+    """
+    Return elements of the given rows of a CSR (indptr, data) structure
+    as (row positions, elements) arrays.
+    """
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    owner = numpy.repeat(numpy.arange(len(rows)), counts)
+    offsets = numpy.arange(counts.sum()) - \
+        numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    return owner, data[numpy.repeat(starts, counts) + offsets]
+
+class AliasIndex(object):
+    """
+    A compiled mapping of aliases to indices of groups of aliases (the
+    same mapping as create_mapping builds).
+
+    Aliases (in lower case if ignore_case) are stored as a sorted array
+    of utf-8 encoded strings, and group indices of the alias at position
+    i are ``groups[indptr[i]:indptr[i+1]]``. Whole lists of genes are
+    looked up at once with :func:`lookup`.
+    """
+
+    def __init__(self, names, indptr, groups, ngroups, ignore_case=True):
+        self.names = names
+        self.indptr = indptr
+        self.groups = groups
+        self.ngroups = ngroups
+        self.ignore_case = ignore_case
+        self._codes = None
+
+    @classmethod
+    def from_groups(cls, groups, ignore_case=True):
+        """ Build an index from a list of groups (sets) of aliases. """
+        aliases = []
+        ids = []
+        for i, group in enumerate(groups):
+            aliases.extend(group)
+            ids.extend([i] * len(group))
+
+        ngroups = len(groups)
+        keys = numpy.array(_alias_keys(aliases, ignore_case), dtype=bytes)
+        names, inverse = numpy.unique(keys, return_inverse=True)
+        # Sorted (alias, group) pairs without duplicates
+        pairs = numpy.unique(inverse.astype(numpy.int64) * max(ngroups, 1) +
+                             numpy.array(ids, dtype=numpy.int64))
+        rows, groups = numpy.divmod(pairs, max(ngroups, 1))
+        indptr = numpy.zeros(len(names) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(rows, minlength=len(names)),
+                     out=indptr[1:])
+        return cls(names, indptr, groups.astype(numpy.int32), ngroups,
+                   ignore_case)
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, genes):
+        """
+        Return an array of alias positions of genes (-1 for unknown genes).
+        """
+        keys = _alias_keys(genes, self.ignore_case)
+        codes = numpy.full(len(keys), -1, dtype=numpy.int64)
+        if keys and len(self.names):
+            keys = numpy.array(keys, dtype=bytes)
+            pos = numpy.searchsorted(self.names, keys)
+            pos = numpy.minimum(pos, len(self.names) - 1)
+            found = self.names[pos] == keys
+            codes[found] = pos[found]
+        return codes
+
+    def take(self, codes):
+        """
+        Return groups of aliases at positions `codes` as a pair of arrays:
+        indices into `codes` and the corresponding group indices.
+        """
+        return _csr_take(self.indptr, self.groups,
+                         numpy.asarray(codes, dtype=numpy.int64))
+
+    def to_ids(self, gene):
+        """ Return a set of indices of groups containing gene. """
+        if self._codes is None:
+            # dictionaries and lists are faster for looking up single genes
+            names = [_alias_string(name) for name in self.names.tolist()]
+            self._codes = (dict(zip(names, range(len(names)))),
+                           self.indptr.tolist(), self.groups.tolist())
+        codes, indptr, groups = self._codes
+        if self.ignore_case:
+            gene = gene.lower()
+        code = codes.get(gene)
+        if code is None:
+            return set()
+        return set(groups[indptr[code]:indptr[code + 1]])
+
+class AliasCache(object):
+    """
+    Compiled gene aliases stored in a (memory mapped) cache directory
+    (see :mod:`orangecontrib.bio.utils.arraycache`).
+
+    The cache holds the alias indices for both exact and case insensitive
+    matching and the groups of aliases. Groups (a list of sets, as
+    returned by the matcher's create_aliases) are only decoded when
+    they are needed.
+    """
+
+    #: Version of the cache format.
+    version = 1
+
+    def __init__(self, arrays, ngroups):
+        self.arrays = arrays
+        self.ngroups = ngroups
+
+    @classmethod
+    def from_aliases(cls, aliases):
+        aliases = list(aliases)
+        exact = AliasIndex.from_groups(aliases, ignore_case=False)
+        lower = AliasIndex.from_groups(aliases, ignore_case=True)
+        # groups -> aliases (positions in exact.names)
+        rows = numpy.repeat(numpy.arange(len(exact.names)),
+                            numpy.diff(exact.indptr))
+        order = numpy.argsort(exact.groups, kind="mergesort")
+        indptr = numpy.zeros(len(aliases) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(exact.groups, minlength=len(aliases)),
+                     out=indptr[1:])
+        arrays = {
+            "names": exact.names, "indptr": exact.indptr,
+            "groups": exact.groups,
+            "lower_names": lower.names, "lower_indptr": lower.indptr,
+            "lower_groups": lower.groups,
+            "group_indptr": indptr,
+            "group_aliases": rows[order].astype(numpy.int32)
+        }
+        return cls(arrays, len(aliases))
+
+    @classmethod
+    def load(cls, path, version=None, revision=None):
+        """
+        Load the cache from `path`. Return None if it does not exist or
+        if it was saved with a different aliases version or from a
+        different revision of the source file.
+        """
+        expected = {"version": cls.version, "revision": revision}
+        if version is not None:
+            expected["aliases_version"] = version
+        loaded = arraycache.load(path, **expected)
+        if loaded is None:
+            return None
+        meta, arrays = loaded
+        return cls(arrays, meta["ngroups"])
+
+    def save(self, path, version=None, revision=None):
+        arraycache.save(path, {"version": self.version,
+                               "aliases_version": version,
+                               "revision": revision,
+                               "ngroups": self.ngroups}, self.arrays)
+
+    def index(self, ignore_case=True):
+        """ Return an :obj:`AliasIndex` for exact or case insensitive
+        matching. """
+        prefix = "lower_" if ignore_case else ""
+        return AliasIndex(self.arrays[prefix + "names"],
+                          self.arrays[prefix + "indptr"],
+                          self.arrays[prefix + "groups"],
+                          self.ngroups, ignore_case)
+
+    def aliases(self):
+        """ Return groups of aliases as a list of sets. """
+        names = [_alias_string(name)
+                 for name in self.arrays["names"].tolist()]
+        indptr = self.arrays["group_indptr"].tolist()
+        members = self.arrays["group_aliases"].tolist()
+        return [set(names[m] for m in members[indptr[i]:indptr[i + 1]])
+                for i in range(self.ngroups)]
+
 def join_sets(set1, set2, lower=False):
     """ 
     Joins two sets of gene set mappings. If lower is True, lower case
@@ -472,6 +899,15 @@ class Matcher(object):
         mat = self.match(gene)
         return mat[0] if len(mat) == 1 else None
 
+    def match_many(self, genes):
+        """Return a list of matches (as returned by :obj:`match`) for each gene in a list."""
+        return [ self.match(gene) for gene in genes ]
+
+    def umatch_many(self, genes):
+        """Return a unique match (as returned by :obj:`umatch`) or None for each gene in a list."""
+        return [ mat[0] if len(mat) == 1 else None
+                 for mat in self.match_many(genes) ]
+
     def explain(self, gene):
         """ 
         Return gene matches with explanations as lists of tuples:
@@ -492,6 +928,21 @@ def buffer_path():
     else:
         return gene_matcher_path
 
+def _load_pickled(filename, version):
+    """
+    Return a (success, output) tuple with the output saved with
+    auto_pickle. Success is False if the file does not exist or was
+    saved for a different version.
+    """
+    try:
+        with open(filename, "rb") as f:
+            versionF = pickle.load(f)
+            if version == None or versionF == version:
+                return True, pickle.load(f)
+    except Exception:
+        pass
+    return False, None
+
 def auto_pickle(filename, version, func, *args, **kwargs):
     """
     Run function func with given arguments and save the results to
@@ -499,36 +950,61 @@ def auto_pickle(filename, version, func, *args, **kwargs):
     version were already saved, just read and return them.
     """
 
-    output = None
-    outputOk = False
-
-    try:
-        f = open(filename,'rb')
-
-        try:
-            versionF = pickle.load(f)
-            if version == None or versionF == version:
-                outputOk = True
-                output = pickle.load(f)
-        except:
-            pass
-        finally:
-            f.close()
-
-    except:
-        pass
+    outputOk, output = _load_pickled(filename, version)
 
     if not outputOk:
         output = func(*args, **kwargs)
 
-        #save output before returning
-        f = open(filename,'wb')
-        pickle.dump(version, f, -1)
-        pickle.dump(output, f, -1)
-        f.close()
+        #save output before returning (replace the file atomically)
+        tmpname = "%s.%i.tmp" % (filename, os.getpid())
+        with open(tmpname, 'wb') as f:
+            pickle.dump(version, f, -1)
+            pickle.dump(output, f, -1)
+        if sys.platform == "win32" and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmpname, filename)
 
     return output
 
+#: Loaded alias caches (shared by all matchers)
+_alias_caches = {}
+_alias_caches_lock = threading.RLock()
+
+def load_alias_cache(filename, version, func, *args, **kwargs):
+    """
+    Return an :obj:`AliasCache` saved in `filename` + ".cache". If it
+    does not exist for the given version, compile and save the aliases
+    returned by func(*args, **kwargs) (or by an :obj:`auto_pickle`
+    file with the same name). The cache is also rebuilt when that file
+    changes. A loaded cache is shared by all callers.
+    """
+    revision = arraycache.file_revision(filename) \
+        if os.path.exists(filename) else None
+    key = (filename, version, revision)
+    with _alias_caches_lock:
+        cache = _alias_caches.get(key)
+        if cache is None:
+            cache = _alias_caches[key] = _load_alias_cache(
+                filename, version, revision, func, *args, **kwargs)
+    return cache
+
+def _load_alias_cache(filename, version, revision, func, *args, **kwargs):
+    path = arraycache.cache_path(filename)
+    cache = AliasCache.load(path, version, revision)
+    if cache is None:
+        ok, aliases = _load_pickled(filename, version)
+        if not ok:
+            aliases = func(*args, **kwargs)
+        cache = AliasCache.from_aliases(aliases)
+        try:
+            cache.save(path, version, revision)
+        except (IOError, OSError):
+            pass
+        else:
+            # use the memory mapped arrays
+            cache = AliasCache.load(path, version, revision) or cache
+    return cache
+
 class MatcherAliases(Matcher):
     """
     Genes matcher based on a list of sets of given aliases.
@@ -542,6 +1018,14 @@ class MatcherAliases(Matcher):
         self.ignore_case = ignore_case
         self.mdict = create_mapping(self.aliases, self.ignore_case)
 
+    def alias_index(self):
+        """ Return a compiled :obj:`AliasIndex` of the aliases. """
+        index = getattr(self, "_alias_index", None)
+        if index is None:
+            index = AliasIndex.from_groups(self.aliases, self.ignore_case)
+            self._alias_index = index
+        return index
+
     def to_ids(self, gene):
         """ Return ids of sets of aliases the gene belongs to. """
         if self.ignore_case:
@@ -553,13 +1037,14 @@ class MatcherAliases(Matcher):
         A reverse dictionary is made according to each target's membership
         in the sets of aliases.
         """
+        targets = list(targets)
         d = defaultdict(list)
         #d = id: [ targets ], where id is index of the set of aliases
-        for target in targets:
-            ids = self.to_ids(target)
-            if ids != None:
-                for id in ids:
-                    d[id].append(target)
+        codes = self.alias_index().lookup(targets)
+        known = numpy.flatnonzero(codes >= 0)
+        owner, ids = self.alias_index().take(codes[known])
+        for t, id in zip(known[owner].tolist(), ids.tolist()):
+            d[id].append(targets[t])
         mo = MatchAliases(d, self)
         self.matcho = mo #backward compatibility - default match object
         return mo
@@ -570,12 +1055,24 @@ class MatcherAliases(Matcher):
     def explain(self, gene):
         return self.matcho.explain(gene)
 
+    def match_many(self, genes):
+        return self.matcho.match_many(genes)
+
 class Match(object):
 
     def umatch(self, gene):
         """Returns an unique (only one matching target) target or None"""
         mat = self.match(gene)
         return mat[0] if len(mat) == 1 else None
+
+    def match_many(self, genes):
+        """Returns a list of matches for each gene in a list"""
+        return [ self.match(gene) for gene in genes ]
+
+    def umatch_many(self, genes):
+        """Returns an unique target or None for each gene in a list"""
+        return [ mat[0] if len(mat) == 1 else None
+                 for mat in self.match_many(genes) ]
  
 class MatchAliases(Match):
 
@@ -599,6 +1096,60 @@ class MatchAliases(Match):
         inputgeneids = self.parent.to_ids(gene)
         return [ (self.to_targets[igid], self.parent.aliases[igid]) for igid in inputgeneids ]
 
+    def target_index(self):
+        """
+        Return target names and a CSR (indptr, target indices) mapping
+        of alias group indices to targets.
+        """
+        if getattr(self, "_target_index", None) is None:
+            names = []
+            codes = {}
+            gids = []
+            tids = []
+            for gid, targets in self.to_targets.items():
+                for target in targets:
+                    code = codes.setdefault(target, len(names))
+                    if code == len(names):
+                        names.append(target)
+                    gids.append(gid)
+                    tids.append(code)
+            gids = numpy.array(gids, dtype=numpy.int64)
+            tids = numpy.array(tids, dtype=numpy.int64)
+            order = numpy.argsort(gids, kind="mergesort")
+            ngroups = self.parent.alias_index().ngroups
+            indptr = numpy.zeros(ngroups + 1, dtype=numpy.int64)
+            numpy.cumsum(numpy.bincount(gids, minlength=ngroups),
+                         out=indptr[1:])
+            self._target_index = (names, indptr, tids[order])
+        return self._target_index
+
+    def match_many(self, genes):
+        """
+        Match a list of genes at once. Return a list of matching targets
+        for each gene (see :obj:`match`).
+        """
+        genes = list(genes)
+        codes = self.parent.alias_index().lookup(genes)
+        known = numpy.flatnonzero(codes >= 0)
+        owner, gids = self.parent.alias_index().take(codes[known])
+        names, indptr, tids = self.target_index()
+        towner, tids = _csr_take(indptr, tids, gids)
+
+        # unique (gene, target) pairs
+        pairs = numpy.unique(known[owner[towner]] * max(len(names), 1) + tids)
+        gene_ind, target_ind = numpy.divmod(pairs, max(len(names), 1))
+
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            matches = [ [] for _ in genes ]
+            for g, t in zip(gene_ind.tolist(), target_ind.tolist()):
+                matches[g].append(names[t])
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return matches
+
 class MatcherAliasesPickled(MatcherAliases):
     """
     Gene matchers based on sets of aliases supporting pickling should
@@ -613,6 +1164,7 @@ class MatcherAliasesPickled(MatcherAliases):
     
     def set_aliases(self, aliases):
         self.saved_aliases = aliases
+        self._alias_index = None
 
     def get_aliases(self):
         if not self.saved_aliases: #loads aliases if not loaded
@@ -633,6 +1185,20 @@ class MatcherAliasesPickled(MatcherAliases):
 
     mdict = property(get_mdict, set_mdict)
 
+    def alias_index(self):
+        """ Return the :obj:`AliasIndex`. It is loaded from the alias
+        cache without decoding the aliases. """
+        if self._alias_index is None:
+            if not self.saved_aliases and self.alias_cache() is not None:
+                self._alias_index = self.alias_cache().index(self.ignore_case)
+            else:
+                self._alias_index = AliasIndex.from_groups(self.aliases,
+                                                           self.ignore_case)
+        return self._alias_index
+
+    def to_ids(self, gene):
+        return self.alias_index().to_ids(gene)
+
     def set_targets(self, targets):
         return MatcherAliases.set_targets(self, targets)
 
@@ -648,20 +1214,33 @@ class MatcherAliasesPickled(MatcherAliases):
         """ Returns gene aliases. """
         notImplemented()
 
+    def alias_cache(self):
+        """
+        Return the :obj:`AliasCache` of this matcher's aliases or None
+        if the aliases can not be cached.
+        """
+        if self._alias_cache is None:
+            fn = self.filename()
+            if fn != None:
+                ver = self.create_aliases_version() #if version == None ignore it
+                if isinstance(fn, tuple): #if you pass tuple, look directly
+                   filename = fn[0]
+                else:
+                   filename = os.path.join(buffer_path(), fn)
+                self._alias_cache = load_alias_cache(filename, ver,
+                                                     self.create_aliases)
+        return self._alias_cache
+
     def load_aliases(self):
-        fn = self.filename()
-        ver = self.create_aliases_version() #if version == None ignore it
-        if fn != None:
-            if isinstance(fn, tuple): #if you pass tuple, look directly
-               filename = fn[0]
-            else:
-               filename = os.path.join(buffer_path(), fn)
-            return auto_pickle(filename, ver, self.create_aliases)
+        cache = self.alias_cache()
+        if cache is not None:
+            return cache.aliases()
         else:
             #if either file version of version is None, do not pickle
             return self.create_aliases()
 
     def __init__(self, ignore_case=True):
+        self._alias_cache = None
         self.aliases = []
         self.mdict = {}
         self.ignore_case = ignore_case
@@ -769,8 +1348,8 @@ class MatcherAliasesNCBI(MatcherAliasesPickled):
     def create_aliases(self):
         ncbi = NCBIGeneInfo(self.organism, genematcher=GMDirect())
         out = []
-        for k in ncbi.keys():
-            out.append(set(filter(None, [k, ncbi[k].symbol, ncbi[k].locus_tag] + [ s for s in ncbi[k].synonyms ] )))
+        for k, info in ncbi.iteritems():
+            out.append(set(filter(None, [k, info.symbol, info.locus_tag] + [ s for s in info.synonyms ] )))
         return out
 
     def filename(self):
@@ -910,6 +1489,9 @@ class MatcherSequence(Matcher):
     def explain(self, gene):
         return self.matcho.explain(gene)
 
+    def match_many(self, genes):
+        return self.matcho.match_many(genes)
+
 class MatchSequence(Match):
 
     def __init__(self, ms):
@@ -922,6 +1504,27 @@ class MatchSequence(Match):
                 return m
         return []
 
+    def match_many(self, genes):
+        """
+        Match a list of genes: each matcher in the sequence is applied
+        to all genes without matches from the previous matchers.
+        """
+        genes = list(genes)
+        matches = [ [] for _ in genes ]
+        todo = list(range(len(genes)))
+        for match in self.ms:
+            if not todo:
+                break
+            res = match.match_many([ genes[i] for i in todo ])
+            rest = []
+            for i, m in zip(todo, res):
+                if m:
+                    matches[i] = m
+                else:
+                    rest.append(i)
+            todo = rest
+        return matches
+
     def explain(self, gene):
         for match in self.ms:
             m = match.match(gene)
@@ -951,6 +1554,35 @@ class MatcherDirect(Matcher):
     def explain(self, gene):
         return self.matcho.explain(gene)
 
+    def match_many(self, genes):
+        return self.matcho.match_many(genes)
+
+
+class MatcherFixed(Matcher):
+    """
+    A matcher using a match object with the targets already set (as
+    returned by `set_targets` of another matcher), which can be shared.
+    Setting new targets does not change the shared match: a new one is
+    made with a matcher from `factory` (a function without arguments).
+    """
+
+    def __init__(self, matcho, factory):
+        self.matcho = matcho
+        self.factory = factory
+
+    def set_targets(self, targets):
+        self.matcho = self.factory().set_targets(targets)
+        return self.matcho
+
+    def match(self, gene):
+        return self.matcho.match(gene)
+
+    def explain(self, gene):
+        return self.matcho.explain(gene)
+
+    def match_many(self, genes):
+        return self.matcho.match_many(genes)
+
                
 GMDirect = MatcherDirect
 GMKEGG = MatcherAliasesKEGG
@@ -66,18 +66,19 @@ def keggGeneSets(org):
     """
 
     kegg = obiKEGG.KEGGOrganism(org)
+    store = kegg.pathway_store()
 
     genesets = []
     for id in kegg.pathways():
-        pway = obiKEGG.KEGGPathway(id)
+        attributes = store.pathway_attributes(id)
         hier = ("KEGG","pathways")
-        if pway.pathway_attributes():
+        if attributes:
             gs = GeneSet(id=id,
-                                 name=pway.title,
+                                 name=attributes["title"],
                                  genes=kegg.get_genes_by_pathway(id),
                                  hierarchy=hier,
                                  organism=org,
-                                 link=pway.link)
+                                 link=attributes["link"])
             genesets.append(gs)
 
     return GeneSets(genesets)
@@ -4,8 +4,10 @@ import os
 import gzip
 import re
 import io
+import warnings
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from contextlib import closing
 
 import six
 if six.PY3:
@@ -58,6 +60,122 @@ def spots_max(x):
     else:
         return max(vs)
 
+
+_spot_reductions = {
+    spots_mean: "mean", spots_median: "median",
+    spots_min: "min", spots_max: "max"
+}
+
+
+def _group_reduce(X, index, n, merge_function=spots_mean):
+    """
+    Reduce the rows of `X` in `n` groups given by `index` (a group for
+    each row; every group must be present). The known (not NaN) values
+    are merged with a grouped mean, median, min or max for the `spots_*`
+    functions and with `merge_function` applied to each group column
+    otherwise.
+    """
+    how = _spot_reductions.get(merge_function, merge_function)
+    if n == 0:
+        return numpy.zeros((0, X.shape[1]))
+    order = numpy.argsort(index, kind="mergesort")
+    X, index = X[order], index[order]
+    starts = numpy.flatnonzero(numpy.r_[True, index[1:] != index[:-1]])
+    if how == "mean":
+        known = ~numpy.isnan(X)
+        sums = numpy.add.reduceat(numpy.where(known, X, 0), starts, axis=0)
+        counts = numpy.add.reduceat(known, starts, axis=0, dtype=int)
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            return sums / counts
+    elif how == "min":
+        return numpy.fmin.reduceat(X, starts, axis=0)
+    elif how == "max":
+        return numpy.fmax.reduceat(X, starts, axis=0)
+
+    sizes = numpy.diff(numpy.r_[starts, len(X)])
+    out = numpy.empty((n, X.shape[1]))
+    if how == "median":
+        # Groups of the same size are reduced at once
+        for size in numpy.unique(sizes):
+            groups = numpy.flatnonzero(sizes == size)
+            if size == 1:
+                out[groups] = X[starts[groups]]
+                continue
+            block = X[starts[groups][:, None] + numpy.arange(size)]
+            with warnings.catch_warnings():
+                # All NaN groups
+                warnings.simplefilter("ignore", RuntimeWarning)
+                out[groups] = numpy.nanmedian(block, axis=1)
+    else:
+        for i, (start, size) in enumerate(zip(starts, sizes)):
+            out[i] = [merge_function(list(column))
+                      for column in X[start:start + size].T]
+    return out
+
+
+def _soft_table_chunk(rows, width, filename):
+    """
+    Convert the split `rows` of a SOFT data table into an array of ids
+    and a float array of values.
+    """
+    if any(len(row) != width for row in rows):
+        raise ValueError("%s: inconsistent number of columns in the data "
+                         "table" % filename)
+    cells = numpy.array(rows, dtype=object).reshape(-1, width)
+    values = cells[:, 2:]
+    values[(values == "null") | (values == "")] = "nan"
+    return cells[:, :2].astype(str), values.astype(float)
+
+
+def _read_soft_table(filename, chunk_size=2 ** 18):
+    """
+    Read the data table of a GDS SOFT file. Return an array of spot and
+    gene ids (a row for each spot) and a 2-D float array of values with
+    NaN for 'null'.
+
+    The rows are converted in chunks of about `chunk_size` cells, so
+    that only the id strings and the float values of the whole table
+    are kept in memory.
+    """
+    f = gzip.open(filename, "rb")
+    if six.PY3:
+        f = io.TextIOWrapper(f, encoding=SOFT_ENCODING)
+    ids, values = [], []
+    with closing(f):
+        for line in f:
+            if line.startswith("!dataset_table_begin"):
+                break
+        width = len(f.readline().rstrip("\r\n").split("\t"))
+        chunk_rows = max(1, chunk_size // width)
+        rows = []
+        for line in f:
+            if line.startswith("!dataset_table_end"):
+                break
+            line = line.rstrip("\r\n")
+            if not line:
+                continue
+            rows.append(line.split("\t"))
+            if len(rows) == chunk_rows:
+                chunk_ids, chunk_values = _soft_table_chunk(
+                    rows, width, filename)
+                ids.append(chunk_ids)
+                values.append(chunk_values)
+                rows = []
+        if rows or not ids:
+            chunk_ids, chunk_values = _soft_table_chunk(rows, width, filename)
+            ids.append(chunk_ids)
+            values.append(chunk_values)
+    return numpy.concatenate(ids), numpy.concatenate(values)
+
+
+def _table_rows(X):
+    """Return the array `X` as the rows for :func:`compat.create_table`."""
+    if compat.OR3:
+        return X
+    return [[v if v == v else compat.unknown for v in row]
+            for row in X.tolist()]
+
+
 p_assign = re.compile(" = (.*$)")
 p_tagvalue = re.compile("![a-z]*_([a-z_]*) = (.*)$")    
 tagvalue = lambda x: p_tagvalue.search(x).groups()
@@ -110,13 +228,6 @@ class GDSInfo:
     def __contains__(self, key): return key in self.info
     
 
-class GeneData:
-    """Store mapping between spot id and gene."""
-    def __init__(self, spot_id, gene_name, d):
-        self.spot_id = spot_id
-        self.gene_name = gene_name
-        self.data = d
-
 class GDS():
     """ 
     Retrieval of a specific GEO DataSet as a :obj:`Orange.data.Table`.
@@ -132,9 +243,13 @@ class GDS():
 
     :param force_download: Force the download.
 
+    :param info: Information on the data set (an item of :obj:`GDSInfo`)
+      used instead of parsing it from the data file.
+
     """
 
-    def __init__(self, gdsname, verbose=False, force_download=False):
+    def __init__(self, gdsname, verbose=False, force_download=False,
+                 info=None):
         self.gdsname = gdsname
         self.verbose = verbose
         self.force_download = force_download
@@ -142,9 +257,15 @@ class GDS():
         d = os.path.dirname(self.filename)
         if not os.path.exists(d):
             os.makedirs(d)
-        self._getinfo() # to get the info
-        taxid = taxonomy.search(self.info["sample_organism"], exact=True)
-        self.info["taxid"] = taxid[0] if len(taxid)==1 else None
+        self._table = None
+        if info is not None:
+            self._download()
+            self.info = dict(info)
+        else:
+            self._getinfo() # to get the info
+        if "taxid" not in self.info:
+            taxid = taxonomy.search(self.info["sample_organism"], exact=True)
+            self.info["taxid"] = taxid[0] if len(taxid)==1 else None
         self._getspotmap() # to get gene->spot and spot->gene mapping
         self.genes = sorted(self.gene2spots.keys())        
         self.spots = sorted(self.spot2gene.keys())        
@@ -224,25 +345,48 @@ class GDS():
                 state = "header"
         self.info = info
 
+    def _table_filenames(self):
+        """Return the cache file names for the parsed data table."""
+        base = self.filename[:-len(".soft.gz")]
+        return base + ".ids.npy", base + ".npy"
+
+    def _load_table(self):
+        """
+        Return the spot and gene ids and the values of the data table
+        (cached as .npy files next to the downloaded file).
+        """
+        if self._table is not None:
+            return self._table
+        filenames = self._table_filenames()
+        mtime = os.path.getmtime(self.filename)
+        table = None
+        if all(os.path.exists(fn) and os.path.getmtime(fn) >= mtime
+               for fn in filenames):
+            try:
+                table = tuple(numpy.load(fn) for fn in filenames)
+            except (IOError, ValueError):
+                table = None
+        if table is None:
+            table = _read_soft_table(self.filename)
+            for fn, array in zip(filenames, table):
+                with open(fn + ".tmp", "wb") as f:
+                    numpy.save(f, array)
+                if os.path.exists(fn):
+                    os.remove(fn)
+                os.rename(fn + ".tmp", fn)
+        self._table = table
+        return table
+
     def _getspotmap(self, include_spots=None):
         """Return gene to spot and spot to genes mapings."""
-        f = gzip.open(self.filename, "rb")
-        if six.PY3:
-            f = io.TextIOWrapper(f, encoding=SOFT_ENCODING)
-        for line in f:
-            if line.startswith("!dataset_table_begin"):
-                break
-        f.readline() # skip header
+        ids, _ = self._load_table()
         spot2gene = {}
         gene2spots = {}
-        for line in f:
-            if line.startswith("!dataset_table_end"):
-                break
-            spot, gene = line.rstrip().split("\t")[0:2]
+        for spot, gene in ids.tolist():
             if include_spots and (spot not in include_spots):
                 continue 
             spot2gene[spot] = gene
-            gene2spots[gene] = gene2spots.get(gene, []) + [spot]
+            gene2spots.setdefault(gene, []).append(spot)
     
         self.spot2gene = spot2gene
         self.gene2spots = gene2spots
@@ -268,34 +412,31 @@ class GDS():
         return set([info["type"] for info in self.info["subsets"]])
     
     def _parse_soft(self, remove_unknown=None):
-        """Parse GDS data, returns data dictionary."""
-        f = gzip.open(self.filename, "rb")
-        if six.PY3:
-            f = io.TextIOWrapper(f, encoding=SOFT_ENCODING)
-
-        mfloat = lambda x: float(x) if x != 'null' else compat.unknown
-    
-        data = {}
-        # find the start of the data part
-        for line in f:
-            if line.startswith("!dataset_table_begin"):
-                break
-        f.readline()
-        
-        # load data
-        for line in f:
-            if line.startswith("!dataset_table_end"):
-                break
-            d = line.rstrip().split("\t")
-            if remove_unknown and (float(d[2:].count('null')) / len(d[2:]) > remove_unknown):
-#                print "ZZZ", float(d[2:].count('null')) / len(d[2:]), d[2:]
-                continue 
-            data[d[0]] = GeneData(d[0], d[1], [mfloat(v) for v in d[2:]])
-        self.gdsdata = data
+        """Parse GDS data, store (spot and gene ids, values) arrays."""
+        ids, X = self._load_table()
+        if remove_unknown:
+            keep = numpy.isnan(X).mean(axis=1) <= remove_unknown
+            ids, X = ids[keep], X[keep]
+        self.gdsdata = ids, X
     
     def _to_ExampleTable(self, report_genes=True, merge_function=spots_mean,
-                                sample_type=None, transpose=False):
+                                sample_type=None, transpose=False, genes=None):
         """Convert parsed GEO format to orange, save by genes or by spots."""
+        ids, X = self.gdsdata
+        if report_genes:
+            names, index = numpy.unique(ids[:, 1], return_inverse=True)
+            X = _group_reduce(X, index.ravel(), len(names), merge_function)
+        else:
+            names, first = numpy.unique(ids[:, 0], return_index=True)
+            X = X[first]
+        names = names.tolist()
+        if genes is not None:
+            # Reorder (missing genes select the last all unknown row)
+            index = dict((name, i) for i, name in enumerate(names))
+            X = numpy.vstack([X, numpy.full((1, X.shape[1]), numpy.nan)])
+            X = X[[index.get(gene, -1) for gene in genes]]
+            names = list(genes)
+
         if transpose: # samples in rows
             sample2class = self.sample_to_class(sample_type)
             cvalues = sorted(set(sample2class.values()))
@@ -314,25 +455,19 @@ class GDS():
                 sample_type = list(ad.keys())[0]
 
             classvar = DiscreteVariable(name=sample_type or "class", values=cvalues)
-            spots = self.genes if report_genes else self.spots
-            atts = [ContinuousVariable(name=gene) for gene in spots]
+            atts = [ContinuousVariable(name=gene) for gene in names]
     
             metasvar = [ DiscreteVariable(name=n, values=sorted(values)) 
                 for n,values in ad.items() if n != sample_type ]
 
-            X = []
             Y = []
             metas = []
-            for (i, sampleid) in enumerate(self.info["samples"]):
-                vals = [ ( (merge_function([self.gdsdata[spot].data[i] for spot in self.gene2spots[gene]]) )
-                         if report_genes else self.gdsdata[gene].data[i] ) 
-                         for gene in spots ]
-                X.append(vals)
+            for sampleid in self.info["samples"]:
                 Y.append(sample2class.get(sampleid, None))
                 metas.append([samp_ann[sampleid].get(n, None) for n,_ in ad.items() if n != sample_type ])
 
             domain = compat.create_domain(atts, classvar, metasvar)
-            return compat.create_table(domain, X, Y, metas)
+            return compat.create_table(domain, _table_rows(X.T), Y, metas)
 
         else: # genes in rows
             annotations = self.sample_annotations(sample_type)
@@ -342,22 +477,13 @@ class GDS():
 
             geneatname = "gene" if report_genes else "spot"
             metasvar = [ StringVariable(geneatname) ]
-            nameval = self.genes if report_genes else self.spots
-
-            X = []
-            metas = []
-            for g in nameval:
-                if report_genes:
-                    X.append(list(map(lambda *x: merge_function(x),
-                        *[self.gdsdata[spot].data for spot in self.gene2spots[g]])))
-                else:
-                    X.append(self.gdsdata[g].data)
-            metas = [ [a] for a in nameval]
+            metas = [ [a] for a in names]
             domain = compat.create_domain(atts, None, metasvar)
-            return compat.create_table(domain, X, None, metas)
+            return compat.create_table(domain, _table_rows(X), None, metas)
 
     def getdata(self, report_genes=True, merge_function=spots_mean,
-                 sample_type=None, transpose=False, remove_unknown=None):
+                 sample_type=None, transpose=False, remove_unknown=None,
+                 genes=None):
         """
         Returns the GEO DataSet as an :obj:`Orange.data.Table`.
 
@@ -381,17 +507,20 @@ class GDS():
           include unknown values. They are removed if the proportion
           of samples with unknown values is above the threshold set by
           ``remove_unknown``. If None, nothing is removed.
+
+        :param genes: Report these genes (or spots) in this order;
+          the values of genes not in the data set are unknown.
         """
         if self.verbose: print("Reading data ...")
 #        if not self.gdsdata:
         self._parse_soft(remove_unknown = remove_unknown)
 #        if remove_unknown:
             # some spots were filtered out, need to revise spot<>gene mappings
-        self._getspotmap(include_spots=set(self.gdsdata.keys()))
+        self._getspotmap(include_spots=set(self.gdsdata[0][:, 0].tolist()))
         if self.verbose: print("Converting to example table ...")
         self.data = self._to_ExampleTable(merge_function=merge_function,
                                           sample_type=sample_type, transpose=transpose,
-                                          report_genes=report_genes)
+                                          report_genes=report_genes, genes=genes)
         return self.data
 
     def __str__(self):
@@ -405,6 +534,74 @@ class GDS():
                )
 
 
+def load_many(gds_ids, workers=4, progress_callback=None, gds_info=None,
+              merge_function=spots_mean, sample_type=None, transpose=False,
+              remove_unknown=None, join="outer", force_download=False):
+    """
+    Download and parse several GEO DataSets concurrently and return
+    a tuple of the common gene list and a list of :obj:`Orange.data.Table`
+    (one for each id in `gds_ids`) with the genes in the same order
+    (unknown values for genes missing from a data set), ready to stack.
+
+    :param workers: The number of concurrent downloads/parses.
+
+    :param progress_callback: Called with the data set id and the
+      overall progress (in percents) when each data set is loaded.
+
+    :param gds_info: Information on the data sets (:obj:`GDSInfo`
+      by default), used instead of parsing it from the data files.
+
+    :param join: Use the union ("outer") or the intersection ("inner")
+      of the data sets' genes.
+
+    The other parameters are as in :func:`GDS.getdata`.
+    """
+    if join not in ("outer", "inner"):
+        raise ValueError("join must be 'outer' or 'inner'")
+    from multiprocessing.pool import ThreadPool
+
+    if gds_info is None:
+        gds_info = GDSInfo()
+    gds_ids = list(gds_ids)
+    unique_ids = list(OrderedDict.fromkeys(gds_ids))
+
+    path = serverfiles.localpath(DOMAIN)
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    def load(gds_id):
+        gds = GDS(gds_id, force_download=force_download,
+                  info=gds_info[gds_id] if gds_id in gds_info else None)
+        gds._parse_soft(remove_unknown=remove_unknown)
+        return gds
+
+    loaded = {}
+    with closing(ThreadPool(max(min(workers, len(unique_ids)), 1))) as pool:
+        for gds in pool.imap_unordered(load, unique_ids):
+            loaded[gds.gdsname] = gds
+            if progress_callback is not None:
+                progress_callback(gds.gdsname,
+                                  100.0 * len(loaded) / len(unique_ids))
+
+        gene_sets = [set(loaded[gds_id].gdsdata[0][:, 1].tolist())
+                     for gds_id in unique_ids]
+        if not gene_sets:
+            genes = []
+        elif join == "outer":
+            genes = sorted(set.union(*gene_sets))
+        else:
+            genes = sorted(set.intersection(*gene_sets))
+
+        tables = pool.map(
+            lambda gds_id: loaded[gds_id].getdata(
+                merge_function=merge_function, sample_type=sample_type,
+                transpose=transpose, remove_unknown=remove_unknown,
+                genes=genes),
+            unique_ids)
+    tables = dict(zip(unique_ids, tables))
+    return genes, [tables[gds_id] for gds_id in gds_ids]
+
+
 def _float_or_na(x):
     if compat.isunknown(x):
         return compat.unknown
@@ -11,6 +11,7 @@ import tarfile
 import gzip
 import re
 import sys
+import gc
 import six
 
 try:
@@ -27,9 +28,18 @@ except ImportError:
     
 import warnings
 
+import numpy
+import scipy.sparse
+
 from gzip import GzipFile
 from collections import defaultdict
 from operator import attrgetter
+from contextlib import contextmanager
+
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError:
+    from collections import Mapping, MutableMapping
 
 from orangecontrib.bio.utils import progress_bar_milestones
 
@@ -47,8 +57,10 @@ except NameError:
 
 from orangecontrib.bio.utils import serverfiles
 from orangecontrib.bio.utils import stats
+from orangecontrib.bio.utils import arraycache
 
 from orangecontrib.bio import gene as obiGene, taxonomy as obiTaxonomy
+from orangecontrib.bio import ontology as obiOntology
 
 default_database_path = os.path.join(serverfiles.localpath(), "GO")
 
@@ -189,22 +201,19 @@ class OBOObject(object):
             self.parse_stanza(stanza)
 
     def parse_stanza(self, stanza):
+        self.add_lines(
+            [obiOntology.parse_tag_value(line) for line in stanza.splitlines()
+             if ":" in line and not line.startswith("!")])
+
+    def add_lines(self, lines):
+        """Add a list of parsed (tag, value, modifiers, comment) tuples
+        (see :func:`orangecontrib.bio.ontology.parse_tag_value`).
+
+        """
         intern_tags = set(self._INTERN_TAGS)
-        for line in stanza.splitlines():
-            if ":" not in line:
-                continue
-            tag, rest = line.split(":", 1)
-            value, modifiers, comment = "", "", ""
-            if "!" in rest:
-                rest, comment = rest.split("!")
-            if "{" in rest:
-                value, modifiers = rest.split("{", 1)
-                modifiers = modifiers.strip("}")
-            else:
-                value = rest
+        for tag, value, modifiers, comment in lines:
             tag = intern(tag)
-            value = value.strip()
-            comment = comment.strip()
+            modifiers, comment = modifiers or "", comment or ""
             if tag in intern_tags:
                 value, comment = intern(value), intern(comment)
             self._lines.append((tag, value, modifiers, comment))
@@ -267,6 +276,343 @@ class Instance(OBOObject):
     pass
 
 
+class _OntologyIndex(object):
+    """
+    Integer term ids and the transitive closure of the ontology's
+    relations (all relationship types, as followed by
+    :func:`Ontology.extract_super_graph`).
+
+    Parents, ancestors and descendants are stored as sparse boolean
+    (CSR) matrices, so the queries are simple row lookups.
+
+    """
+    #: Arrays stored in a compiled ontology cache.
+    ARRAYS = ["stanzas", "depth", "order", "cyclic"]
+    MATRICES = ["parents", "ancestors", "descendants"]
+
+    def __init__(self, terms, parents):
+        """
+        :param list terms: A sorted list of term ids.
+        :param list parents: A list of parent term indices for each term.
+
+        """
+        self.terms = terms
+        self.term_index = dict((t, i) for i, t in enumerate(self.terms))
+        #: Indices of the term stanzas in a compiled ontology (if any).
+        self.stanzas = None
+        n = len(self.terms)
+
+        parents = [sorted(set(pars)) for pars in parents]
+        children = [[] for _ in range(n)]
+        for i, pars in enumerate(parents):
+            for p in pars:
+                children[p].append(i)
+
+        # Topological order (parents before their children).
+        indegree = [len(pars) for pars in parents]
+        order = [i for i in range(n) if not indegree[i]]
+        for i in order:
+            for c in children[i]:
+                indegree[c] -= 1
+                if not indegree[c]:
+                    order.append(c)
+
+        ancestors = [None] * n
+        for i in order:
+            anc = set(parents[i])
+            for p in parents[i]:
+                anc.update(ancestors[p])
+            ancestors[i] = anc
+
+        # Terms on a cycle (if any) are not in `order`.
+        self.cyclic = [i for i in range(n) if ancestors[i] is None]
+        for i in self.cyclic:
+            anc, queue = set(), list(parents[i])
+            while queue:
+                p = queue.pop()
+                if p not in anc:
+                    anc.add(p)
+                    queue.extend(parents[p])
+            ancestors[i] = anc
+        self.order = order
+
+        self.parents = _bool_csr(parents, n)
+        self.ancestors = _bool_csr(ancestors, n)
+        self.descendants = self.ancestors.T.tocsr()
+
+        # Minimum depth (the top level terms have depth 1).
+        depth = numpy.zeros(n, dtype=numpy.int32)
+        level = [i for i in range(n) if not parents[i]]
+        d = 1
+        while level:
+            depth[level] = d
+            level = set(c for i in level for c in children[i]
+                        if not depth[c])
+            level = list(level)
+            d += 1
+        self.depth = depth
+
+    @classmethod
+    def from_terms(cls, terms):
+        """
+        Build the index from a dictionary of :class:`Term` instances.
+        Relations to terms not in the dictionary are ignored (as in
+        :func:`from_compiled`).
+        """
+        ids = sorted(terms)
+        term_index = dict((t, i) for i, t in enumerate(ids))
+        return cls(ids, [[term_index[p] for _, p in terms[t].related
+                          if p in term_index]
+                         for t in ids])
+
+    @classmethod
+    def from_compiled(cls, compiled):
+        """
+        Build the index from the relation arrays of a compiled ontology
+        (without materializing any :class:`Term` instances).
+        """
+        stanzas, codes = _term_stanzas(compiled)
+        table = compiled.table()
+        ids = [table[c] for c in codes.tolist()]
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+        ids = [ids[i] for i in order]
+        stanzas, codes = stanzas[order], codes[order]
+        n = len(ids)
+
+        stanza_index = numpy.full(len(compiled), -1, dtype=numpy.int64)
+        stanza_index[stanzas] = numpy.arange(n)
+        code_index = numpy.full(len(compiled.arrays["offsets"]), -1,
+                                dtype=numpy.int64)
+        code_index[codes] = numpy.arange(n)
+
+        source, _, target = compiled.arrays["relations"]
+        source, target = stanza_index[source], code_index[target]
+        mask = (source >= 0) & (target >= 0)
+        parents = [[] for _ in range(n)]
+        for i, p in zip(source[mask].tolist(), target[mask].tolist()):
+            parents[i].append(p)
+
+        index = cls(ids, parents)
+        index.stanzas = stanzas
+        return index
+
+    def to_arrays(self):
+        """
+        Return the index as a dictionary of arrays for a compiled ontology
+        cache.
+        """
+        arrays = dict(("index_" + name,
+                       numpy.asarray(getattr(self, name), dtype=numpy.int64))
+                      for name in self.ARRAYS)
+        for name in self.MATRICES:
+            matrix = getattr(self, name)
+            arrays["index_%s_indptr" % name] = matrix.indptr
+            arrays["index_%s_indices" % name] = matrix.indices
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, compiled):
+        """
+        Restore the index stored in a compiled ontology (return `None` if
+        there is none).
+        """
+        arrays = compiled.arrays
+        if "index_stanzas" not in arrays:
+            return None
+        index = cls.__new__(cls)
+        index.stanzas = numpy.asarray(arrays["index_stanzas"])
+        table = compiled.table()
+        index.terms = [table[c] for c in
+                       compiled.arrays["stanza_id"][index.stanzas].tolist()]
+        index.term_index = dict((t, i) for i, t in enumerate(index.terms))
+        index.depth = numpy.asarray(arrays["index_depth"], dtype=numpy.int32)
+        index.order = arrays["index_order"].tolist()
+        index.cyclic = arrays["index_cyclic"].tolist()
+        n = len(index.terms)
+        for name in cls.MATRICES:
+            indices = arrays["index_%s_indices" % name]
+            setattr(index, name, scipy.sparse.csr_matrix(
+                (numpy.ones(len(indices), dtype=bool), indices,
+                 arrays["index_%s_indptr" % name]), shape=(n, n)))
+        return index
+
+    def rows(self, matrix, ids):
+        """
+        Return the (unique) column indices of `matrix` rows `ids`.
+        """
+        indptr, indices = matrix.indptr, matrix.indices
+        if len(ids) == 1:
+            [i] = ids
+            return indices[indptr[i]: indptr[i + 1]].tolist()
+        else:
+            return numpy.unique(matrix[ids].indices).tolist()
+
+    def slims_map(self, slims):
+        """
+        Return a list with the (most specific) slim terms for each term.
+
+        :param set slims: A set of term indices.
+
+        """
+        indptr, indices = self.parents.indptr, self.parents.indices
+        result = [None] * len(self.terms)
+        for i in self.order:
+            if i in slims:
+                result[i] = frozenset([i])
+            else:
+                result[i] = frozenset().union(
+                    *[result[p] for p in indices[indptr[i]: indptr[i + 1]]])
+
+        for i in self.cyclic:
+            queue, visited, found = [i], set(), set()
+            while queue:
+                j = queue.pop()
+                visited.add(j)
+                if j in slims:
+                    found.add(j)
+                elif result[j] is not None:
+                    found.update(result[j])
+                else:
+                    queue.extend(p for p in indices[indptr[j]: indptr[j + 1]]
+                                 if p not in visited)
+            result[i] = frozenset(found)
+        return result
+
+
+def _term_stanzas(compiled):
+    """
+    Return the (stanza indices, id codes) of terms in a compiled ontology.
+    A later stanza with the same id replaces an earlier one.
+    """
+    stanzas = compiled.stanzas("Term")
+    codes = compiled.arrays["stanza_id"][stanzas]
+    mask = codes >= 0
+    stanzas, codes = stanzas[mask], codes[mask]
+    # The last occurrence of each id
+    _, last = numpy.unique(codes[::-1], return_index=True)
+    last = numpy.sort(len(codes) - 1 - last)
+    return stanzas[last], codes[last]
+
+
+def _open_ontology(filename):
+    """
+    Open an .obo file (`filename` can also be a directory or a tar
+    archive containing a 'gene_ontology_edit.obo' file).
+    """
+    if os.path.isfile(filename) and tarfile.is_tarfile(filename):
+        with tarfile.open(filename) as tar:
+            member = tar.extractfile("gene_ontology_edit.obo")
+            return six.BytesIO(member.read())
+    elif os.path.isfile(filename):
+        return open(filename, "rb")
+    elif os.path.isdir(filename):
+        return open(os.path.join(filename, "gene_ontology_edit.obo"), "rb")
+    else:
+        raise ValueError("Cannot open %r for parsing" % filename)
+
+
+def _compiled_ontology(filename, progress_callback=None):
+    """
+    Return the compiled ontology `filename` from (or saved to) a cache
+    next to it. The cache includes the ontology's :class:`_OntologyIndex`.
+    """
+    def index_arrays(compiled):
+        return _OntologyIndex.from_compiled(compiled).to_arrays()
+    return obiOntology._CompiledOBO.cached(
+        filename, opener=_open_ontology, progress_callback=progress_callback,
+        extra=index_arrays)
+
+
+def _bool_csr(rows, n):
+    """
+    Return a (n, n) boolean CSR matrix with `rows` (lists of column
+    indices) as nonzero entries.
+    """
+    indptr = numpy.zeros(n + 1, dtype=numpy.int64)
+    indptr[1:] = numpy.cumsum([len(r) for r in rows])
+    indices = numpy.fromiter((j for r in rows for j in sorted(r)),
+                             dtype=numpy.int32, count=int(indptr[-1]))
+    return scipy.sparse.csr_matrix(
+        (numpy.ones(len(indices), dtype=bool), indices, indptr),
+        shape=(n, n))
+
+
+class _CompiledTerms(MutableMapping):
+    """
+    A term id -> :class:`Term` mapping backed by a compiled ontology
+    (:class:`orangecontrib.bio.ontology._CompiledOBO`). The :class:`Term`
+    instances are only created when first accessed.
+
+    """
+    def __init__(self, ontology, compiled):
+        self.ontology = ontology
+        self.compiled = compiled
+        stanzas, codes = _term_stanzas(compiled)
+        table = compiled.table()
+        self._stanzas = dict(zip([table[c] for c in codes.tolist()],
+                                 stanzas.tolist()))
+        self._terms = {}
+        self._children = None
+        #: Were terms added or removed (the compiled relations are stale)
+        self.modified = False
+
+    def _invalidate(self):
+        self.modified = True
+        self.ontology._index = None
+        self.ontology._slims_map = None
+
+    def __getitem__(self, id):
+        try:
+            return self._terms[id]
+        except KeyError:
+            term = self._terms[id] = self._term(self._stanzas[id])
+            return term
+
+    def __setitem__(self, id, term):
+        self._stanzas.setdefault(id, None)
+        self._terms[id] = term
+        self._invalidate()
+
+    def __delitem__(self, id):
+        del self._stanzas[id]
+        self._terms.pop(id, None)
+        self._invalidate()
+
+    def __iter__(self):
+        return iter(self._stanzas)
+
+    def __len__(self):
+        return len(self._stanzas)
+
+    def __contains__(self, id):
+        return id in self._stanzas
+
+    def _term(self, stanza):
+        compiled = self.compiled
+        term = Term(ontology=self.ontology)
+        term.add_lines(compiled.stanza_lines(stanza))
+
+        if self._children is None:
+            source, rel_type, target = compiled.arrays["relations"]
+            terms = numpy.array([i for i in self._stanzas.values()
+                                 if i is not None], dtype=int)
+            mask = numpy.isin(source, terms)
+            source, rel_type, target = \
+                source[mask], rel_type[mask], target[mask]
+            order = numpy.argsort(target, kind="mergesort")
+            self._children = target[order], rel_type[order], source[order]
+
+        target, rel_type, source = self._children
+        code = compiled.arrays["stanza_id"][stanza]
+        start, end = numpy.searchsorted(target, [code, code + 1])
+        stanza_id, string = compiled.arrays["stanza_id"], compiled.string
+        term.related_to = set(
+            (intern(string(t)), string(stanza_id[s]))
+            for t, s in zip(rel_type[start:end].tolist(),
+                            source[start:end].tolist()))
+        return term
+
+
 class Ontology(object):
     """
     :class:`Ontology` is the class representing a gene ontology.
@@ -297,8 +643,12 @@ class Ontology(object):
         self.alias_mapper = {}
         self.reverse_alias_mapper = defaultdict(set)
         self.header = ""
+        self._index = None
+        self._slims_map = None
 
-        if filename is not None:
+        if isinstance(filename, obiOntology._CompiledOBO):
+            self._set_compiled(filename)
+        elif filename is not None:
             self.parse_file(filename, progress_callback)
         elif rev is not None:
             if not _CVS_REVISION_RE.match(rev):
@@ -311,14 +661,15 @@ class Ontology(object):
                                     "gene_ontology_edit@rev%s.obo" % rev)
             if not os.path.exists(filename):
                 self.download_ontology_at_rev(rev, filename, pc)
-            self.parse_file(filename,
-                            lambda v: progress_callback(v / 2.0 + 50)
-                            if progress_callback else None)
+            self._set_compiled(_compiled_ontology(
+                filename, lambda v: progress_callback(v / 2.0 + 50)
+                if progress_callback else None))
         else:
             filename = serverfiles.localpath_download(
                 "GO", "gene_ontology_edit.obo.tar.gz"
             )
-            self.parse_file(filename, progress_callback)
+            self._set_compiled(
+                _compiled_ontology(filename, progress_callback))
 
     @classmethod
     def load(cls, progress_callback=None):
@@ -326,13 +677,16 @@ class Ontology(object):
         default_database_path. It looks for a filename starting with
         'gene_ontology'. If not found it will download it.
 
+        The ontology is loaded from a compiled cache next to the file
+        (which is created on first use).
+
         """
         filename = os.path.join(default_database_path,
                                 "gene_ontology_edit.obo.tar.gz")
         if not os.path.isfile(filename) and not os.path.isdir(filename):
             serverfiles.download("GO", "gene_ontology_edit.obo.tar.gz")
 
-        return cls(filename, progress_callback=progress_callback)
+        return cls(_compiled_ontology(filename, progress_callback))
 
     Load = load
 
@@ -342,51 +696,63 @@ class Ontology(object):
         argument to report on the progress.
         """
         if isinstance(file, basestring):
-            if os.path.isfile(file) and tarfile.is_tarfile(file):
-                f = tarfile.open(file).extractfile("gene_ontology_edit.obo")
-            elif os.path.isfile(file):
-                f = open(file)
-            elif os.path.isdir(file):
-                f = open(os.path.join(file, "gene_ontology_edit.obo"))
-            else:
-                raise ValueError("Cannot open %r for parsing" % file)
+            f = _open_ontology(file)
+            try:
+                compiled = obiOntology._CompiledOBO.parse(f, progress_callback)
+            finally:
+                f.close()
         else:
-            f = file
-
-        data = f.readlines()
-        data = "".join([line for line in data if not line.startswith("!")])
-        self.header = data[: data.index("[Term]")]
-        c = re.compile("\[.+?\].*?\n\n", re.DOTALL)
-        data = c.findall(data)
-
-        milestones = progress_bar_milestones(len(data), 90)
-        for i, block in enumerate(builtinOBOObjects + data):
-            if block.startswith("[Term]"):
-                term = Term(block, self)
-                self.terms[term.id] = term
-            elif block.startswith("[Typedef]"):
-                typedef = Typedef(block, self)
-                self.typedefs[typedef.id] = typedef
-            elif block.startswith("[Instance]"):
-                instance = Instance(block, self)
-                self.instances[instance.id] = instance
-            if progress_callback and i in milestones:
-                progress_callback(90.0 * i / len(data))
+            compiled = obiOntology._CompiledOBO.parse(file, progress_callback)
+        self._set_compiled(compiled)
 
-        self.alias_mapper = {}
+    def _set_compiled(self, compiled):
+        """
+        Set the ontology contents from a compiled ontology. The terms are
+        materialized lazily (see :class:`_CompiledTerms`).
+        """
+        self.header = compiled.header
+        self.typedefs = {}
+        self.instances = {}
+        for block in builtinOBOObjects:
+            typedef = Typedef(block, self)
+            self.typedefs[typedef.id] = typedef
+        for stanza_type, cls, objects in [("Typedef", Typedef, self.typedefs),
+                                          ("Instance", Instance,
+                                           self.instances)]:
+            for i in compiled.stanzas(stanza_type).tolist():
+                obj = cls(ontology=self)
+                obj.add_lines(compiled.stanza_lines(i))
+                objects[obj.id] = obj
+
+        self.terms = _CompiledTerms(self, compiled)
+        stanzas = list(self.terms._stanzas.values())
+        self.alias_mapper = dict(
+            (alt_id, compiled.stanza_id(i))
+            for i, alt_id in compiled.tag_values("alt_id", stanzas))
         self.reverse_alias_mapper = defaultdict(set)
-        milestones = progress_bar_milestones(len(self.terms), 10)
-        for i, (id, term) in enumerate(six.iteritems(self.terms)):
-            for typeId, parent in term.related:
-                self.terms[parent].related_to.add((typeId, id))
-            try:
-                self.alias_mapper.update([(alt_id, id)
-                                          for alt_id in term.alt_id])
-                self.reverse_alias_mapper[id].union_update(term.alt_id)
-            except AttributeError:
-                pass
-            if progress_callback and i in milestones:
-                progress_callback(90.0 + 10.0 * i / len(self.terms))
+        self._index = _OntologyIndex.from_arrays(compiled)
+        self._slims_map = None
+
+    def _get_index(self):
+        if self._index is None:
+            if isinstance(self.terms, _CompiledTerms) and \
+                    not self.terms.modified:
+                self._index = _OntologyIndex.from_compiled(
+                    self.terms.compiled)
+            else:
+                self._index = _OntologyIndex.from_terms(self.terms)
+        return self._index
+
+    def _term_ids(self, terms):
+        """
+        Return the integer ids (in the :class:`_OntologyIndex`) of `terms`.
+        """
+        index = self._get_index()
+        try:
+            return [index.term_index[self.alias_mapper.get(t, t)]
+                    for t in terms]
+        except KeyError as err:
+            raise KeyError(err.args[0])
 
     def defined_slims_subsets(self):
         """
@@ -435,18 +801,26 @@ class Ontology(object):
         :param str term: Term ID.
 
         """
-        queue = set([term])
-        visited = set()
-        slims = set()
-        while queue:
-            term = queue.pop()
-            visited.add(term)
-            if term in self.slims_subset:
-                slims.add(term)
-            else:
-                queue.update(set(tid for _, tid in self[term].related) -
-                             visited)
-        return slims
+        if term in self.slims_subset:
+            return set([term])
+        index = self._get_index()
+        slims = frozenset(self.slims_subset)
+        if self._slims_map is None or self._slims_map[0] != slims:
+            ids = set(index.term_index[t] for t in slims
+                      if t in index.term_index)
+            self._slims_map = (slims, index.slims_map(ids))
+        slims_map = self._slims_map[1]
+        [i] = self._term_ids([term])
+        if term in index.term_index:
+            ids = slims_map[i]
+        else:
+            # An alternative id; start from the parents of the primary term
+            # (the primary term itself is not visited).
+            parents = index.parents
+            ids = set().union(
+                *[slims_map[p] for p in
+                  parents.indices[parents.indptr[i]: parents.indptr[i + 1]]])
+        return set(index.terms[j] for j in ids)
 
     def extract_super_graph(self, terms):
         """
@@ -456,13 +830,12 @@ class Ontology(object):
 
         """
         terms = [terms] if isinstance(terms, basestring) else terms
-        visited = set()
-        queue = set(terms)
-        while queue:
-            term = queue.pop()
-            visited.add(term)
-            queue.update(set(tid for _, tid in self[term].related) -
-                         visited)
+        visited = set(terms)
+        if visited:
+            index = self._get_index()
+            ids = index.rows(index.ancestors, self._term_ids(visited))
+            terms = index.terms
+            visited.update([terms[i] for i in ids])
         return visited
 
     def extract_sub_graph(self, terms):
@@ -473,27 +846,23 @@ class Ontology(object):
 
         """
         terms = [terms] if type(terms) == str else terms
-        visited = set()
-        queue = set(terms)
-        while queue:
-            term = queue.pop()
-            visited.add(term)
-            queue.update(set(tid for _, tid in self[term].related_to) -
-                         visited)
+        visited = set(terms)
+        if visited:
+            index = self._get_index()
+            ids = index.rows(index.descendants, self._term_ids(visited))
+            terms = index.terms
+            visited.update([terms[i] for i in ids])
         return visited
 
-    def term_depth(self, term, cache_={}):
+    def term_depth(self, term):
         """
         Return the minimum depth of a `term`.
 
         (length of the shortest path to this term from the top level term).
 
         """
-        if term not in cache_:
-            cache_[term] = min([self.term_depth(parent) + 1
-                                for _, parent in self[term].related] or
-                               [1])
-        return cache_[term]
+        [i] = self._term_ids([term])
+        return int(self._get_index().depth[i])
 
     def __getitem__(self, termid):
         """
@@ -620,6 +989,280 @@ class AnnotationRecord(_AnnotationRecordBase):
         return list(map(intern, self.DB_Object_Synonym.split("|")))
 
 
+class _AnnotationColumns(object):
+    """
+    Annotation records stored column-wise. Each field is coded with
+    integer indices into a (sorted) table of its distinct string values.
+
+    :param list fields: Names of the stored fields.
+    :param list tables: A list of string tables (one for each field).
+    :param numpy.ndarray codes:
+        A (len(fields), N) integer array of codes into `tables`.
+    :param str header: The annotation file header.
+
+    """
+    #: Version of the on disk (cache) format.
+    version = 1
+
+    def __init__(self, fields, tables, codes, header=""):
+        self.fields = list(fields)
+        self.tables = tables
+        self.codes = codes
+        self.header = header
+        self._object_tables = None
+
+    @classmethod
+    def from_records(cls, records, fields=annotationFields, header=""):
+        """
+        Encode a list of :class:`AnnotationRecord` instances.
+        """
+        codes = numpy.zeros((len(fields), len(records)), dtype=numpy.int32)
+        tables = []
+        for j, field in enumerate(fields):
+            getter = attrgetter(field)
+            table = sorted(set(map(getter, records)))
+            index = dict((value, i) for i, value in enumerate(table))
+            codes[j] = numpy.fromiter(
+                (index[getter(rec)] for rec in records),
+                dtype=numpy.int32, count=len(records))
+            tables.append(table)
+        return cls(fields, tables, codes, header)
+
+    def __len__(self):
+        return self.codes.shape[1]
+
+    def column(self, field):
+        """
+        Return a (table, codes) tuple for `field`.
+        """
+        j = self.fields.index(field)
+        return self.tables[j], self.codes[j]
+
+    def records(self, rows=None):
+        """
+        Return a list of :class:`AnnotationRecord` instances (for all or
+        only the selected `rows`).
+        """
+        assert self.fields == annotationFields
+        if self._object_tables is None:
+            self._object_tables = [numpy.array(table, dtype=object)
+                                   for table in self.tables]
+        codes = self.codes if rows is None else self.codes[:, rows]
+        columns = [table[codes[j]].tolist()
+                   for j, table in enumerate(self._object_tables)]
+        with _gc_disabled():
+            return list(map(AnnotationRecord._make, zip(*columns)))
+
+    @classmethod
+    def load_cache(cls, filename):
+        """
+        Load the compiled cache for the annotations `filename`. Return
+        `None` if the cache does not exist or is out of date.
+        """
+        cached = arraycache.load(arraycache.cache_path(filename),
+                                 version=cls.version,
+                                 revision=arraycache.file_revision(filename))
+        if cached is None:
+            return None
+        meta, arrays = cached
+        codes = arrays["codes"]
+        if codes.shape != (len(meta["fields"]), meta["count"]):
+            return None
+        return cls(meta["fields"], meta["tables"], codes, meta["header"])
+
+    def save_cache(self, filename):
+        """
+        Save the columns as a compiled cache for the annotations
+        `filename`.
+        """
+        meta = {"version": self.version,
+                "revision": arraycache.file_revision(filename),
+                "fields": self.fields,
+                "tables": self.tables,
+                "count": len(self),
+                "header": self.header}
+        arraycache.save(arraycache.cache_path(filename), meta,
+                        {"codes": self.codes})
+
+
+class _AnnotationGroups(Mapping):
+    """
+    A read only mapping of the distinct values of an annotation `field`
+    to lists of :class:`AnnotationRecord` instances, backed by
+    :class:`_AnnotationColumns`. The records of a group are only created
+    when it is first accessed. As with a ``defaultdict(list)`` a missing
+    key maps to an empty list.
+
+    """
+    def __init__(self, columns, field):
+        self._columns = columns
+        table, codes = columns.column(field)
+        self._table = table
+        self._index = dict((value, i) for i, value in enumerate(table))
+        # Rows grouped by the field's code
+        self._order = numpy.argsort(codes, kind="mergesort")
+        self._bounds = numpy.searchsorted(codes[self._order],
+                                          numpy.arange(len(table) + 1))
+        self._groups = {}
+
+    def __getitem__(self, key):
+        if key not in self._groups:
+            i = self._index.get(key)
+            if i is None:
+                return []
+            start, end = self._bounds[i: i + 2]
+            self._groups[key] = self._columns.records(self._order[start:end])
+        return self._groups[key]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def get(self, key, default=None):
+        return self[key] if key in self._index else default
+
+    def __iter__(self):
+        return iter(self._table)
+
+    def __len__(self):
+        return len(self._table)
+
+
+@contextmanager
+def _gc_disabled():
+    """
+    Disable the cyclic garbage collector while creating large numbers of
+    (acyclic) objects.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class _EnrichmentIndex(object):
+    """
+    A gene x term incidence index used by
+    :func:`Annotations.get_enriched_terms`.
+
+    Annotations are stored as integer coded columns (gene, term, evidence
+    and aspect). For each evidence code/aspect filter a sparse gene x term
+    incidence matrix is built (and cached) which already includes the
+    propagation of annotations to all super terms, so the term counts
+    for a set of genes are computed with a single sparse matrix-vector
+    product.
+
+    """
+    #: Annotation fields used by the index.
+    FIELDS = ["DB_Object_Symbol", "GO_ID", "Evidence_Code", "Aspect"]
+
+    def __init__(self, columns, ontology):
+        self.ontology = ontology
+
+        self.genes, self.ann_gene = columns.column("DB_Object_Symbol")
+        self.gene_index = dict((g, i) for i, g in enumerate(self.genes))
+
+        index = ontology._get_index()
+        self.terms = index.terms
+        self.term_index = dict(index.term_index)
+        # Annotations to alternative ids are collected by the primary term
+        # (see `Annotations._collect_annotations`)
+        for term_id, alt_ids in six.iteritems(ontology.reverse_alias_mapper):
+            for alt_id in alt_ids:
+                self.term_index.setdefault(alt_id, self.term_index[term_id])
+
+        self.go_ids, self.ann_go_id = columns.column("GO_ID")
+        remap = numpy.array([self.term_index.get(t, -1)
+                             for t in self.go_ids], dtype=numpy.int32)
+        self.ann_term = remap[self.ann_go_id]
+
+        self.evidence_codes, self.ann_evidence = \
+            columns.column("Evidence_Code")
+        self.aspects, self.ann_aspect = columns.column("Aspect")
+
+        self._closure = None
+        self._incidence = {}
+
+    def closure(self):
+        """
+        Return a sparse term x term matrix `C` with ``C[i, j] == 1``
+        if `terms[j]` is `terms[i]` or any of its super terms.
+        """
+        if self._closure is None:
+            ancestors = self.ontology._get_index().ancestors
+            identity = scipy.sparse.identity(len(self.terms), dtype=bool,
+                                             format="csr")
+            self._closure = (ancestors + identity).astype(numpy.int32)
+        return self._closure
+
+    def incidence(self, evidence_codes, aspects):
+        """
+        Return a boolean (CSC) gene x term matrix of annotations with
+        `evidence_codes` and `aspects` propagated to all super terms.
+        """
+        key = (frozenset(evidence_codes), frozenset(aspects))
+        if key not in self._incidence:
+            ev = [i for i, e in enumerate(self.evidence_codes)
+                  if e in key[0]]
+            asp = [i for i, a in enumerate(self.aspects) if a in key[1]]
+            mask = (numpy.isin(self.ann_evidence, ev) &
+                    numpy.isin(self.ann_aspect, asp) &
+                    (self.ann_term >= 0))
+            rows, cols = self.ann_gene[mask], self.ann_term[mask]
+            direct = scipy.sparse.csr_matrix(
+                (numpy.ones(len(rows), dtype=numpy.int32), (rows, cols)),
+                shape=(len(self.genes), len(self.terms)))
+            propagated = scipy.sparse.csc_matrix(direct.dot(self.closure()))
+            propagated.data = numpy.ones_like(propagated.data, dtype=bool)
+            self._incidence[key] = propagated
+        return self._incidence[key]
+
+    def gene_indices(self, genes):
+        """
+        Return a sorted array of indices (into `genes`) of the given gene
+        names.
+        """
+        return numpy.array(sorted(self.gene_index[g] for g in genes
+                                  if g in self.gene_index), dtype=int)
+
+    def gene_mask(self, genes):
+        """
+        Return a 0/1 vector over `genes` marking the given gene names.
+        """
+        mask = numpy.zeros(len(self.genes), dtype=numpy.int32)
+        mask[self.gene_indices(genes)] = 1
+        return mask
+
+    def unknown_terms(self, gene_indices, evidence_codes, aspects):
+        """
+        Return the set of GO ids (not in the ontology) annotated to the
+        genes with `evidence_codes` and `aspects`.
+        """
+        unknown = numpy.flatnonzero(self.ann_term < 0)
+        unknown = unknown[numpy.isin(self.ann_gene[unknown], gene_indices)]
+        return set(self.go_ids[self.ann_go_id[i]] for i in unknown
+                   if self.evidence_codes[self.ann_evidence[i]]
+                   in evidence_codes and
+                   self.aspects[self.ann_aspect[i]] in aspects)
+
+
+def _enrichment_p_values(args):
+    """ Compute the (optionally FDR adjusted) p-values for a single
+    gene list in :func:`Annotations.get_enriched_terms_batch`.
+    """
+    prob, counts, N, ref_counts, n, use_fdr = args
+    if hasattr(prob, "p_values"):
+        p_values = prob.p_values(counts, N, ref_counts, n).tolist()
+    else:
+        p_values = [prob.p_value(k, N, m, n)
+                    for k, m in zip(counts, ref_counts)]
+    if use_fdr:
+        p_values = stats.FDR(p_values)
+    return p_values
+
+
 class Annotations(object):
     """
     :class:`Annotations` object holds the annotations.
@@ -646,22 +1289,17 @@ class Annotations(object):
                  progress_callback=None, rev=None):
         self.ontology = ontology
 
-        #: A dictionary mapping a gene name (DB_Object_Symbol) to a
-        #: set of all annotations of that gene.
-        self.gene_annotations = defaultdict(list)
-
-        #: A dictionary mapping a GO term id to a set of annotations that
-        #: are directly annotated to that term
-        self.term_anotations = defaultdict(list)
+        self._gene_annotations = defaultdict(list)
+        self._term_anotations = defaultdict(list)
+        self._annotations = []
 
         self.all_annotations = defaultdict(list)
 
         self._gene_names = None
         self._gene_names_dict = None
         self._alias_mapper = None
+        self._columns = None
 
-        #: A list of all :class:`AnnotationRecords` instances.
-        self.annotations = []
         self.header = ""
         self.genematcher = genematcher
         self.taxid = None
@@ -672,6 +1310,9 @@ class Annotations(object):
             if type(filename_or_organism, Annotations):
                 self.taxid = filename_or_organism.taxid
 
+        elif isinstance(filename_or_organism, _AnnotationColumns):
+            self._set_columns(filename_or_organism)
+
         elif isinstance(filename_or_organism, basestring) and \
                 os.path.exists(filename_or_organism):
             self.parse_file(filename_or_organism, progress_callback)
@@ -751,6 +1392,7 @@ class Annotations(object):
         """Set the ontology to use in the annotations mapping.
         """
         self.all_annotations = defaultdict(list)
+        self._enrichment_index = None
         self._ontology = ontology
 
     def get_ontology(self):
@@ -763,6 +1405,33 @@ class Annotations(object):
         if self.ontology is None:
             self.ontology = Ontology()
 
+    @property
+    def annotations(self):
+        """A list of all :class:`AnnotationRecord` instances.
+        """
+        if self._annotations is None:
+            self._annotations = self._columns.records()
+        return self._annotations
+
+    @property
+    def gene_annotations(self):
+        """A dictionary mapping a gene name (DB_Object_Symbol) to a
+        list of all annotations of that gene.
+        """
+        if self._gene_annotations is None:
+            self._gene_annotations = _AnnotationGroups(
+                self._columns, "DB_Object_Symbol")
+        return self._gene_annotations
+
+    @property
+    def term_anotations(self):
+        """A dictionary mapping a GO term id to a list of annotations
+        that are directly annotated to that term.
+        """
+        if self._term_anotations is None:
+            self._term_anotations = _AnnotationGroups(self._columns, "GO_ID")
+        return self._term_anotations
+
     @classmethod
     def load(cls, org, ontology=None, genematcher=None,
              progress_callback=None):
@@ -782,12 +1451,47 @@ class Annotations(object):
                 raise obiTaxonomy.UnknownSpeciesIdentifier(org + str(code))
             serverfiles.download("GO", filename)
 
-        return cls(path, ontology=ontology, genematcher=genematcher,
-                   progress_callback=progress_callback)
+        columns = _AnnotationColumns.load_cache(path)
+        if columns is not None:
+            return cls(columns, ontology=ontology, genematcher=genematcher,
+                       progress_callback=progress_callback)
+
+        annotations = cls(path, ontology=ontology, genematcher=genematcher,
+                          progress_callback=progress_callback)
+        try:
+            annotations._get_columns().save_cache(path)
+        except (IOError, OSError) as ex:
+            warnings.warn("Could not save the annotations cache (%s)" % ex,
+                          UserWarning)
+        return annotations
 
     Load = load
 
-    def parse_file(self, file, progress_callback=None):
+    def _get_columns(self):
+        if self._columns is None:
+            self._columns = _AnnotationColumns.from_records(
+                self.annotations, header=self.header)
+        return self._columns
+
+    def _set_columns(self, columns):
+        """Load the annotations from an :class:`_AnnotationColumns`.
+
+        The columns remain the primary storage; the annotation records
+        (and the gene/term mappings) are only created on demand.
+        """
+        self.header = columns.header
+        self._annotations = None
+        self._gene_annotations = None
+        self._term_anotations = None
+        self.all_annotations = defaultdict(list)
+        self._enrichment_index = None
+        self._gene_names_dict = None
+        self._gene_names = None
+        self._alias_mapper = None
+        self._columns = columns
+
+    def parse_file(self, file, progress_callback=None, evidence_codes=None,
+                   aspects=None, taxids=None):
         """Parse and load the annotations from file.
 
         `file` can be:
@@ -797,33 +1501,97 @@ class Annotations(object):
             - a path to the actual association file
             - an open file-like object of the association file
 
+        The file is read one line at a time. Rows not matching the
+        `evidence_codes`, `aspects` or `taxids` (if given) are skipped
+        before they are parsed.
+
+        :param list evidence_codes: Evidence codes to load.
+        :param aspects: Aspects to load ("P", "F", "C" or a set of these).
+        :param list taxids:
+            NCBI taxonomy ids to load (matched against the gene's
+            ``Taxon`` column).
+
         """
+        size, tell = None, None
+        container = None  # the archive or file (closed after f)
         if isinstance(file, basestring):
             if os.path.isfile(file) and tarfile.is_tarfile(file):
-                f = tarfile.open(file).extractfile("gene_association")
+                container = tarfile.open(file)
+                member = container.getmember("gene_association")
+                f = container.extractfile(member)
+                size = member.size
             elif os.path.isfile(file) and file.endswith(".gz"):
-                f = gzip.open(file)
+                raw = container = open(file, "rb")
+                f = gzip.GzipFile(fileobj=raw)
+                # Report on the compressed size
+                size, tell = os.path.getsize(file), raw.tell
             elif os.path.isfile(file):
-                f = open(file)
+                f = open(file, "rb")
+                size = os.path.getsize(file)
             elif os.path.isdir(file):
-                f = open(os.path.join(file, "gene_association"))
+                file = os.path.join(file, "gene_association")
+                f = open(file, "rb")
+                size = os.path.getsize(file)
             else:
                 raise ValueError("Cannot open %r for parsing." % file)
         else:
             f = file
-        lines = [line for line in f.read().splitlines() if line.strip()]
+            try:
+                size = os.fstat(f.fileno()).st_size
+            except (AttributeError, IOError, OSError, ValueError):
+                pass
+
+        if isinstance(aspects, basestring):
+            aspects = set([aspects])
+        evidence_codes = set(evidence_codes) if evidence_codes else None
+        aspects = set(aspects) if aspects else None
+        taxids = set("taxon:" + str(taxid) for taxid in taxids) \
+            if taxids else None
 
-        milestones = progress_bar_milestones(len(lines), 100)
-        for i, line in enumerate(lines):
+        try:
+            self._parse_lines(f, size, tell, progress_callback,
+                              evidence_codes, aspects, taxids)
+        finally:
+            if f is not file:
+                f.close()
+            if container is not None:
+                container.close()
+
+    def _parse_lines(self, f, size, tell, progress_callback,
+                     evidence_codes, aspects, taxids):
+        header = [self.header] if self.header else []
+        read = 0
+        step = max((size or 0) // 100, 1)
+        next_report = step
+        for line in f:
+            read += len(line)
+            if progress_callback and size and read >= next_report:
+                next_report = read + step
+                pos = tell() if tell is not None else read
+                progress_callback(100.0 * min(pos, size) / size)
+
+            if not isinstance(line, str):
+                line = line.decode("utf-8")
+            line = line.rstrip("\r\n")
+            if not line.strip():
+                continue
             if line.startswith("!"):
-                self.header = self.header + line + "\n"
+                header.append(line + "\n")
                 continue
 
-            a = AnnotationRecord.from_string(line)
-            self.add_annotation(a)
+            fields = line.split("\t")
+            if evidence_codes is not None and \
+                    fields[6] not in evidence_codes:
+                continue
+            if aspects is not None and fields[8] not in aspects:
+                continue
+            if taxids is not None and \
+                    fields[12].split("|", 1)[0] not in taxids:
+                continue
 
-            if progress_callback and i in milestones:
-                progress_callback(100.0 * i / len(lines))
+            self.add_annotation(AnnotationRecord._make(map(intern, fields)))
+
+        self.header = "".join(header)
 
     def add_annotation(self, a):
         """Add a single :class:`AnotationRecord` instance to this object.
@@ -833,15 +1601,33 @@ class Annotations(object):
         if not a.geneName or not a.GOId or a.Qualifier == "NOT":
             return
 
+        self._unpack_columns()
         self.gene_annotations[a.geneName].append(a)
         self.annotations.append(a)
         self.term_anotations[a.GOId].append(a)
         self.all_annotations = defaultdict(list)
+        self._enrichment_index = None
+        self._columns = None
 
         self._gene_names_dict = None
         self._gene_names = None
         self._alias_mapper = None
 
+    def _unpack_columns(self):
+        """Replace the column backed annotations with plain lists and
+        dictionaries (so they can be modified).
+        """
+        if self._columns is None or \
+                isinstance(self._gene_annotations, defaultdict):
+            return
+        annotations = self.annotations
+        self._gene_annotations = defaultdict(list)
+        self._term_anotations = defaultdict(list)
+        with _gc_disabled():
+            for a in annotations:
+                self._gene_annotations[a.geneName].append(a)
+                self._term_anotations[a.GOId].append(a)
+
     @property
     def gene_names_dict(self):
         if self._gene_names_dict is None:
@@ -853,19 +1639,41 @@ class Annotations(object):
     @property
     def gene_names(self):
         if self._gene_names is None:
-            self._gene_names = set([ann.geneName for ann in self.annotations])
+            if self._annotations is None:
+                genes, _ = self._columns.column("DB_Object_Symbol")
+                self._gene_names = set(genes)
+            else:
+                self._gene_names = set([ann.geneName
+                                        for ann in self.annotations])
         return self._gene_names
 
     @property
     def alias_mapper(self):
         if self._alias_mapper is None:
+            if self._annotations is None:
+                rows = self._alias_rows()
+            else:
+                rows = ((ann.geneName, ann.DB_Object_ID, ann.DB_Object_Synonym)
+                        for ann in self.annotations)
             self._alias_mapper = {}
-            for ann in self.annotations:
-                self._alias_mapper.update([(alias, ann.geneName)
-                                           for alias in ann.alias +
-                                            [ann.geneName, ann.DB_Object_ID]])
+            for name, id, synonyms in rows:
+                self._alias_mapper.update(
+                    [(intern(alias), name)
+                     for alias in synonyms.split("|") + [name, id]])
         return self._alias_mapper
 
+    def _alias_rows(self):
+        """Return the distinct (symbol, id, synonyms) triples from the
+        columns (in the order of their last occurrence).
+        """
+        fields = ["DB_Object_Symbol", "DB_Object_ID", "DB_Object_Synonym"]
+        tables, codes = zip(*map(self._columns.column, fields))
+        codes = numpy.vstack(codes)[:, ::-1]
+        _, first = numpy.unique(codes, axis=1, return_index=True)
+        rows = codes[:, numpy.sort(first)[::-1]]
+        return [tuple(table[c] for table, c in zip(tables, row))
+                for row in rows.T]
+
     def get_gene_names_translator(self, genes):
         """ Return a dictionary mapping canonical names (DB_Object_Symbol)
         to `genes`.
@@ -916,9 +1724,12 @@ class Annotations(object):
         id = self.ontology.alias_mapper.get(id, id)
         if id not in self.all_annotations or \
                 type(self.all_annotations[id]) == list:
+            reverse_alias_mapper = self.ontology.reverse_alias_mapper
             annot_set = set()
-            for annots in self._collect_annotations(id, set()):
-                annot_set.update(annots)
+            for term in self.ontology.extract_sub_graph([id]):
+                for alt_id in reverse_alias_mapper.get(term, ()):
+                    annot_set.update(self.term_anotations.get(alt_id, ()))
+                annot_set.update(self.term_anotations.get(term, ()))
             self.all_annotations[id] = annot_set
         return self.all_annotations[id]
 
@@ -938,6 +1749,17 @@ class Annotations(object):
         return list(set([ann.geneName for ann in annotations
                          if ann.Evidence_Code in evidence_codes]))
 
+    def _get_enrichment_index(self):
+        self._ensure_ontology()
+        if self._enrichment_index is None:
+            columns = self._columns
+            if columns is None:
+                # Only encode the fields used by the index
+                columns = _AnnotationColumns.from_records(
+                    self.annotations, _EnrichmentIndex.FIELDS)
+            self._enrichment_index = _EnrichmentIndex(columns, self.ontology)
+        return self._enrichment_index
+
     def get_enriched_terms(self, genes, reference=None, evidence_codes=None,
                            slims_only=False, aspect=None,
                            prob=stats.Binomial(), use_fdr=True,
@@ -957,8 +1779,32 @@ class Annotations(object):
             or a set containing these elements.
 
         """
-        revGenesDict = self.get_gene_names_translator(genes)
-        genes = set(revGenesDict.keys())
+        return self.get_enriched_terms_batch(
+            [genes], reference=reference, evidence_codes=evidence_codes,
+            slims_only=slims_only, aspect=aspect, prob=prob, use_fdr=use_fdr,
+            progress_callback=progress_callback)[0]
+
+    def get_enriched_terms_batch(self, gene_lists, reference=None,
+                                 evidence_codes=None, slims_only=False,
+                                 aspect=None, prob=stats.Binomial(),
+                                 use_fdr=True, workers=None,
+                                 progress_callback=None):
+        """ Return a list of enriched terms dictionaries (as returned by
+        :func:`get_enriched_terms`), one for each list of genes in
+        `gene_lists`.
+
+        The reference, evidence code and aspect filtering is done only
+        once for all the lists, and the term counts of all the lists are
+        computed with a single sparse matrix product.
+
+        :param gene_lists: A list of gene lists.
+        :param int workers:
+            If given, compute the p-values (the only per list step that
+            is not vectorized) in a pool of `workers` processes.
+
+        See :func:`get_enriched_terms` for the other parameters.
+
+        """
         if reference:
             refGenesDict = self.get_gene_names_translator(reference)
             reference = set(refGenesDict.keys())
@@ -973,21 +1819,6 @@ class Annotations(object):
             aspects_set = aspect
 
         evidence_codes = set(evidence_codes or evidenceDict.keys())
-        annotations = [ann
-                       for gene in genes for ann in self.gene_annotations[gene]
-                       if ann.Evidence_Code in evidence_codes and
-                       ann.Aspect in aspects_set]
-
-        refAnnotations = set(
-            [ann
-             for gene in reference for ann in self.gene_annotations[gene]
-             if ann.Evidence_Code in evidence_codes and
-             ann.Aspect in aspects_set]
-        )
-
-        annotationsDict = defaultdict(set)
-        for ann in annotations:
-            annotationsDict[ann.GO_ID].add(ann)
 
         self._ensure_ontology()
         if slims_only and not self.ontology.slims_subset:
@@ -995,43 +1826,88 @@ class Annotations(object):
                           "Using 'goslim_generic' subset", UserWarning)
             self.ontology.set_slims_subset("goslim_generic")
 
-        terms = annotationsDict.keys()
-        filteredTerms = [term for term in terms if term in self.ontology]
-
-        if len(terms) != len(filteredTerms):
-            termDiff = set(terms) - set(filteredTerms)
+        index = self._get_enrichment_index()
+        incidence = index.incidence(evidence_codes, aspects_set)
+        ref_mask = index.gene_mask(reference)
+        ref_counts = incidence.T.dot(ref_mask)
+        incidence = incidence.tocsr()
+
+        translators = [self.get_gene_names_translator(genes)
+                       for genes in gene_lists]
+        members = [index.gene_indices(revGenesDict)
+                   for revGenesDict in translators]
+
+        # A (list x gene) membership matrix. Genes outside the reference
+        # do not contribute to the counts but still nominate candidate
+        # terms, so they are weighted by `scale` (larger than any count)
+        # and the counts are the product's remainders modulo `scale`.
+        scale = len(index.genes) + 1
+        cols = numpy.concatenate([numpy.zeros(0, dtype=int)] + members)
+        rows = numpy.repeat(numpy.arange(len(members)),
+                            [len(m) for m in members])
+        weights = numpy.where(ref_mask[cols] != 0, 1, scale)
+        membership = scipy.sparse.csr_matrix(
+            (weights.astype(numpy.int64), (rows, cols)),
+            shape=(len(members), len(index.genes)))
+        counts = membership.dot(incidence).tocsr()
+
+        unknown = index.unknown_terms(cols, evidence_codes, aspects_set)
+        if unknown:
             warnings.warn("%s terms in the annotations were not found in the "
-                          "ontology." % ",".join(map(repr, termDiff)),
+                          "ontology." % ",".join(map(repr, unknown)),
                           UserWarning)
 
-        terms = self.ontology.extract_super_graph(filteredTerms)
-        res = {}
-
-        milestones = progress_bar_milestones(len(terms), 100)
-        for i, term in enumerate(terms):
-            if slims_only and term not in self.ontology.slims_subset:
-                continue
-            allAnnotations = self.get_all_annotations(term).intersection(refAnnotations)
-##            allAnnotations.intersection_update(refAnnotations)
-            allAnnotatedGenes = set([ann.geneName for ann in allAnnotations])
-            mappedGenes = genes.intersection(allAnnotatedGenes)
-
-            if len(reference) > len(allAnnotatedGenes):
-                mappedReferenceGenes = reference.intersection(allAnnotatedGenes)
-            else:
-                mappedReferenceGenes = allAnnotatedGenes.intersection(reference)
-            res[term] = ([revGenesDict[g] for g in mappedGenes],
-                         prob.p_value(len(mappedGenes), len(reference),
-                                      len(mappedReferenceGenes), len(genes)),
-                         len(mappedReferenceGenes))
+        if slims_only:
+            slims = self.ontology.slims_subset
+            slims_mask = numpy.array([t in slims for t in index.terms],
+                                     dtype=bool)
+
+        lists = []
+        tasks = []
+        milestones = progress_bar_milestones(len(gene_lists), 100)
+        for i, (revGenesDict, genes) in enumerate(zip(translators, members)):
+            start, end = counts.indptr[i: i + 2]
+            columns = counts.indices[start: end]
+            term_counts = counts.data[start: end] % scale
+            if slims_only:
+                keep = slims_mask[columns]
+                columns, term_counts = columns[keep], term_counts[keep]
+            terms = [index.terms[j] for j in columns]
+
+            # Only genes in the reference contribute to the clusters.
+            genes = genes[ref_mask[genes] != 0]
+            cluster = incidence[genes].tocsc()
+
+            lists.append((revGenesDict, terms, columns, genes, cluster))
+            tasks.append((prob, term_counts.tolist(), len(reference),
+                          ref_counts[columns].tolist(), len(revGenesDict),
+                          use_fdr))
             if progress_callback and i in milestones:
-                progress_callback(100.0 * i / len(terms))
-        if use_fdr:
-            res = sorted(res.items(), key=lambda x: x[1][1])
-            res = dict([(id, (genes, p, ref))
-                        for (id, (genes, _, ref)), p in
-                        zip(res, stats.FDR([p for _, (_, p, _) in res]))])
-        return res
+                progress_callback(50.0 * i / len(gene_lists))
+
+        if workers:
+            from multiprocessing import Pool
+            from contextlib import closing
+            with closing(Pool(workers)) as pool:
+                p_values = pool.map(_enrichment_p_values, tasks)
+        else:
+            p_values = list(map(_enrichment_p_values, tasks))
+
+        results = []
+        for (revGenesDict, terms, columns, rows, cluster), task, p_values in \
+                zip(lists, tasks, p_values):
+            res = {}
+            ref_counts = task[3]
+            for i, (term, j) in enumerate(zip(terms, columns)):
+                start, end = cluster.indptr[j: j + 2]
+                mappedGenes = [index.genes[rows[r]]
+                               for r in cluster.indices[start: end]]
+                res[term] = ([revGenesDict[g] for g in mappedGenes],
+                             p_values[i], ref_counts[i])
+            results.append(res)
+            if progress_callback:
+                progress_callback(50.0 + 50.0 * len(results) / len(lists))
+        return results
 
     def get_annotated_terms(self, genes, direct_annotation_only=False,
                             evidence_codes=None, progress_callback=None):
@@ -1069,9 +1945,7 @@ class Annotations(object):
                               file="graph.png", width=None, height=None,
                               precison=3):
         ref_size = len(self.gene_names) if ref_size == None else ref_size
-        sortedterms = sorted(terms.items(), key=lambda term: term[1][1])
-        fdr = dict(zip([t[0] for t in sortedterms],
-                       stats.FDR([t[1][1] for t in sortedterms])))
+        fdr = dict(zip(terms, stats.FDR([terms[t][1] for t in terms])))
         termsList = [(term,
                       ((float(len(terms[term][0])) / cluster_size) /
                        (float(terms[term][2]) / ref_size)),
@@ -1108,6 +1982,8 @@ class Annotations(object):
     def __len__(self):
         """ Return the number of annotations
         """
+        if self._annotations is None:
+            return len(self._columns)
         return len(self.annotations)
 
     def __getitem__(self, index):
@@ -12,6 +12,11 @@ import Orange
 from . import geneset as obiGeneSets
 from .utils.expression import *
 from . import gene as obiGene
+from .utils.gsea_matrix import (
+    mean, nth, orderedPointersCorr, enrichmentScoreRanked, rankPositions,
+    genesetBlocks, enrichmentScoresMatrix, shuffledLocations,
+    signalToNoiseMatrix, SignalToNoiseRankings, GenePermutationRankings,
+    permutationNulls, gseapval, runOptCallbacks, gseaR, gseaSignificance)
 
 """
 Gene set enrichment analysis.
@@ -29,9 +34,6 @@ def issequencens(x):
     "Is x a sequence and not string ? We say it is if it has a __getitem__ method and is not string."
     return hasattr(x, '__getitem__') and not isinstance(x, basestring)
 
-def mean(l):
-    return float(sum(l))/len(l)
-
 def rankingFromOrangeMeas(meas):
     """
     Creates a function that sequentally ranks all attributes and returns
@@ -40,106 +42,6 @@ def rankingFromOrangeMeas(meas):
     """
     return lambda d: [ meas(i,d) for i in range(len(d.domain.attributes)) ]
 
-def orderedPointersCorr(lcor):
-    """
-    Return a list of integers: indexes in original
-    lcor. Elements in the list are ordered by
-    their lcor[i] value. Higher correlations first.
-    """
-    ordered = [ (i,a) for i,a in enumerate(lcor) ] #original pos + correlation
-    ordered.sort(key=lambda x: -x[1]) #sort by correlation, descending
-    ordered = nth(ordered, 0) #contains positions in the original list
-    return ordered
-
-def enrichmentScoreRanked(subset, lcor, ordered, p=1.0, rev2=None):
-    """
-    Input data and subset. 
-    
-    subset: list of attribute indices of the input data belonging
-        to the same set.
-    lcor: correlations with class for each attribute in a list. 
-
-    Returns enrichment score on given data.
-
-    This implementation efficiently handles "sparse" genesets (that
-    cover only a small subset of all genes in the dataset).
-    """
-
-    #print lcor
-
-    subset = set(subset)
-
-    if rev2 == None:
-        def rev(l):
-            return numpy.argsort(l)
-        rev2 = rev(ordered)
-
-    #add if gene is not in the subset
-    notInA = -(1. / (len(lcor)-len(subset)))
-    #base for addition if gene is in the subset
-
-    cors = [ abs(lcor[i])**p for i in subset ] #belowe in numpy
-    sumcors = sum(cors)
-
-    #this should not happen
-    if sumcors == 0.0:
-        return (0.0, None)
-    
-    inAb = 1./sumcors
-
-    ess = [0.0]
-    
-    map = {}
-    for i in subset:
-        orderedpos = rev2[i]
-        map[orderedpos] = inAb*abs(lcor[i]**p)
-        
-    last = 0
-
-    maxSum = minSum = csum = 0.0
-
-    for a,b in sorted(map.items()):
-        diff = a-last
-        csum += notInA*diff
-        last = a+1
-        
-        if csum < minSum:
-            minSum = csum
-        
-        csum += b
-
-        if csum > maxSum:
-            maxSum = csum
-
-    #finish it
-    diff = (len(ordered))-last
-    csum += notInA*diff
-
-    if csum < minSum:
-        minSum = csum
-
-    #print "MY", (maxSum if abs(maxSum) > abs(minSum) else minSum)
-
-    """
-    #BY DEFINITION
-    print "subset", subset
-
-    for i in ordered:
-        ess.append(ess[-1] + \
-            (inAb*abs(lcor[i]**p) if i in subset else notInA)
-        )
-        if i in subset:
-            print ess[-2], ess[-1]
-            print i, (inAb*abs(lcor[i]**p))
-
-    maxEs = max(ess)
-    minEs = min(ess)
-    
-    print "REAL", (maxEs if abs(maxEs) > abs(minEs) else minEs, ess[1:])
-
-    """
-    return (maxSum if abs(maxSum) > abs(minSum) else minSum, [])
-
 #from mOrngData
 def shuffleAttribute(data, attribute, locations):
     """
@@ -188,24 +90,32 @@ def shuffleAttributes(data, rand=random.Random(0)):
     d2 = orange.ExampleTable(dom2, data)
     return d2
 
-def gseapval(es, esnull):
+class ClassPermutationRankings(SignalToNoiseRankings):
     """
-    From article (PNAS):
-    estimate nominal p-value for S from esnull by using the positive
-    or negative portion of the distribution corresponding to the sign 
-    of the observed ES(S).
+    SignalToNoiseRankings of the attributes of an orange.ExampleTable.
     """
-    
-    try:
-        if es < 0:
-            return float(len([ a for a in esnull if a <= es ]))/ \
-                len([ a for a in esnull if a < 0])    
-        else: 
-            return float(len([ a for a in esnull if a >= es ]))/ \
-                len([ a for a in esnull if a >= 0])
-    except:
-        return 1.0
 
+    def __init__(self, data):
+        X, C = data.toNumpyMA("A/C")
+        classes = numpy.where(numpy.ma.getmaskarray(C), -1,
+            numpy.ma.getdata(C)).astype(int)
+        #attributes x examples
+        SignalToNoiseRankings.__init__(self, numpy.ma.getdata(X).T,
+            numpy.ma.getmaskarray(X).T, classes)
+
+class DataPermutationRankings(object):
+    """
+    Rankings with a custom ranking function on data with shuffled
+    classes (shuffleClass).
+    """
+
+    def __init__(self, data, rankingf):
+        self.data = data
+        self.rankingf = rankingf
+
+    def __call__(self, seeds):
+        return numpy.array([ self.rankingf(shuffleClass(self.data, seed))
+            for seed in seeds ], dtype=float).reshape(len(seeds), -1)
 
 def enrichmentScore(data, subset, rankingf):
     """
@@ -217,7 +127,7 @@ def enrichmentScore(data, subset, rankingf):
     return es,l
 
 def gseaE(data, subsets, rankingf=None, \
-        n=100, permutation="class", callback=None):
+        n=100, permutation="class", callback=None, workers=None):
     """
     Run GSEA algorithm on an example table.
 
@@ -228,247 +138,38 @@ def gseaE(data, subsets, rankingf=None, \
     n: number of random permutations to sample null distribution.
     permutation: "class" for permutating class, else permutate attribute 
         order.
+    workers: number of worker processes for permutations (default: do not
+        use worker processes).
 
     """
 
-    if not rankingf:
-        rankingf=rankingFromOrangeMeas(MA_signalToNoise())
-
-    enrichmentScores = []
- 
-    lcor = rankingf(data)
-    #print lcor
-
-    ordered = orderedPointersCorr(lcor)
-
-    def rev(l):
-        return numpy.argsort(l)
-
-    rev2 = rev(ordered)
+    if not rankingf and iset(data):
+        #the default ranking is computed for all permutations at once
+        classRankings = ClassPermutationRankings(data)
+        lcor = classRankings.rankings()[0]
+    else:
+        if not rankingf:
+            rankingf=rankingFromOrangeMeas(MA_signalToNoise())
+        classRankings = DataPermutationRankings(data, rankingf)
+        lcor = rankingf(data)
 
-    for subset in subsets:
-        es = enrichmentScoreRanked(subset, lcor, ordered, rev2=rev2)[0]
-        enrichmentScores.append(es)
+    enrichmentScores = enrichmentScoresMatrix(lcor, subsets)[0].tolist()
 
     runOptCallbacks(callback)
 
     #print "PERMUTATION", permutation
 
-    enrichmentNulls = [ [] for a in range(len(subsets)) ]
-
-    for i in range(n):
-
-        if permutation == "class":
-            d2 = shuffleClass(data, 2000+i) #fixed permutation
-            r2 = rankingf(d2)
-        else:
-            r2 = shuffleList(lcor, random.Random(2000+i))
-
-        ordered2 = orderedPointersCorr(r2)
-        rev22 = rev(ordered2)
-        for si,subset in enumerate(subsets):
-            esn = enrichmentScoreRanked(subset, r2, ordered2, rev2=rev22)[0]
-            enrichmentNulls[si].append(esn)
-
-        runOptCallbacks(callback)
-
-    return gseaSignificance(enrichmentScores, enrichmentNulls)
-
-
-def runOptCallbacks(callback):
-    if callback is not None:
-        try:
-            [ a() for a in callback ]
-        except:
-            callback()            
-
-def gseaR(rankings, subsets, n, callback=None):
-    """
-    """
-    enrichmentScores = []
-    ordered = orderedPointersCorr(rankings)
-    
-    def rev(l):
-        return numpy.argsort(l)
-
-    rev2 = rev(ordered)
-
-    for subset in subsets:
-
-        es = enrichmentScoreRanked(subset, rankings, ordered, rev2=rev2)[0]
-        enrichmentScores.append(es)
-    
-    runOptCallbacks(callback)
-
-    enrichmentNulls = [ [] for a in range(len(subsets)) ]
-
-    for i in range(n):
-        
-        r2 = shuffleList(rankings, random.Random(2000+i))
-        ordered2 = orderedPointersCorr(r2)
-        rev22 = rev(ordered2)
-
-        for si,subset in enumerate(subsets):
-
-            esn = enrichmentScoreRanked(subset, r2, ordered2, rev2=rev22)[0]
-            enrichmentNulls[si].append(esn)
-
-        runOptCallbacks(callback)
-
-    return gseaSignificance(enrichmentScores, enrichmentNulls)
-
-
-def gseaSignificance(enrichmentScores, enrichmentNulls):
-
-    #print enrichmentScores
-
-    import time
-
-    tb1 = time.time()
-
-    enrichmentPVals = []
-    nEnrichmentScores = []
-    nEnrichmentNulls = []
-
-    for i in range(len(enrichmentScores)):
-        es = enrichmentScores[i]
-        enrNull = enrichmentNulls[i]
-        #print es, enrNull
-
-        enrichmentPVals.append(gseapval(es, enrNull))
-
-        #normalize the ES(S,pi) and the observed ES(S), separetely rescaling
-        #the positive and negative scores by divident by the mean of the 
-        #ES(S,pi)
-
-        #print es, enrNull
-
-        def normalize(s):
-            try:
-                if s == 0:
-                    return 0.0
-                if s >= 0:
-                    meanPos = mean([a for a in enrNull if a >= 0])
-                    #print s, meanPos
-                    return s/meanPos
-                else:
-                    meanNeg = mean([a for a in enrNull if a < 0])
-                    #print s, meanNeg
-                    return -s/meanNeg
-            except:
-                return 0.0 #return if according mean value is uncalculable
-
-
-        nes = normalize(es)
-        nEnrichmentScores.append(nes)
-        
-        nenrNull = [ normalize(s) for s in enrNull ]
-        nEnrichmentNulls.append(nenrNull)
- 
-
-    #print "First part", time.time() - tb1
-
-    #FDR computation
-    #create a histogram of all NES(S,pi) over all S and pi
-    vals = reduce(lambda x,y: x+y, nEnrichmentNulls, [])
-
-
-    def shorten(l, p=10000):
-        """
-        Take each len(l)/p element, if len(l)/p >= 2.
-        """
-        e = len(l)/p
-        if e <= 1:
-            return l
-        else:
-            return [ l[i] for i in xrange(0, len(l), e) ]
-
-    #vals = shorten(vals) -> this can speed up second part. is it relevant TODO?
-
-    """
-    Use this null distribution to compute an FDR q value, for a given NES(S) =
-    NES* >= 0. The FDR is the ratio of the percantage of all (S,pi) with
-    NES(S,pi) >= 0, whose NES(S,pi) >= NES*, divided by the percentage of
-    observed S wih NES(S) >= 0, whose NES(S) >= NES*, and similarly if NES(S)
-    = NES* <= 0.
-    """
-
-    nvals = numpy.array(sorted(vals))
-    nnes = numpy.array(sorted(nEnrichmentScores))
-
-    #print "LEN VALS", len(vals), len(nEnrichmentScores)
-
-    fdrs = []
-
-    import operator
-
-    for i in range(len(enrichmentScores)):
-
-        nes = nEnrichmentScores[i]
-
-        """
-        #Strighfoward but slow implementation follows in comments.
-        #Useful as code description.
-        
-        if nes >= 0:
-            op0 = operator.ge
-            opn = operator.ge
-        else:
-            op0 = operator.lt
-            opn = operator.le
-
-        allPos = [a for a in vals if op0(a,0)]
-        allHigherAndPos = [a for a in allPos if opn(a,nes) ]
-
-        nesPos = [a for a in nEnrichmentScores if op0(a,0) ]
-        nesHigherAndPos = [a for a in nesPos if opn(a,nes) ]
-
-        top = len(allHigherAndPos)/float(len(allPos)) #p value
-        down = len(nesHigherAndPos)/float(len(nesPos))
-        
-        l1 = [ len(allPos), len(allHigherAndPos), len(nesPos), len(nesHigherAndPos)]
-
-        allPos = allHigherAndPos = nesPos =  nesHigherAndPos = 1
-
-        """
-
-        #this could be speed up twice with the same accuracy! 
-        if nes >= 0:
-            allPos = int(len(vals) - numpy.searchsorted(nvals, 0, side="left"))
-            allHigherAndPos = int(len(vals) - numpy.searchsorted(nvals, nes, side="left"))
-            nesPos = len(nnes) - int(numpy.searchsorted(nnes, 0, side="left"))
-            nesHigherAndPos = len(nnes) - int(numpy.searchsorted(nnes, nes, side="left"))
-        else:
-            allPos = int(numpy.searchsorted(nvals, 0, side="left"))
-            allHigherAndPos = int(numpy.searchsorted(nvals, nes, side="right"))
-            nesPos = int(numpy.searchsorted(nnes, 0, side="left"))
-            nesHigherAndPos = int(numpy.searchsorted(nnes, nes, side="right"))
-           
-        """
-        #Comparing results
-        l2 = [ allPos, allHigherAndPos, nesPos, nesHigherAndPos ]
-        diffs = [ l1[i]-l2[i] for i in range(len(l1)) ]
-        sumd = sum( [ abs(a) for a in diffs ] )
-        if sumd > 0:
-            print nes > 0
-            print "orig", l1
-            print "modi", l2
-        """
-
-        try:
-            top = allHigherAndPos/float(allPos) #p value
-            down = nesHigherAndPos/float(nesPos)
-
-            fdrs.append(top/down)
-        except:
-            fdrs.append(1000000000.0)
-    
-    #print "Whole part", time.time() - tb1
+    if permutation == "class":
+        permutationRankings = classRankings
+    else:
+        permutationRankings = GenePermutationRankings(lcor)
 
-    return zip(enrichmentScores, nEnrichmentScores, enrichmentPVals, fdrs)
+    seeds = [ 2000+i for i in range(n) ] #fixed permutations
+    nulls = permutationNulls(permutationRankings, seeds, subsets,
+        callback=callback, workers=workers)
 
+    return gseaSignificance(enrichmentScores, nulls.T.tolist())
 
-def nth(l,n): return [ a[n] for a in l ]
 
 def itOrFirst(data):
     """ Returns input if input is of type ExampleTable, else returns first
@@ -930,7 +631,7 @@ class GSEA(object):
         """
         return dict( (gs, self.genesIndices(nth(self.genesets[gs],1))) for gs in gsets)
 
-    def compute(self, minSize=3, maxSize=1000, minPart=0.1, n=100, callback=None, rankingf=None, permutation="class"):
+    def compute(self, minSize=3, maxSize=1000, minPart=0.1, n=100, callback=None, rankingf=None, permutation="class", workers=None):
 
         subsetsok = self.selectGenesets(minSize=minSize, maxSize=maxSize, minPart=minPart)
 
@@ -944,10 +645,10 @@ class GSEA(object):
             return {} # quick return if no genesets
 
         if len(itOrFirst(self.data)) > 1:
-            gseal = gseaE(self.data, nth(gsetsnumit,1), n=n, callback=callback, permutation=permutation, rankingf=rankingf)
+            gseal = gseaE(self.data, nth(gsetsnumit,1), n=n, callback=callback, permutation=permutation, rankingf=rankingf, workers=workers)
         else:
             rankings = [ self.data[0][at].native() for at in self.data.domain.attributes ]
-            gseal = gseaR(rankings, nth(gsetsnumit,1), n, callback=None)
+            gseal = gseaR(rankings, nth(gsetsnumit,1), n, callback=None, workers=workers)
 
         res = {}
 
@@ -965,7 +666,7 @@ class GSEA(object):
         return res
 
 def direct(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
-    gene_desc=None, n=100, callback=None):
+    gene_desc=None, n=100, callback=None, workers=None):
     """ Gene Set Enrichment analysis for pre-computed correlations
     between genes and phenotypes. 
     
@@ -980,11 +681,12 @@ def direct(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
 
     assert len(data.domain.attributes) == 1 or len(data) == 1
     return runGSEA(data, geneSets=gene_sets, matcher=matcher, minSize=min_size, 
-        maxSize=max_size, minPart=min_part, n=n, geneVar=gene_desc, callback=callback)
+        maxSize=max_size, minPart=min_part, n=n, geneVar=gene_desc, callback=callback,
+        workers=workers)
 
 def run(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
     at_least=3, phenotypes=None, gene_desc=None, phen_desc=None, n=100, 
-    permutation="phenotype", callback=None, rankingf=None):
+    permutation="phenotype", callback=None, rankingf=None, workers=None):
     """ Run Gene Set Enrichment Analysis.
 
     :param Orange.data.Table data: Gene expression data.  
@@ -997,6 +699,9 @@ def run(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
     :param n: Number of permutations for significance computation. Default: 100.
     :param str permutation: Permutation type, "phenotype" (default) for 
         phenotypes, "gene" for genes.
+    :param int workers: If given, compute permutations in a pool of
+        ``workers`` processes. The results do not depend on the number
+        of workers.
     :param int min_size:
     :param int max_size: Minimum and maximum allowed number of genes from
         gene set also the data set. Defaults: 3 and 1000.
@@ -1033,19 +738,19 @@ def run(data, gene_sets, matcher, min_size=3, max_size=1000, min_part=0.1,
     return runGSEA(data, geneSets=gene_sets, matcher=matcher, minSize=min_size, 
         maxSize=max_size, minPart=min_part, n=n, permutation=permutation, 
         geneVar=gene_desc, callback=callback, phenVar=phen_desc, 
-        classValues=phenotypes)
+        classValues=phenotypes, workers=workers)
 
 def runGSEA(data, organism=None, classValues=None, geneSets=None, n=100, 
         permutation="class", minSize=3, maxSize=1000, minPart=0.1, atLeast=3, 
         matcher=None, geneVar=None, phenVar=None, caseSensitive=False, 
-        rankingf=None, callback=None):
+        rankingf=None, callback=None, workers=None):
     gso = GSEA(data, organism=organism, matcher=matcher, 
         classValues=classValues, atLeast=atLeast, caseSensitive=caseSensitive,
         geneVar=geneVar, phenVar=phenVar)
     gso.addGenesets(geneSets)
     res1 = gso.compute(n=n, permutation=permutation, minSize=minSize,
         maxSize=maxSize, minPart=minPart, rankingf=rankingf,
-        callback=callback)
+        callback=callback, workers=workers)
     return res1
 
 def etForAttribute(datal,a):
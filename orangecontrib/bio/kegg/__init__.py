@@ -169,6 +169,15 @@ class Organism(object):
         else:
             return [p.entry_id for p in self.api.list_pathways(self.org_code)]
 
+    def pathway_store(self, progress_callback=None):
+        """
+        Return a :class:`~.pathway.PathwayStore` with all pathways for
+        this organism (new or changed pathways are parsed and stored first).
+        """
+        store = pathway.PathwayStore(self.org_code)
+        store.update(self.pathways(), progress_callback=progress_callback)
+        return store
+
     def list_pathways(self):
         """
         List all pathways for this organism.
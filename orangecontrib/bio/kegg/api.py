@@ -339,6 +339,8 @@ KEGG api with caching
 """
 
 import os
+import threading
+import time
 
 from . import caching
 from .caching import cached_method, cache_entry, touch_dir
@@ -351,6 +353,29 @@ except ImportError:
     from Orange.utils import lru_cache
 
 
+#: Maximum number of requests per second made by :obj:`CachedKeggApi.pre_cache`
+rate_limit = 5
+
+
+class RateLimiter(object):
+    """
+    Limit the rate of calls to :func:`wait` (from any thread) to at most
+    `rate` per second.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
 class CachedKeggApi(KeggApi):
     def __init__(self, store=None):
         KeggApi.__init__(self)
@@ -366,7 +391,36 @@ class CachedKeggApi(KeggApi):
                                                  "kegg_api_cache_2.sqlite3"))
 
     def last_modified(self, args, kwargs=None):
-        return getattr(self, "default_release", "")
+        if not hasattr(self, "default_release"):
+            self.default_release = self.kegg_release() or ""
+        return self.default_release
+
+    def kegg_release(self):
+        """
+        Return the current KEGG release (or ``None`` if it is unknown).
+
+        The release is stored in the cache and only checked for updates
+        as often as set by the `cache.invalidate` setting. Cache entries
+        of other releases are invalid.
+        """
+        key = "kegg_release()"
+        with closing(self.cache_store()) as store:
+            try:
+                entry = store[key]
+            except KeyError:
+                entry = None
+            since = caching.invalidate_time()
+            if entry is not None and \
+                    (since is None or entry.mtime >= since):
+                return entry.value
+            try:
+                release = KeggApi.info(self, "kegg").release
+            except Exception:
+                # Offline; keep using the last known release
+                return entry.value if entry is not None else None
+            store[key] = cache_entry(release, mtime=datetime.now(),
+                                     release=release)
+            return release
 
     def set_default_release(self, release):
         self.default_release = release
@@ -403,56 +457,132 @@ class CachedKeggApi(KeggApi):
             raise ValueError("Can batch at most 10 ids at a time.")
 
         get = self.get
-        uncached = []
-        unmatched = set()
 
         with closing(get.cache_store()) as store:
-            # Which ids are already cached
-            # TODO: Invalidate entries by release string.
-            for id in ids:
-                key = get.key_from_args((id,))
-                if not get.key_has_valid_cache(key, store):
-                    uncached.append(id)
-
-        if uncached:
-            # in case there are duplicate ids
-            uncached = sorted(set(uncached))
-
-            rval = KeggApi.get(self, uncached)
-
-            if rval is not None:
-                entries = rval.split("///\n")
-            else:
-                entries = []
-
-            if entries and not entries[-1].strip():
-                # Delete the last single newline entry if present
-                del entries[-1]
-
-            if len(entries) != len(uncached):
-                new_uncached, entries = match_by_ids(uncached, entries)
-                unmatched = set(uncached) - set(new_uncached)
-                uncached = new_uncached
-                warnings.warn("Unable to match entries for keys: %s." %
-                              ", ".join(map(repr, unmatched)))
-
-            with closing(get.cache_store()) as store:
-                for id, entry in zip(uncached, entries):
-                    key = get.key_from_args((id,))
-                    if entry is not None:
-                        entry = entry + "///\n"
-                    store[key] = cache_entry(entry, mtime=datetime.now())
-
-        # Finally join all the results, but drop all None objects
-
-        with closing(get.cache_store()):
-            keys = [get.key_from_args((id,)) for id in ids]
-            entries = [store[key].value for key in keys]
-
-        entries = filter(lambda e: e is not None, entries)
-
-        rval = "".join(entries)
-        return rval
+            uncached = self._uncached(ids, store)
+            caching.statistics.add(hits=len(ids) - len(uncached),
+                                   misses=len(uncached))
+            if uncached:
+                self._store_entries(store, self._fetch_entries(uncached))
+
+            # Finally join all the results, but drop all None objects
+            # (and the entries that could not be retrieved)
+            entries = [self._cached_entry(id, store) for id in ids]
+
+        return "".join(e for e in entries if e is not None)
+
+    def _uncached(self, ids, store):
+        """
+        Return the `ids` without a valid cache entry in `store`.
+        """
+        get = self.get
+        return [id for id in ids
+                if not get.key_has_valid_cache(get.key_from_args((id,)), store)]
+
+    def _cached_entry(self, id, store):
+        try:
+            return store[self.get.key_from_args((id,))].value
+        except KeyError:
+            return None
+
+    def _fetch_entries(self, ids):
+        """
+        Retrieve the entries for (at most 10) `ids` from the service and
+        return a list of (id, entry text) pairs for ids that were matched.
+        Nothing is cached.
+        """
+        # in case there are duplicate ids
+        ids = sorted(set(ids))
+
+        rval = KeggApi.get(self, ids)
+
+        if rval is not None:
+            entries = rval.split("///\n")
+        else:
+            entries = []
+
+        if entries and not entries[-1].strip():
+            # Delete the last single newline entry if present
+            del entries[-1]
+
+        if len(entries) != len(ids):
+            matched, entries = match_by_ids(ids, entries)
+            unmatched = set(ids) - set(matched)
+            ids = matched
+            warnings.warn("Unable to match entries for keys: %s." %
+                          ", ".join(map(repr, unmatched)))
+
+        return [(id, entry + "///\n" if entry is not None else None)
+                for id, entry in zip(ids, entries)]
+
+    def _store_entries(self, store, entries):
+        """
+        Store (id, entry text) pairs in `store` (in a single transaction),
+        tagged with the current release, and evict the stale entries.
+        """
+        key_from_args = self.get.key_from_args
+        mtime = datetime.now()
+        release = self.last_modified(()) or None
+        store.update((key_from_args((id,)),
+                      cache_entry(entry, mtime=mtime, release=release))
+                     for id, entry in entries)
+        caching.evict(store, release)
+
+    def pre_cache(self, ids, batch_size=10, workers=4, progress_callback=None):
+        """
+        Retrieve entries for all `ids` that are not yet cached and store
+        them in the cache. The entries are requested in batches of
+        `batch_size` (at most 10) ids by a pool of `workers` threads,
+        at most :obj:`rate_limit` requests per second. The fetched entries
+        are stored in groups of several batches in single transactions.
+        """
+        if batch_size > 10 or batch_size < 1:
+            raise ValueError("Invalid batch_size")
+
+        from multiprocessing.pool import ThreadPool
+
+        with closing(self.get.cache_store()) as store:
+            uncached = self._uncached(ids, store)
+            caching.statistics.add(hits=len(ids) - len(uncached),
+                                   misses=len(uncached))
+            ids = uncached
+            batches = [ids[i: i + batch_size]
+                       for i in range(0, len(ids), batch_size)]
+            if not batches:
+                return
+
+            limiter = RateLimiter(rate_limit)
+
+            def fetch(batch):
+                limiter.wait()
+                return batch, self._fetch_entries(batch)
+
+            pending = []
+            done = 0
+            with closing(ThreadPool(max(1, min(workers, len(batches))))) as pool:
+                try:
+                    for batch, entries in pool.imap_unordered(fetch, batches):
+                        # the cache store is only used from this thread
+                        pending.extend(entries)
+                        if len(pending) >= 100:
+                            self._store_entries(store, pending)
+                            pending = []
+                        done += len(batch)
+                        if progress_callback:
+                            progress_callback(100.0 * done / len(ids))
+                finally:
+                    if pending:
+                        self._store_entries(store, pending)
+
+    def get_entries(self, ids):
+        """
+        Return a list of entry texts for `ids` (``None`` for entries that
+        could not be retrieved). Uncached entries are first retrieved
+        with :obj:`pre_cache`.
+        """
+        self.pre_cache(ids)
+        with closing(self.get.cache_store()) as store:
+            return [self._cached_entry(id, store) for id in ids]
 
     @cached_method
     def conv(self, target_db, source):
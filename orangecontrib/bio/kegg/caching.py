@@ -3,13 +3,18 @@ Caching framework for cached kegg api calls.
 
 """
 import os
+import glob
 import sqlite3
+import threading
+import time
+import zlib
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 
 from contextlib import closing
+from collections import OrderedDict
 
 from datetime import datetime, date, timedelta
 from . import conf
@@ -35,24 +40,145 @@ class Store(object):
         pass
 
 
+class LRUCache(object):
+    """
+    A thread safe mapping of at most `maxsize` most recently used items.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            self._items[key] = value
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
 class Sqlite3Store(Store, DictMixin):
+    """
+    A persistent mapping of string keys to picklable values in an sqlite3
+    database file. Values are stored pickled and compressed.
+
+    The database is opened in WAL mode (readers in other connections are
+    not blocked by a writer). Every modification is committed
+    immediately, unless it is made inside a ``with store:`` block or by
+    :func:`update`, which commit all their modifications in a single
+    transaction.
+
+    Recently used values are also kept (unpickled) in an in-process LRU
+    cache of `cache_size` items, which is shared by all stores of the
+    same file.
+
+    Each value is stored with its modification time, size and (for
+    :class:`cache_entry` values) the KEGG release, which are used by
+    :func:`evict`.
+    """
+    _front_caches = {}
+    _lock = threading.Lock()
 
-    def __init__(self, filename):
+    def __init__(self, filename, cache_size=1000):
         self.filename = filename
         self.con = sqlite3.connect(filename)
+        self._depth = 0
+
+        path = os.path.realpath(filename)
+        with Sqlite3Store._lock:
+            if path not in Sqlite3Store._front_caches:
+                Sqlite3Store._front_caches[path] = LRUCache(cache_size)
+            self.front_cache = Sqlite3Store._front_caches[path]
+
+        try:
+            self.con.execute("PRAGMA journal_mode=WAL")
+            self.con.execute("PRAGMA synchronous=NORMAL")
+        except sqlite3.DatabaseError:
+            # e.g. WAL is not supported on some network file systems
+            pass
+
         self.con.execute("""
             CREATE TABLE IF NOT EXISTS cache
                 (key TEXT UNIQUE,
-                 value TEXT
+                 value TEXT,
+                 mtime REAL,
+                 size INTEGER,
+                 release TEXT
                 )
         """)
+        # Add the columns missing in tables created by older versions
+        columns = [r[1] for r in self.con.execute("PRAGMA table_info(cache)")]
+        for column, type in [("mtime", "REAL"), ("size", "INTEGER"),
+                             ("release", "TEXT")]:
+            if column not in columns:
+                self.con.execute("ALTER TABLE cache ADD COLUMN %s %s" %
+                                 (column, type))
+        # Redundant (key is UNIQUE) index created by older versions
         self.con.execute("""
-            CREATE INDEX IF NOT EXISTS cache_index
-            ON cache (key)
+            DROP INDEX IF EXISTS cache_index
         """)
         self.con.commit()
 
+    @staticmethod
+    def _dumps(value):
+        return sqlite3.Binary(
+            zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+
+    @staticmethod
+    def _loads(data):
+        data = bytes(data) if six.PY3 else str(data)
+        try:
+            data = zlib.decompress(data)
+        except zlib.error:
+            # An uncompressed value stored by an older version
+            pass
+        return pickle.loads(data)
+
+    def _commit(self):
+        if not self._depth:
+            self.con.commit()
+
+    def __enter__(self):
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, *args):
+        self._depth -= 1
+        if not self._depth:
+            if exc_type is None:
+                self.con.commit()
+            else:
+                self.con.rollback()
+                self.front_cache.clear()
+
     def __getitem__(self, key):
+        missing = self
+        value = self.front_cache.get(key, missing)
+        if value is not missing:
+            return value
+
         cur = self.con.execute("""
             SELECT value
             FROM cache
@@ -62,28 +188,52 @@ class Sqlite3Store(Store, DictMixin):
         if not r:
             raise KeyError(key)
         else:
-            pickle_str = r[0][0]
-            if not six.PY3:
-                pickle_str = str(pickle_str)
             try:
-                return pickle.loads(pickle_str)
+                value = self._loads(r[0][0])
             except Exception:
                 raise KeyError(key)
+            self.front_cache.set(key, value)
+            return value
 
     def __setitem__(self, key, value):
-        value = pickle.dumps(value)
-        self.con.execute("""
-            INSERT OR REPLACE INTO cache
-            VALUES (?, ?)
-        """, (key, value))
-        self.con.commit()
+        self.update([(key, value)])
+
+    def update(self, items=(), **kwargs):
+        """Store all (key, value) items in a single transaction."""
+        if hasattr(items, "keys"):
+            items = [(key, items[key]) for key in items.keys()]
+        items = list(items) + list(kwargs.items())
+        mtime = time.time()
+        rows = []
+        for key, value in items:
+            data = self._dumps(value)
+            rows.append((key, data, mtime, len(data),
+                         getattr(value, "release", None)))
+        self.con.executemany("""
+            INSERT OR REPLACE INTO cache (key, value, mtime, size, release)
+            VALUES (?, ?, ?, ?, ?)
+        """, rows)
+        self._commit()
+        for key, value in items:
+            self.front_cache.set(key, value)
 
     def __delitem__(self, key):
+        self.front_cache.discard(key)
         self.con.execute("""
             DELETE FROM cache
             WHERE key=?
         """, (key,))
-        self.con.commit()
+        self._commit()
+
+    def __contains__(self, key):
+        if self.front_cache.get(key, self) is not self:
+            return True
+        cur = self.con.execute("""
+            SELECT 1
+            FROM cache
+            WHERE key=?
+        """, (key,))
+        return cur.fetchone() is not None
 
     def keys(self):
         cur = self.con.execute("""
@@ -92,15 +242,85 @@ class Sqlite3Store(Store, DictMixin):
         """)
         return [str(r[0]) for r in cur.fetchall()]
 
+    def evict(self, release=None, max_size=None, max_age=None, limit=None):
+        """
+        Remove (in a single transaction) the entries
+
+            * not tagged with `release` (if given),
+            * stored more than `max_age` seconds ago (if given),
+            * and the oldest entries while the total size of the stored
+              values exceeds `max_size` bytes (if given),
+
+        but at most `limit` entries. Return the number of removed entries.
+        """
+        conditions, params = [], []
+        if release is not None:
+            conditions.append("release IS NULL OR release != ?")
+            params.append(release)
+        if max_age is not None:
+            conditions.append("COALESCE(mtime, 0) < ?")
+            params.append(time.time() - max_age)
+
+        keys = []
+        if conditions:
+            query = "SELECT key FROM cache WHERE " + " OR ".join(
+                "(%s)" % c for c in conditions)
+            if limit is not None:
+                query += " LIMIT %i" % limit
+            keys = [r[0] for r in self.con.execute(query, params)]
+
+        if max_size is not None and (limit is None or len(keys) < limit):
+            removed = set(keys)
+            total = self.stats()["bytes"]
+            cur = self.con.execute("""
+                SELECT key, COALESCE(size, length(value))
+                FROM cache
+                ORDER BY COALESCE(mtime, 0)
+            """)
+            for key, size in cur:
+                if total <= max_size or \
+                        (limit is not None and len(keys) >= limit):
+                    break
+                total -= size
+                if key not in removed:
+                    keys.append(key)
+            cur.close()
+
+        with self:
+            self.con.executemany("""
+                DELETE FROM cache
+                WHERE key=?
+            """, [(key,) for key in keys])
+        for key in keys:
+            self.front_cache.discard(key)
+        return len(keys)
+
+    def stats(self):
+        """
+        Return a dictionary with the number of stored `entries` and the
+        total size of their (compressed) values in `bytes`.
+        """
+        entries, size = self.con.execute("""
+            SELECT COUNT(*), SUM(COALESCE(size, length(value)))
+            FROM cache
+        """).fetchone()
+        return {"entries": entries, "bytes": size or 0}
+
     def close(self):
-        pass
+        if self._depth:
+            self.con.commit()
+            self._depth = 0
+        self.con.close()
 
     def __len__(self):
-        return None
+        cur = self.con.execute("""
+            SELECT COUNT(*)
+            FROM cache
+        """)
+        return cur.fetchone()[0]
 
     def __iter__(self):
-        return None
-
+        return iter(self.keys())
 
 
 class DictStore(Store, DictMixin):
@@ -119,14 +339,131 @@ class DictStore(Store, DictMixin):
 
 
 class cache_entry(object):
-    def __init__(self, value, mtime=None, expires=None):
+    def __init__(self, value, mtime=None, expires=None, release=None):
         self.value = value
         self.mtime = mtime
         self.expires = expires
+        self.release = release
 
 _SESSION_START = datetime.now()
 
 
+class CacheStatistics(object):
+    """
+    Numbers of cache hits, misses and evicted entries in this session.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.hits = self.misses = self.evicted = 0
+
+    def add(self, hits=0, misses=0, evicted=0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.evicted += evicted
+
+statistics = CacheStatistics()
+
+
+def invalidate_time():
+    """
+    Return the time before which the checks for updates (of the KEGG
+    release) are outdated by the `cache.invalidate` setting ("always",
+    "session", "daily" or "weekly"). Return ``None`` if they never are.
+    """
+    invalidate = conf.params["cache.invalidate"]
+    if invalidate == "always":
+        return datetime.max
+    elif invalidate == "session":
+        return _SESSION_START
+    elif invalidate == "daily":
+        return datetime.now().replace(hour=0, minute=0, second=0,
+                                      microsecond=0)
+    elif invalidate == "weekly":
+        return datetime.now() - timedelta(7)
+    else:
+        return None
+
+
+def eviction_policy():
+    """
+    Return the maximal size (in bytes) and age (in seconds) of the
+    entries in each cache store as set by `cache.max_size` (in MB) and
+    `cache.max_age` (in days). ``None`` (set as 0) means unlimited.
+
+    The size limit applies to the (compressed) values in each
+    :class:`Sqlite3Store` separately. Other files in the cache path
+    (KGML files, images and pathway databases) are not counted and are
+    only removed by :func:`clear_cache`.
+    """
+    max_size = float(conf.params["cache.max_size"]) * 2 ** 20
+    max_age = float(conf.params["cache.max_age"]) * 24 * 60 * 60
+    return (int(max_size) if max_size > 0 else None,
+            max_age if max_age > 0 else None)
+
+
+#: Minimal interval (in seconds) between evictions from the same store
+evict_interval = 60
+
+_last_evicted = {}
+
+
+def evict(store, release=None, limit=1000):
+    """
+    Remove at most `limit` entries from `store` that are stale (not of
+    the `release`) or are beyond the limits of :func:`eviction_policy`
+    (for this store).
+    Called after entries are stored, so that stale entries are dropped
+    incrementally (at most every :obj:`evict_interval` seconds).
+    """
+    key = (os.path.realpath(store.filename), release)
+    now = time.time()
+    if now - _last_evicted.get(key, 0) < evict_interval:
+        return 0
+    _last_evicted[key] = now
+
+    max_size, max_age = eviction_policy()
+    evicted = store.evict(release=release, max_size=max_size,
+                          max_age=max_age, limit=limit)
+    statistics.add(evicted=evicted)
+    return evicted
+
+
+def _is_cache_store(filename):
+    """Is `filename` a :class:`Sqlite3Store` database."""
+    try:
+        with closing(sqlite3.connect(filename)) as con:
+            return con.execute(
+                "SELECT name FROM sqlite_master "
+                "WHERE type='table' AND name='cache'").fetchone() is not None
+    except sqlite3.DatabaseError:
+        return False
+
+
+def cache_stats():
+    """
+    Return a dictionary with the numbers of cache `hits`, `misses` and
+    `evicted` entries in this session, and the number of `entries` and
+    their `bytes` in all cache stores (the sizes limited by
+    :func:`eviction_policy`; other files in the cache path are not
+    included).
+    """
+    stats = {"hits": statistics.hits, "misses": statistics.misses,
+             "evicted": statistics.evicted, "entries": 0, "bytes": 0}
+    path = conf.params["cache.path"]
+    for filename in glob.glob(os.path.join(path, "*.sqlite3")):
+        if not _is_cache_store(filename):
+            continue
+        with closing(Sqlite3Store(filename)) as store:
+            store_stats = store.stats()
+        stats["entries"] += store_stats["entries"]
+        stats["bytes"] += store_stats["bytes"]
+    return stats
+
+
 class cached_wrapper(object):
     """
     TODO: needs documentation
@@ -162,7 +499,7 @@ class cached_wrapper(object):
 
     def invalidate_all(self):
         prefix = self.key_from_args(()).rstrip(",)")
-        with self.cache_store() as store:
+        with closing(self.cache_store()) as store, store:
             for key in store:
                 if key.startswith(prefix):
                     del store[key]
@@ -172,64 +509,41 @@ class cached_wrapper(object):
         if timestamp is None:
             timestamp = datetime.now()
 
+        release = self.last_modified_from_args(args, kwargs) or None
         with closing(self.cache_store()) as store:
-            store[key] = cache_entry(value, mtime=timestamp)
+            store[key] = cache_entry(value, mtime=timestamp, release=release)
 
     def __call__(self, *args):
         key = self.key_from_args(args)
         with closing(self.cache_store()) as store:
             if self.key_has_valid_cache(key, store):
+                statistics.add(hits=1)
                 rval = store[key].value
             else:
+                statistics.add(misses=1)
                 rval = self.function(self.instance, *args)
-                store[key] = cache_entry(rval, datetime.now(), None)
+                release = self.last_modified_from_args(args) or None
+                store[key] = cache_entry(rval, datetime.now(), None,
+                                         release=release)
+                evict(store, release)
 
         return rval
 
     def key_has_valid_cache(self, key, store):
-        if key not in store:
+        try:
+            entry = store[key]
+        except KeyError:
             return False
         else:
-            entry = store[key]
             return self.is_entry_valid(entry, None)
 
     def is_entry_valid(self, entry, args):
-        # For now always return True, the caching architecture needs to be
-        # completely reworked
+        release = self.last_modified_from_args(args)
+        if release:
+            # Entries of other (or unknown) KEGG releases are stale
+            return getattr(entry, "release", None) == release
         return True
 
-        # Need to check datetime first (it subclasses date)
-        if isinstance(entry.mtime, datetime):
-            mtime = entry.mtime
-        elif isinstance(entry.mtime, date):
-            mtime = datetime(entry.mtime.year, entry.mtime.month,
-                             entry.mtime.day, 1, 1, 1)
-        else:
-            return False
-
-        last_modified = self.last_modified_from_args(args)
-
-        if isinstance(last_modified, date):
-            last_modified = datetime(last_modified.year, last_modified.month,
-                                     last_modified.day, 1, 1, 1)
-        elif isinstance(last_modified, str):
-            # Could have different format
-            mtime = mtime.strftime("%Y %m %d %H %M %S")
-
-        elif last_modified is None:
-            if conf.params["cache.invalidate"] == "always":
-                return False
-            elif conf.params["cache.invalidate"] == "session":
-                last_modified = _SESSION_START
-            elif conf.params["cache.invalidate"] == "daily":
-                last_modified = datetime.now().replace(hour=0, minute=0,
-                                                       second=0, microsecond=0)
-            elif conf.params["cache.invalidate"] == "weekly":
-                last_modified = datetime.now() - timedelta(7)
-            else:  # ???
-                pass
-        return last_modified <= mtime
-
 
 class cached_method(object):
     def __init__(self, function):
@@ -271,15 +585,18 @@ def touch_dir(path):
 def clear_cache():
     """Clear all locally cached KEGG data.
     """
-    import glob
     path = conf.params["cache.path"]
     if os.path.realpath(path) != os.path.realpath(conf.kegg_dir):
         raise Exception("Non default cache path. Please remove the contents "
                         "of %r manually." % path)
 
-    for cache_filename in glob.glob(os.path.join(path, "*.sqlite3")):
+    for cache_filename in glob.glob(os.path.join(path, "*.sqlite3*")):
         os.remove(cache_filename)
 
+    with Sqlite3Store._lock:
+        Sqlite3Store._front_caches.clear()
+    _last_evicted.clear()
+
     for ko_filename in glob.glob(os.path.join(path, "*.keg")):
         os.remove(ko_filename)
 
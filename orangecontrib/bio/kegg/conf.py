@@ -23,6 +23,11 @@ default = """
 path = %(kegg_dir)s/
 store = sqlite3
 invalidate = weekly
+# maximal size in MB of the cached API responses in each cache store
+# (*.sqlite3 file) and age of entries in days (0 = unlimited); KGML files,
+# images and pathway databases in the cache path are not limited
+max_size = 512
+max_age = 0
 
 [service]
 transport = urllib2
@@ -49,6 +54,8 @@ _ALL_PARAMS = [
     "cache.path",
     "cache.store",
     "cache.invalidate",
+    "cache.max_size",
+    "cache.max_age",
     "service.transport"
 ]
 
@@ -7,7 +7,6 @@ from __future__ import absolute_import
 
 import sys
 import re
-from contextlib import closing
 
 from . import entry
 from .entry import fields
@@ -74,8 +73,6 @@ class DBDataBase(object):
 
         self.api = api.CachedKeggApi()
         self._info = None
-        #TODO invalidate cache by KEGG release
-        #self.api.set_default_release(self.info.release)
         self._keys = []
 
     @property
@@ -204,11 +201,13 @@ class DBDataBase(object):
         res = self.api.find(self.DB, name).splitlines()
         return [r.split(" ", 1)[0] for r in res]
 
-    def pre_cache(self, keys=None, batch_size=10, progress_callback=None):
+    def pre_cache(self, keys=None, batch_size=10, progress_callback=None,
+                  workers=4):
         """
         Retrieve all the entries for `keys` and cache them locally for faster
         subsequent retrieval. If `keys` is ``None`` then all entries will be
-        retrieved.
+        retrieved. Batches of `batch_size` entries are retrieved by
+        `workers` concurrent threads (see :obj:`.api.CachedKeggApi.pre_cache`).
 
         """
         if not isinstance(self.api, api.CachedKeggApi):
@@ -220,28 +219,10 @@ class DBDataBase(object):
         if keys is None:
             keys = self.keys()
 
-        keys = map(self._add_db, keys)
-
-        get = self.api.get
-
-        # drop all keys with a valid cache entry to minimize the number
-        # of 'get' requests.
-        with closing(get.cache_store()) as store:
-            def is_uncached(key):
-                cache_key = get.key_from_args((key,))
-                return not get.key_has_valid_cache(cache_key, store)
-            keys = [key for key in keys if is_uncached(key)]
-
-        start = 0
-
-        while start < len(keys):
-            batch = keys[start: start + batch_size]
-            self.api.get(batch)
-
-            if progress_callback:
-                progress_callback(100.0 * start / len(keys))
+        keys = list(map(self._add_db, keys))
 
-            start += batch_size
+        self.api.pre_cache(keys, batch_size=batch_size, workers=workers,
+                           progress_callback=progress_callback)
 
     def batch_get(self, keys):
         """
@@ -251,25 +232,33 @@ class DBDataBase(object):
 
         """
         entries = []
-        batch_size = 10
         keys = list(map(self._add_db, keys))
 
-        # Precache the entries first
-        self.pre_cache(keys)
-
-        start = 0
-        while start < len(keys):
-            batch = keys[start: start + batch_size]
-            batch_entries = self.api.get(batch)
-            if batch_entries is not None:
-                batch_entries = batch_entries.split("///\n")
+        # Precaches the entries first
+        for text in self.api.get_entries(keys):
+            if text is not None:
                 # Remove possible empty last line
-                batch_entries = [e for e in batch_entries if e.strip()]
-                entries.extend(map(self.ENTRY_TYPE, batch_entries))
-            start += batch_size
+                entries.extend(self.ENTRY_TYPE(e) for e in text.split("///\n")
+                               if e.strip())
 
         return entries
 
+    def batch_get_sections(self, keys, sections):
+        """
+        Batch retrieve the entries for `keys` like :obj:`batch_get`, but
+        only extract the text of the `sections` (e.g. ``["NAME",
+        "PATHWAY"]``) without constructing the `ENTRY_TYPE` instances.
+        Return a dict mapping section titles (and 'ENTRY') to lists of
+        section texts (``None`` if missing in an entry) in the order of
+        the retrieved entries.
+
+        """
+        keys = list(map(self._add_db, keys))
+        texts = [text for text in self.api.get_entries(keys)
+                 if text is not None]
+        parser = entry.DBGETEntryParser()
+        return parser.parse_columns("".join(texts), sections)
+
     def _add_db(self, key):
         """
         Prefix the key with '%(DB)s:' string if not already prefixed.
@@ -451,11 +440,18 @@ class Genes(DBDataBase):
         self._keys = self.api.get_genes_by_organism(org_code)
 
     def gene_aliases(self):
+        columns = self.batch_get_sections(self.keys(), ["NAME", "DBLINKS"])
         aliases = {}
-        for entry in self.itervalues():
+        for entry_text, name, dblinks in zip(columns["ENTRY"],
+                                             columns["NAME"],
+                                             columns["DBLINKS"]):
+            entry_key = entry_text.split(" ", 1)[0]
+            names = name.split(",") if name else []
+            links = fields.DBDBLinks(dblinks)._convert() if dblinks else {}
             aliases.update(
-                dict.fromkeys(entry.aliases(),
-                              self.org_code + ":" + entry.entry_key)
+                dict.fromkeys([entry_key] + names +
+                              [link[0] for link in links.values()],
+                              self.org_code + ":" + entry_key)
             )
 
         return aliases
@@ -4,6 +4,8 @@ A parser for DBGET database entries
 """
 from __future__ import print_function
 
+import re
+
 from six import StringIO
 
 
@@ -134,6 +136,75 @@ class DBGETEntryParser(object):
     def parse_string(self, string):
         return self.parse(StringIO(string))
 
+    def parse_columns(self, text, sections):
+        r"""
+        Extract only the `sections` from (concatenated, '///' separated)
+        entries in `text` without generating the events. Return a dict
+        mapping section titles (and 'ENTRY') to lists with the text
+        of the section in each entry (``None`` if an entry has no such
+        section). Subsections are skipped and the text of repeated
+        sections is joined.
+
+        ::
+
+            >>> parser = DBGETEntryParser()
+            >>> columns = parser.parse_columns(
+            ...     "ENTRY       foo\n"
+            ...     "NAME        foo's name\n"
+            ...     "            continued\n"
+            ...     "///\n"
+            ...     "ENTRY       bar\n"
+            ...     "///\n", ["NAME"])
+            ...
+            >>> columns["ENTRY"]
+            ['foo', 'bar']
+            >>> columns["NAME"]
+            ["foo's name\ncontinued", None]
+
+        """
+        sections = ["ENTRY"] + [s for s in sections if s != "ENTRY"]
+        match = re.search(r"^ENTRY( +)", text, re.M)
+        offset = len("ENTRY") + len(match.group(1)) if match else 12
+        indent = "\n" + " " * offset
+        # Matching the newline before the titles is much faster than '^'
+        pattern = re.compile(
+            r"\n(?:(%s)(?: +|$)(.*(?:\n {%i}.*)*)|(///))" %
+            ("|".join(map(re.escape, sections)), offset), re.M)
+
+        columns = dict((title, []) for title in sections)
+
+        def add(row):
+            for title in sections:
+                columns[title].append(row.get(title))
+
+        row = None
+        for title, value, end in pattern.findall("\n" + text):
+            if end:
+                if row is not None:
+                    add(row)
+                row = None
+                continue
+            elif title == "ENTRY":
+                if row is not None:
+                    add(row)
+                row = {}
+            elif row is None:
+                # Not inside an entry
+                continue
+
+            value = value.replace(indent, "\n")
+            if value.startswith("\n"):
+                # No contents on the title line
+                value = value[1:]
+            if title in row:
+                row[title] += "\n" + value
+            else:
+                row[title] = value
+
+        if row is not None:
+            add(row)
+        return columns
+
     def _partition_section_title(self, line):
         """
         Split the section title from the rest of the line
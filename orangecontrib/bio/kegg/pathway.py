@@ -7,10 +7,13 @@ KEGG Pathway
 from __future__ import absolute_import
 
 import os
+import sqlite3
 
 import xml.parsers
 from xml.dom import minidom
+from xml.etree import ElementTree
 
+from collections import namedtuple, defaultdict
 from contextlib import closing
 from functools import reduce
 
@@ -339,3 +342,231 @@ class Pathway(object):
         """
         kegg = api.CachedKeggApi()
         return kegg.list_pathways(organism)
+
+
+PathwayEntry = namedtuple("PathwayEntry", ["id", "name", "type", "link"])
+
+PathwayRelation = namedtuple(
+    "PathwayRelation", ["entry1", "entry2", "type", "subtypes"])
+
+
+def parse_kgml(source):
+    """
+    Parse a KGML file (a filename or an open file) with a streaming
+    parser. Return a (pathway attributes, entries, relations) tuple,
+    where entries and relations are lists of :class:`PathwayEntry` and
+    :class:`PathwayRelation`.
+    """
+    attributes, entries, relations = {}, [], []
+    subtypes = []
+    context = ElementTree.iterparse(source, events=("start", "end"))
+    for event, element in context:
+        tag = element.tag
+        if event == "start":
+            if tag == "pathway":
+                attributes = dict(element.attrib)
+            elif tag == "relation":
+                subtypes = []
+            continue
+
+        if tag == "entry":
+            get = element.get
+            entries.append(PathwayEntry(int(get("id")), get("name"),
+                                        get("type"), get("link")))
+        elif tag == "subtype":
+            subtypes.append((element.get("name"), element.get("value")))
+        elif tag == "relation":
+            get = element.get
+            relations.append(PathwayRelation(int(get("entry1")),
+                                             int(get("entry2")),
+                                             get("type"), subtypes))
+        if tag != "pathway":
+            # Free the already processed subtrees
+            element.clear()
+    return attributes, entries, relations
+
+
+class PathwayStore(object):
+    """
+    A local store of all KEGG pathways of an organism. The pathways'
+    KGML files are parsed once (see :func:`update`) into entry and
+    relation tables and an inverted gene to pathways index in an sqlite3
+    database (in `local_cache`).
+
+    :param str org: KEGG organism code (e.g. 'hsa').
+
+    """
+    _ATTRIBUTES = ["name", "org", "number", "title", "image", "link"]
+
+    def __init__(self, org, local_cache=None):
+        if local_cache is None:
+            local_cache = conf.params["cache.path"]
+        self.org = org
+        self.local_cache = local_cache
+        self._index = None
+
+    @property
+    def filename(self):
+        return os.path.join(self.local_cache,
+                            "pathways_%s.sqlite" % self.org)
+
+    def _connect(self):
+        caching.touch_dir(self.local_cache)
+        con = sqlite3.connect(self.filename)
+        con.executescript("""
+            CREATE TABLE IF NOT EXISTS pathway
+                (id TEXT PRIMARY KEY, name TEXT, org TEXT, number TEXT,
+                 title TEXT, image TEXT, link TEXT, mtime REAL);
+            CREATE TABLE IF NOT EXISTS entry
+                (pathway TEXT, id INTEGER, name TEXT, type TEXT, link TEXT);
+            CREATE TABLE IF NOT EXISTS relation
+                (pathway TEXT, entry1 INTEGER, entry2 INTEGER, type TEXT,
+                 subtypes TEXT);
+            CREATE TABLE IF NOT EXISTS gene
+                (gene TEXT, pathway TEXT);
+            CREATE INDEX IF NOT EXISTS entry_pathway ON entry (pathway);
+            CREATE INDEX IF NOT EXISTS relation_pathway ON relation (pathway);
+            CREATE INDEX IF NOT EXISTS gene_gene ON gene (gene);
+        """)
+        return con
+
+    @staticmethod
+    def _pathway_id(pathway_id):
+        if not pathway_id.startswith("path:"):
+            pathway_id = "path:" + pathway_id
+        return pathway_id
+
+    def update(self, pathway_ids=None, workers=4, progress_callback=None):
+        """
+        Download (with `workers` threads) the missing KGML files of
+        `pathway_ids` (all pathways of the organism by default) and store
+        the pathways with new or changed KGML files.
+        """
+        from multiprocessing.pool import ThreadPool
+
+        if pathway_ids is None:
+            pathway_ids = [p.entry_id for p in Pathway.list(self.org)]
+        pathways = [Pathway(pid, local_cache=self.local_cache)
+                    for pid in pathway_ids]
+        caching.touch_dir(self.local_cache)
+
+        missing = [p for p in pathways
+                   if not os.path.exists(p._local_kgml_filename())]
+        if missing:
+            with closing(ThreadPool(max(1, min(workers, len(missing))))) \
+                    as pool:
+                pool.map(lambda p: p._get_kgml().close(), missing)
+
+        with closing(self._connect()) as con:
+            stored = dict(con.execute("SELECT id, mtime FROM pathway"))
+            for i, p in enumerate(pathways):
+                pid = self._pathway_id(p.pathway_id)
+                mtime = os.stat(p._local_kgml_filename()).st_mtime
+                if stored.get(pid) != mtime:
+                    self._store_pathway(con, pid, p._local_kgml_filename(),
+                                        mtime)
+                if progress_callback:
+                    progress_callback(100.0 * (i + 1) / len(pathways))
+            con.commit()
+        self._index = None
+
+    def _store_pathway(self, con, pathway_id, filename, mtime):
+        con.execute("DELETE FROM pathway WHERE id=?", (pathway_id,))
+        for table in ["entry", "relation", "gene"]:
+            con.execute("DELETE FROM %s WHERE pathway=?" % table,
+                        (pathway_id,))
+        try:
+            attributes, entries, relations = parse_kgml(filename)
+        except ElementTree.ParseError:
+            # An invalid (e.g. empty) KGML file
+            return
+
+        con.execute("INSERT INTO pathway VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [pathway_id] +
+                    [attributes.get(name) for name in self._ATTRIBUTES] +
+                    [mtime])
+        con.executemany("INSERT INTO entry VALUES (?, ?, ?, ?, ?)",
+                        [(pathway_id,) + e for e in entries])
+        con.executemany("INSERT INTO relation VALUES (?, ?, ?, ?, ?)",
+                        [(pathway_id, r.entry1, r.entry2, r.type,
+                          ";".join("%s=%s" % s for s in r.subtypes))
+                         for r in relations])
+        genes = set(name for e in entries if e.type == "gene"
+                    for name in e.name.split())
+        con.executemany("INSERT INTO gene VALUES (?, ?)",
+                        [(gene, pathway_id) for gene in genes])
+
+    def _query(self, query, args=()):
+        with closing(self._connect()) as con:
+            return con.execute(query, args).fetchall()
+
+    def pathways(self):
+        """
+        Return a list of all stored pathway ids.
+        """
+        return [r[0] for r in
+                self._query("SELECT id FROM pathway ORDER BY id")]
+
+    def pathway_attributes(self, pathway_id):
+        """
+        Return a dict with the pathway's attributes ('name', 'org',
+        'number', 'title', 'image' and 'link') or ``None`` if the pathway
+        is not stored.
+        """
+        rows = self._query(
+            "SELECT %s FROM pathway WHERE id=?" % ", ".join(self._ATTRIBUTES),
+            (self._pathway_id(pathway_id),))
+        return dict(zip(self._ATTRIBUTES, rows[0])) if rows else None
+
+    def entries(self, pathway_id):
+        """
+        Return a list of :class:`PathwayEntry` tuples of the pathway.
+        """
+        return [PathwayEntry(*r) for r in self._query(
+            "SELECT id, name, type, link FROM entry WHERE pathway=? "
+            "ORDER BY id", (self._pathway_id(pathway_id),))]
+
+    def relations(self, pathway_id):
+        """
+        Return a list of :class:`PathwayRelation` tuples of the pathway.
+        """
+        return [PathwayRelation(entry1, entry2, type,
+                                [tuple(s.split("=", 1))
+                                 for s in subtypes.split(";") if s])
+                for entry1, entry2, type, subtypes in self._query(
+                    "SELECT entry1, entry2, type, subtypes FROM relation "
+                    "WHERE pathway=? ORDER BY rowid",
+                    (self._pathway_id(pathway_id),))]
+
+    def genes(self, pathway_id):
+        """
+        Return a sorted list of all genes on the pathway.
+        """
+        return [r[0] for r in self._query(
+            "SELECT gene FROM gene WHERE pathway=? ORDER BY gene",
+            (self._pathway_id(pathway_id),))]
+
+    def gene_index(self):
+        """
+        Return a dict mapping genes to frozensets of pathways that
+        include them (loaded once from the store).
+        """
+        if self._index is None:
+            index = defaultdict(set)
+            for gene, pathway_id in self._query("SELECT gene, pathway "
+                                                "FROM gene"):
+                index[gene].add(pathway_id)
+            self._index = dict((gene, frozenset(pathways))
+                               for gene, pathways in index.items())
+        return self._index
+
+    def get_pathways_by_genes(self, gene_ids):
+        """
+        Return a sorted list of pathways that include all genes in
+        `gene_ids`.
+        """
+        index = self.gene_index()
+        pathways = [index.get(gene, frozenset()) for gene in set(gene_ids)]
+        if not pathways:
+            return []
+        return sorted(reduce(frozenset.intersection, pathways))
@@ -1,11 +1,220 @@
 import unittest
 import doctest
+import shutil
+import tempfile
+import threading
+import time
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import unquote
 
 from orangecontrib.bio import kegg
+from orangecontrib.bio.kegg import api, conf, databases, service
+
+
+def gene_entry(gene_id):
+    org, key = gene_id.split(":")
+    return ("ENTRY       %s              CDS       T01001\n"
+            "NAME        G%s, ALIAS%s\n"
+            "ORGANISM    %s  Homo sapiens (human)\n"
+            "DBLINKS     NCBI-GeneID: %s\n"
+            "            UniProt: P%s Q%s\n"
+            "///\n" % (key, key, key, org, key, key, key))
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """A stand-in for the KEGG REST api (only the 'list' and 'get'
+    operations on genes of organism 'hsa' and 'info' of 'kegg')."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        op, arg = unquote(self.path).strip("/").split("/", 1)
+        with server.lock:
+            server.requests.append((op, arg))
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            time.sleep(server.delay)
+            if op == "list" and arg == "hsa":
+                text = "".join("hsa:%i\tG%i; gene %i\n" % (i, i, i)
+                               for i in server.genes)
+            elif op == "get":
+                text = "".join(gene_entry(gene_id)
+                               for gene_id in arg.split("+")
+                               if int(gene_id.split(":")[1]) in server.genes)
+            elif op == "info" and arg == "kegg" and server.release:
+                text = ("kegg             Kyoto Encyclopedia of Genes and "
+                        "Genomes\n"
+                        "kegg             Release %s\n"
+                        "                 Kanehisa Laboratories\n" %
+                        server.release)
+            else:
+                text = ""
+        finally:
+            with server.lock:
+                server.active -= 1
+
+        if not text:
+            self.send_error(404)
+            return
+        data = text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, genes):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), Handler)
+        self.lock = threading.Lock()
+        self.genes = set(genes)
+        self.requests = []
+        self.active = self.max_active = 0
+        self.delay = 0.0
+        self.release = None
+
+
+class StandInTestCase(unittest.TestCase):
+    """Run tests against a local KEGG REST api stand-in with an empty
+    cache."""
+    genes = range(1, 96)
+
+    def setUp(self):
+        self.server = Server(self.genes)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.path = tempfile.mkdtemp()
+        self.cache_path = conf.params["cache.path"]
+        conf.params["cache.path"] = self.path
+        self.rest_api = service.REST_API
+        service.REST_API = "http://127.0.0.1:%i/" % \
+            self.server.server_address[1]
+        self.service = getattr(service.slumber_service, "_cached", None)
+        service.slumber_service.__dict__.pop("_cached", None)
+        self.rate_limit = api.rate_limit
+
+    def tearDown(self):
+        api.rate_limit = self.rate_limit
+        service.REST_API = self.rest_api
+        if self.service is not None:
+            service.slumber_service._cached = self.service
+        else:
+            service.slumber_service.__dict__.pop("_cached", None)
+        conf.params["cache.path"] = self.cache_path
+        shutil.rmtree(self.path)
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestApi(StandInTestCase):
+    def get_requests(self):
+        return [arg for op, arg in self.server.requests if op == "get"]
+
+    def test_pre_cache(self):
+        api.rate_limit = 1000
+        self.server.delay = 0.05
+        genes = databases.Genes("hsa")
+        keys = list(genes.keys())
+        self.assertEqual(len(keys), 95)
+
+        progress = []
+        genes.pre_cache(keys + ["hsa:1000"], workers=4,
+                        progress_callback=progress.append)
+        batches = [batch.split("+") for batch in self.get_requests()]
+        self.assertEqual(len(batches), 10)
+        self.assertTrue(all(len(batch) <= 10 for batch in batches))
+        self.assertEqual(sorted(sum(batches, [])),
+                         sorted(keys + ["hsa:1000"]))
+        self.assertGreater(self.server.max_active, 1)
+        self.assertEqual(progress[-1], 100.0)
+
+        # Everything is served from the cache
+        del self.server.requests[:]
+        entries = genes.batch_get(keys[::-1])
+        self.assertEqual(self.server.requests, [])
+        self.assertEqual([e.entry_key for e in entries],
+                         [key.split(":")[1] for key in keys[::-1]])
+        self.assertEqual(entries[0].name, "G95, ALIAS95")
+        self.assertEqual(genes["hsa:3"].entry_key, "3")
+        self.assertEqual(self.server.requests, [])
+
+        genes.pre_cache(keys)
+        self.assertEqual(self.server.requests, [])
+
+        # Entries are cached by their ids
+        store = api.CachedKeggApi().cache_store()
+        self.assertEqual(store[genes.api.get.key_from_args(("hsa:7",))].value,
+                         gene_entry("hsa:7"))
+
+    def test_batch_get(self):
+        genes = databases.Genes("hsa")
+        entries = genes.batch_get(["1", "hsa:2", "1000", "3"])
+        self.assertEqual([e.entry_key for e in entries], ["1", "2", "3"])
+        self.assertEqual(self.get_requests(), ["hsa:1+hsa:1000+hsa:2+hsa:3"])
+        self.assertEqual(genes.api.get(["hsa:3", "hsa:1"]),
+                         gene_entry("hsa:3") + gene_entry("hsa:1"))
+        self.assertEqual(len(self.get_requests()), 1)
+
+    def test_batch_get_sections(self):
+        genes = databases.Genes("hsa")
+        columns = genes.batch_get_sections(["3", "1000", "hsa:1"],
+                                           ["NAME", "PATHWAY"])
+        self.assertEqual(columns["NAME"], ["G3, ALIAS3", "G1, ALIAS1"])
+        self.assertEqual(columns["PATHWAY"], [None, None])
+        self.assertEqual([e.split()[0] for e in columns["ENTRY"]], ["3", "1"])
+
+        aliases = genes.gene_aliases()
+        expected = {}
+        for entry in genes.batch_get(genes.keys()):
+            expected.update(dict.fromkeys(entry.aliases(),
+                                          "hsa:" + entry.entry_key))
+        self.assertEqual(aliases, expected)
+        self.assertEqual(aliases[" ALIAS7"], "hsa:7")
+        self.assertEqual(aliases["P7"], "hsa:7")
+
+    def test_release(self):
+        self.server.release = "1.0"
+        invalidate = conf.params["cache.invalidate"]
+        conf.params["cache.invalidate"] = "always"
+        try:
+            kegg_api = api.CachedKeggApi()
+            self.assertEqual(kegg_api.kegg_release(), "1.0")
+            self.assertEqual(kegg_api.get(["hsa:1", "hsa:2"]),
+                             gene_entry("hsa:1") + gene_entry("hsa:2"))
+            kegg_api.get(["hsa:1"])
+            self.assertEqual(len(self.get_requests()), 1)
+
+            # Entries of the old release are not used after an update
+            self.server.release = "2.0"
+            kegg_api = api.CachedKeggApi()
+            kegg_api.get(["hsa:1"])
+            self.assertEqual(self.get_requests()[1:], ["hsa:1"])
 
+            # The last known release is used when offline
+            self.server.release = None
+            self.assertEqual(api.CachedKeggApi().kegg_release(), "2.0")
+        finally:
+            conf.params["cache.invalidate"] = invalidate
 
-class TestApi(unittest.TestCase):
-    pass
+    def test_rate_limiter(self):
+        limiter = api.RateLimiter(50)
+        start = time.time()
+        threads = [threading.Thread(target=limiter.wait) for _ in range(11)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertGreaterEqual(time.time() - start, 0.19)
 
 
 def load_tests(loader, tests, ignore):
@@ -0,0 +1,221 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from orangecontrib.bio.kegg import caching, conf
+
+
+class TestSqlite3Store(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, "store.sqlite3")
+
+    def tearDown(self):
+        caching.Sqlite3Store._front_caches.clear()
+        shutil.rmtree(self.path)
+
+    def test_store(self):
+        store = caching.Sqlite3Store(self.filename)
+        self.assertEqual(len(store), 0)
+        store["a"] = caching.cache_entry("A" * 1000)
+        store.update([("b", [1, 2]), ("c", None)], d={"x": 1})
+        self.assertEqual(len(store), 4)
+        self.assertEqual(sorted(store), ["a", "b", "c", "d"])
+        self.assertIn("c", store)
+        self.assertNotIn("e", store)
+        self.assertRaises(KeyError, lambda: store["e"])
+        del store["c"]
+        del store["e"]
+        self.assertEqual(sorted(store.keys()), ["a", "b", "d"])
+        store.close()
+
+        caching.Sqlite3Store._front_caches.clear()
+        store = caching.Sqlite3Store(self.filename)
+        self.assertEqual(store["a"].value, "A" * 1000)
+        self.assertEqual(store["b"], [1, 2])
+        self.assertEqual(store.get("c", "missing"), "missing")
+        store.close()
+
+        con = sqlite3.connect(self.filename)
+        mode = con.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode.lower(), "wal")
+        # Values are compressed, no redundant index
+        size = con.execute("SELECT length(value) FROM cache WHERE key='a'")
+        self.assertLess(size.fetchone()[0], 200)
+        self.assertEqual(con.execute(
+            "SELECT name FROM sqlite_master WHERE type='index' AND "
+            "name='cache_index'").fetchall(), [])
+        con.close()
+
+    def test_transaction(self):
+        store = caching.Sqlite3Store(self.filename)
+        reader = sqlite3.connect(self.filename)
+
+        def count():
+            return reader.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+        with store:
+            for i in range(10):
+                store[str(i)] = i
+            # Not committed yet, but readers are not blocked
+            self.assertEqual(count(), 0)
+        self.assertEqual(count(), 10)
+
+        try:
+            with store:
+                store["0"] = "changed"
+                store["x"] = 1
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(count(), 10)
+        self.assertEqual(store["0"], 0)
+        self.assertNotIn("x", store)
+        reader.close()
+        store.close()
+
+    def test_old_values(self):
+        con = sqlite3.connect(self.filename)
+        con.execute("CREATE TABLE cache (key TEXT UNIQUE, value TEXT)")
+        con.execute("CREATE INDEX cache_index ON cache (key)")
+        con.execute("INSERT INTO cache VALUES (?, ?)",
+                    ("a", pickle.dumps({"a": 1})))
+        con.commit()
+        con.close()
+
+        store = caching.Sqlite3Store(self.filename)
+        self.assertEqual(store["a"], {"a": 1})
+        store["b"] = caching.cache_entry(1, release="1.0")
+        self.assertEqual(store.stats()["entries"], 2)
+        # Untagged values are stale
+        self.assertEqual(store.evict(release="1.0"), 1)
+        self.assertEqual(list(store), ["b"])
+
+    def test_front_cache(self):
+        store = caching.Sqlite3Store(self.filename, cache_size=2)
+        store.update([("a", 1), ("b", 2), ("c", 3)])
+        self.assertEqual(len(store.front_cache), 2)
+        self.assertIsNone(store.front_cache.get("a"))
+        self.assertEqual(store["a"], 1)
+        self.assertIsNone(store.front_cache.get("b"))
+        # The front cache is shared by stores of the same file
+        other = caching.Sqlite3Store(self.filename)
+        self.assertIs(other.front_cache, store.front_cache)
+        del other["a"]
+        self.assertNotIn("a", store)
+
+
+    def test_evict(self):
+        store = caching.Sqlite3Store(self.filename)
+        store.update((str(i), caching.cache_entry(os.urandom(1000),
+                                                  release="1.0"))
+                     for i in range(10))
+        store.update((str(i), caching.cache_entry(os.urandom(1000),
+                                                  release="2.0"))
+                     for i in range(10, 20))
+        stats = store.stats()
+        self.assertEqual(stats["entries"], 20)
+        self.assertGreater(stats["bytes"], 20000)
+
+        self.assertEqual(store["0"].release, "1.0")
+        self.assertEqual(store.evict(release="2.0", limit=4), 4)
+        self.assertEqual(store.evict(release="2.0"), 6)
+        self.assertEqual(sorted(map(int, store)), list(range(10, 20)))
+        self.assertIsNone(store.front_cache.get("0"))
+
+        # The oldest entries are evicted first
+        store.con.execute("UPDATE cache SET mtime=? WHERE key IN ('12', '13')",
+                          (time.time() - 100,))
+        store.con.commit()
+        self.assertEqual(store.evict(max_size=store.stats()["bytes"] - 1), 1)
+        self.assertEqual(store.evict(max_age=50), 1)
+        self.assertNotIn("12", store)
+        self.assertNotIn("13", store)
+        self.assertEqual(store.evict(max_size=3500), 5)
+        self.assertLessEqual(store.stats()["bytes"], 3500)
+        self.assertEqual(store.evict(max_size=0), 3)
+        self.assertEqual(store.stats(), {"entries": 0, "bytes": 0})
+
+
+class TestCachedMethod(unittest.TestCase):
+    class Api(object):
+        def __init__(self, filename):
+            self.filename = filename
+            self.release = "1.0"
+            self.calls = 0
+
+        def cache_store(self):
+            return caching.Sqlite3Store(self.filename)
+
+        def last_modified(self, args, kwargs=None):
+            return self.release
+
+        @caching.cached_method
+        def square(self, x):
+            self.calls += 1
+            return x * x
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache_path = conf.params["cache.path"]
+        conf.params["cache.path"] = self.path
+        caching.statistics.reset()
+
+    def tearDown(self):
+        conf.params["cache.path"] = self.cache_path
+        caching.Sqlite3Store._front_caches.clear()
+        caching._last_evicted.clear()
+        shutil.rmtree(self.path)
+
+    def test_release(self):
+        api = self.Api(os.path.join(self.path, "api.sqlite3"))
+        self.assertEqual([api.square(i) for i in [1, 2, 1]], [1, 4, 1])
+        self.assertEqual(api.calls, 2)
+
+        stats = caching.cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+        self.assertEqual(stats["entries"], 2)
+        self.assertGreater(stats["bytes"], 0)
+
+        # Entries of an old release are invalid, and evicted
+        api.release = "2.0"
+        self.assertEqual(api.square(1), 1)
+        self.assertEqual(api.calls, 3)
+        stats = caching.cache_stats()
+        self.assertEqual((stats["entries"], stats["evicted"]), (1, 1))
+
+    def test_eviction_policy(self):
+        max_size, max_age = (conf.params["cache.max_size"],
+                             conf.params["cache.max_age"])
+        try:
+            conf.params["cache.max_size"] = "0"
+            conf.params["cache.max_age"] = "1"
+            self.assertEqual(caching.eviction_policy(), (None, 86400))
+            conf.params["cache.max_size"] = "1"
+            conf.params["cache.max_age"] = "0"
+            self.assertEqual(caching.eviction_policy(), (2 ** 20, None))
+        finally:
+            conf.params["cache.max_size"] = max_size
+            conf.params["cache.max_age"] = max_age
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_lru(self):
+        cache = caching.LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(len(cache), 2)
+        cache.discard("a")
+        self.assertEqual(cache.get("a", 0), 0)
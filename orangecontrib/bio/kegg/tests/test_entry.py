@@ -43,6 +43,28 @@ class TestParser(unittest.TestCase):
         for event, title, text in parse.parse(stream):
             pass
 
+    def test_parse_columns(self):
+        text = (TEST_ENTRY +
+                "ENTRY       second\n"
+                "DESCRIPTION\n"
+                "            on the next line\n"
+                "NAMES       not a NAME\n"
+                "///\n" +
+                TEST_ENTRY.replace("test_id", "third").replace("///\n", ""))
+        columns = parser.DBGETEntryParser().parse_columns(
+            text, ["NAME", "DESCRIPTION", "OTHER"])
+        self.assertEqual(sorted(columns),
+                         ["DESCRIPTION", "ENTRY", "NAME", "OTHER"])
+        self.assertEqual(columns["OTHER"], [None, None, None])
+        self.assertEqual(columns["NAME"], ["test", None, "test"])
+        self.assertEqual(columns["DESCRIPTION"][1], "on the next line")
+
+        # Same as the contents of the parsed entries (without subsections)
+        entries = [Entry(e) for e in text.split("///\n")]
+        self.assertEqual(columns["ENTRY"], [e.entry for e in entries])
+        self.assertEqual(columns["DESCRIPTION"],
+                         [e.DESCRIPTION.text.rstrip("\n") for e in entries])
+
 
 def load_tests(loader, tests, ignore):
     tests.addTests(doctest.DocTestSuite(parser))
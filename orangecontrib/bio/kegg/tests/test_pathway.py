@@ -0,0 +1,126 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from contextlib import closing
+
+from orangecontrib.bio.kegg import caching, conf, pathway
+
+
+KGML = """\
+<?xml version="1.0"?>
+<!DOCTYPE pathway SYSTEM "http://www.kegg.jp/kegg/xml/KGML_v0.7.1_.dtd">
+<pathway name="path:hsa%(number)s" org="hsa" number="%(number)s"
+         title="Pathway %(number)s"
+         image="http://www.kegg.jp/kegg/pathway/hsa/hsa%(number)s.png"
+         link="http://www.kegg.jp/kegg-bin/show_pathway?hsa%(number)s">
+    <entry id="1" name="%(genes)s" type="gene"
+        link="http://www.kegg.jp/dbget-bin/www_bget?hsa:1">
+        <graphics name="G1" type="rectangle" x="1" y="2" width="46" height="17"/>
+    </entry>
+    <entry id="2" name="hsa:%(number)s" type="gene">
+        <graphics name="G2" type="rectangle" x="1" y="2" width="46" height="17"/>
+    </entry>
+    <entry id="3" name="cpd:C00031" type="compound">
+        <graphics name="C00031" type="circle" x="3" y="4" width="8" height="8"/>
+    </entry>
+    <relation entry1="1" entry2="2" type="PPrel">
+        <subtype name="activation" value="--&gt;"/>
+        <subtype name="phosphorylation" value="+p"/>
+    </relation>
+    <relation entry1="2" entry2="3" type="ECrel"/>
+</pathway>
+"""
+
+
+class TestPathwayStore(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.pathways = {"00010": "hsa:1 hsa:2", "00020": "hsa:1 hsa:3",
+                         "00030": "hsa:2"}
+        for number, genes in self.pathways.items():
+            self.write(number, genes)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, number, genes):
+        filename = os.path.join(self.path, "hsa%s.xml" % number)
+        with open(filename, "w") as f:
+            f.write(KGML % {"number": number, "genes": genes})
+
+    def store(self):
+        store = pathway.PathwayStore("hsa", local_cache=self.path)
+        store.update(["path:hsa" + number for number in self.pathways])
+        return store
+
+    def test_store(self):
+        store = self.store()
+        self.assertEqual(store.pathways(),
+                         ["path:hsa00010", "path:hsa00020", "path:hsa00030"])
+        p = pathway.Pathway("path:hsa00020", local_cache=self.path)
+        self.assertEqual(store.genes("path:hsa00020"), p.genes())
+        self.assertEqual(store.pathway_attributes("hsa00020"),
+                         p.pathway_attributes())
+        self.assertIsNone(store.pathway_attributes("hsa99999"))
+
+        entries = store.entries("path:hsa00010")
+        self.assertEqual([(e.id, e.type) for e in entries],
+                         [(1, "gene"), (2, "gene"), (3, "compound")])
+        self.assertEqual(entries[0].name, "hsa:1 hsa:2")
+        self.assertIsNone(entries[1].link)
+        self.assertEqual(store.relations("path:hsa00010"), [
+            (1, 2, "PPrel", [("activation", "-->"),
+                             ("phosphorylation", "+p")]),
+            (2, 3, "ECrel", [])])
+
+    def test_cache_stats(self):
+        store = self.store()
+        other = os.path.join(self.path, "other.sqlite3")
+        with closing(sqlite3.connect(other)) as con:
+            con.execute("CREATE TABLE foo (bar)")
+        cache_path = conf.params["cache.path"]
+        conf.params["cache.path"] = self.path
+        try:
+            stats = caching.cache_stats()
+        finally:
+            conf.params["cache.path"] = cache_path
+        self.assertEqual(stats["entries"], 0)
+        # Databases other than cache stores are left alone
+        for filename in [store.filename, other]:
+            with closing(sqlite3.connect(filename)) as con:
+                self.assertNotIn(("cache",), con.execute(
+                    "SELECT name FROM sqlite_master").fetchall())
+                self.assertNotEqual(con.execute(
+                    "PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_index(self):
+        store = self.store()
+        self.assertEqual(store.get_pathways_by_genes(["hsa:1"]),
+                         ["path:hsa00010", "path:hsa00020"])
+        self.assertEqual(store.get_pathways_by_genes(["hsa:1", "hsa:2"]),
+                         ["path:hsa00010"])
+        self.assertEqual(store.get_pathways_by_genes(["hsa:4"]), [])
+        self.assertEqual(store.get_pathways_by_genes([]), [])
+        self.assertEqual(store.gene_index()["hsa:00030"],
+                         frozenset(["path:hsa00030"]))
+
+        # Only changed pathways are parsed again
+        self.write("00030", "hsa:1")
+        filename = os.path.join(self.path, "hsa00030.xml")
+        os.utime(filename, (time.time() + 10, time.time() + 10))
+        store = self.store()
+        self.assertEqual(store.get_pathways_by_genes(["hsa:1", "hsa:2"]),
+                         ["path:hsa00010"])
+        self.assertEqual(len(store.get_pathways_by_genes(["hsa:1"])), 3)
+
+        # Invalid KGML files are not stored
+        with open(filename, "w") as f:
+            f.write("")
+        os.utime(filename, (time.time() + 20, time.time() + 20))
+        store = self.store()
+        self.assertEqual(len(store.pathways()), 2)
+        self.assertEqual(store.entries("hsa00030"), [])
@@ -44,11 +44,13 @@ See the definition of the `.obo file format <http://www.geneontology.org/GO.form
 """
 from __future__ import print_function
 import sys
+import gc
 import re
 import warnings
 import keyword
 from collections import defaultdict
 import six
+import numpy
 
 from six import StringIO
 
@@ -64,6 +66,8 @@ except NameError:
     basestring = str
     intern = sys.intern
 
+from .utils import arraycache, progress_bar_milestones
+
 #: These are builtin OBO objects present in any ontology by default.
 BUILTIN_OBO_OBJECTS = [
 """[Typedef]
@@ -514,6 +518,277 @@ class OBOParser(object):
         return self.parse()
 
 
+class _CompiledOBO(object):
+    """
+    A compiled (tokenized) .obo file.
+
+    All strings (tags, values, modifiers, comments) are stored once in a
+    newline separated utf-8 string table and referenced by integer codes,
+    so the compiled ontology can be saved to and memory mapped from an on
+    disk cache (see :mod:`orangecontrib.bio.utils.arraycache`). Strings are
+    only decoded when a stanza is requested.
+
+    Arrays:
+        * `stanza_type`, `stanza_id` - string codes of stanza types and ids
+          (-1 for stanzas without an id)
+        * `stanza_ptr` - stanza `i` has tag lines `stanza_ptr[i]` up to
+          `stanza_ptr[i + 1]`
+        * `lines` - a (4, n_lines) array of (tag, value, modifiers, comment)
+          codes (-1 for a missing modifier or comment)
+        * `relations` - a (3, n_relations) array of (source stanza,
+          relation type code, target code) for all `is_a` and
+          `relationship` tags
+
+    Consumers can store additional (derived) arrays in the cache (any
+    array not in the above list is preserved).
+
+    """
+    #: Version of the on disk (cache) format.
+    version = 1
+
+    def __init__(self, header, codes, arrays):
+        self.header = header
+        self.codes = codes
+        self.arrays = arrays
+        self._table = None
+        self._blob = None
+
+    @classmethod
+    def parse(cls, file, progress_callback=None):
+        """
+        Compile the contents of an open .obo `file`.
+        """
+        data = file.read()
+        if isinstance(data, bytes) and not isinstance(data, str):
+            data = data.decode("utf-8")
+        lines = data.splitlines()
+
+        strings = {}
+        def code(string):
+            if string is None:
+                return -1
+            c = strings.get(string)
+            if c is None:
+                c = strings[string] = len(strings)
+            return c
+
+        header = []
+        stanza_type, stanza_id, stanza_ptr = [], [], [0]
+        tag_lines, relations = [], []
+        current = None
+
+        def close():
+            stanza_ptr.append(len(tag_lines))
+            stanza_id.append(ids[0] if ids else -1)
+
+        milestones = progress_bar_milestones(len(lines), 100)
+        for i, line in enumerate(lines):
+            if line.startswith("[") and line.endswith("]"):
+                if current is not None:
+                    close()
+                current = line.strip("[]")
+                stanza_type.append(code(current))
+                ids = []
+            elif line.startswith("!"):
+                pass
+            elif current is None:
+                if tag_lines or stanza_type:
+                    # A tag outside of any stanza
+                    continue
+                header.append(line)
+            elif line.strip():
+                if ":" not in line:
+                    continue
+                tag, value, modifiers, comment = parse_tag_value(line)
+                tag_lines.append((code(tag), code(value), code(modifiers),
+                                  code(comment)))
+                if tag == "id":
+                    ids.append(tag_lines[-1][1])
+                elif tag == "is_a":
+                    relations.append((len(stanza_type) - 1, code(tag),
+                                      tag_lines[-1][1]))
+                elif tag == "relationship":
+                    rel = value.split(None, 1)
+                    if len(rel) == 2:
+                        relations.append((len(stanza_type) - 1,
+                                          code(rel[0]), code(rel[1])))
+            else:
+                close()
+                current = None
+            if progress_callback and i in milestones:
+                progress_callback(100.0 * i / len(lines))
+        if current is not None:
+            close()
+
+        table = sorted(strings, key=strings.get)
+        encoded = [s if isinstance(s, bytes) else s.encode("utf-8")
+                   for s in table]
+        offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum([len(s) + 1 for s in encoded])
+        blob = numpy.frombuffer(b"\n".join(encoded), dtype=numpy.uint8)
+
+        def array(rows, width):
+            return numpy.array(rows, dtype=numpy.int32).reshape(-1, width).T
+
+        arrays = {
+            "stanza_type": numpy.array(stanza_type, dtype=numpy.int32),
+            "stanza_id": numpy.array(stanza_id, dtype=numpy.int32),
+            "stanza_ptr": numpy.array(stanza_ptr, dtype=numpy.int64),
+            "lines": numpy.ascontiguousarray(array(tag_lines, 4)),
+            "relations": numpy.ascontiguousarray(array(relations, 3)),
+            "blob": blob,
+            "offsets": offsets
+        }
+        # Codes of the (few) tag names and stanza types.
+        codes = dict((table[c], c)
+                     for c in set(stanza_type) | set(t[0] for t in tag_lines))
+        compiled = cls("".join(line + "\n" for line in header), codes, arrays)
+        compiled._table = table
+        return compiled
+
+    @classmethod
+    def load(cls, path, revision):
+        """
+        Load a compiled cache from `path`. Return `None` if the cache does
+        not exist or is not for `revision`.
+        """
+        cached = arraycache.load(path, version=cls.version,
+                                 revision=revision)
+        if cached is None:
+            return None
+        meta, arrays = cached
+        return cls(meta["header"], meta["codes"], arrays)
+
+    def save(self, path, revision):
+        """
+        Save the compiled ontology to a cache directory `path`.
+        """
+        meta = {"version": self.version, "revision": revision,
+                "header": self.header, "codes": self.codes}
+        arraycache.save(path, meta, self.arrays)
+
+    @classmethod
+    def cached(cls, filename, opener=None, progress_callback=None,
+               extra=None):
+        """
+        Return the compiled contents of a .obo `filename`, using (and if
+        needed updating) the cache next to it.
+
+        :param function opener:
+            A function opening `filename` for reading (default `open`).
+        :param function extra:
+            A function returning a dictionary of derived arrays to store in
+            the cache with a newly compiled ontology.
+
+        """
+        path = arraycache.cache_path(filename)
+        revision = arraycache.file_revision(filename)
+        compiled = cls.load(path, revision)
+        if compiled is None:
+            f = (opener or open)(filename)
+            try:
+                compiled = cls.parse(f, progress_callback)
+            finally:
+                f.close()
+            if extra is not None:
+                compiled.arrays.update(extra(compiled))
+            try:
+                compiled.save(path, revision)
+            except (IOError, OSError) as ex:
+                warnings.warn("Could not save the ontology cache (%s)" % ex,
+                              UserWarning)
+        return compiled
+
+    def __len__(self):
+        return len(self.arrays["stanza_type"])
+
+    def table(self):
+        """
+        Return the (decoded) string table.
+        """
+        if self._table is None:
+            blob = self.arrays["blob"]
+            if len(self.arrays["offsets"]) > 1:
+                blob = blob.tobytes()
+                if not isinstance(blob, str):
+                    blob = blob.decode("utf-8")
+                self._table = blob.split("\n")
+            else:
+                self._table = []
+        return self._table
+
+    def string(self, code):
+        """
+        Return the string with `code` (`None` for -1).
+        """
+        if code < 0:
+            return None
+        elif self._table is not None:
+            return self._table[code]
+        if self._blob is None:
+            self._blob = memoryview(self.arrays["blob"])
+        offsets = self.arrays["offsets"]
+        s = self._blob[offsets[code]: offsets[code + 1] - 1].tobytes()
+        return s if isinstance(s, str) else s.decode("utf-8")
+
+    def stanzas(self, stanza_type=None):
+        """
+        Return the indices of stanzas (of `stanza_type`).
+        """
+        types = self.arrays["stanza_type"]
+        if stanza_type is None:
+            return numpy.arange(len(types))
+        elif stanza_type not in self.codes:
+            return numpy.arange(0)
+        return numpy.flatnonzero(types == self.codes[stanza_type])
+
+    def stanza_type(self, i):
+        return self.string(self.arrays["stanza_type"][i])
+
+    def stanza_id(self, i):
+        return self.string(self.arrays["stanza_id"][i])
+
+    def stanza_lines(self, i):
+        """
+        Return a list of (tag, value, modifiers, comment) tuples of
+        stanza `i`.
+        """
+        ptr = self.arrays["stanza_ptr"]
+        lines = self.arrays["lines"][:, ptr[i]: ptr[i + 1]].T.tolist()
+        string = self.string
+        return [tuple(string(c) for c in line) for line in lines]
+
+    def iter_stanzas(self):
+        """
+        Iterate over all (stanza type, stanza lines) pairs.
+        """
+        table = self.table()
+        ptr = self.arrays["stanza_ptr"].tolist()
+        lines = [[table[c] if c >= 0 else None for c in column]
+                 for column in self.arrays["lines"].tolist()]
+        lines = list(zip(*lines))
+        for i, stanza_type in enumerate(self.arrays["stanza_type"].tolist()):
+            yield table[stanza_type], lines[ptr[i]: ptr[i + 1]]
+
+    def tag_values(self, tag, stanzas=None):
+        """
+        Return a list of (stanza index, value) pairs for all `tag` lines
+        (in `stanzas` if given).
+        """
+        if tag not in self.codes:
+            return []
+        lines = self.arrays["lines"]
+        rows = numpy.flatnonzero(lines[0] == self.codes[tag])
+        owner = numpy.searchsorted(self.arrays["stanza_ptr"], rows,
+                                   side="right") - 1
+        if stanzas is not None:
+            mask = numpy.isin(owner, stanzas)
+            rows, owner = rows[mask], owner[mask]
+        string = self.string
+        return [(s, string(v))
+                for s, v in zip(owner.tolist(), lines[1, rows].tolist())]
+
+
 class OBOOntology(object):
     """
     An class representing an OBO ontology.
@@ -557,37 +832,46 @@ class OBOOntology(object):
         """
         self.header_tags.append((tag, value))
 
-    def load(self, file, progress_callback=None):
+    def load(self, file, progress_callback=None, use_cache=False):
         """
         Load terms from a file.
 
         :param file-like file:
-            A file-like like object describing the ontology in obo format.
+            A file-like like object (or a filename) describing the
+            ontology in obo format.
         :param function progress_callback:
             An optional function callback to report on the progress.
+        :param bool use_cache:
+            If `file` is a filename, load it from (and if needed save it
+            to) a compiled cache next to the file.
 
         """
         if isinstance(file, basestring):
-            file = open(file, "rb")
+            if use_cache:
+                compiled = _CompiledOBO.cached(file, progress_callback=
+                                               progress_callback)
+            else:
+                with open(file, "rb") as f:
+                    compiled = _CompiledOBO.parse(f, progress_callback)
+        else:
+            compiled = _CompiledOBO.parse(file, progress_callback)
 
-        parser = OBOParser(file)
-        current = None
-        tag_values = []
-        for event, value in parser.parse(progress_callback=progress_callback):
-            if event == "TAG_VALUE":
-                tag_values.append(value)
-            elif event == "START_STANZA":
-                current = OBOObject(value)
-            elif event == "CLOSE_STANZA":
-                current.add_tags(tag_values)
-                self.add_object(current)
-                current = None
-                tag_values = []
-            elif event == "HEADER_TAG":
-                self.add_header_tag(*value)
-            elif event != "COMMENT":
-                raise Exception("Parse Error! Unknown parse "
-                                "event {0}".format(event))
+        for line in compiled.header.splitlines():
+            if line.strip():
+                tag, value, _, _ = parse_tag_value(line)
+                self.add_header_tag(tag, value)
+
+        # The cyclic GC only slows down creating many (acyclic) objects
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for stanza_type, lines in compiled.iter_stanzas():
+                obj = OBOObject(stanza_type)
+                obj.add_tags(lines)
+                self.add_object(obj)
+        finally:
+            if gc_enabled:
+                gc.enable()
 
         imports = [value for tag, value in self.header_tags
                    if tag == "import"]
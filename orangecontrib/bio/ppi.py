@@ -1,6 +1,11 @@
 from __future__ import absolute_import
 
 import os
+import io
+import hashlib
+import tempfile
+import time
+import multiprocessing
 try:
     from urllib2 import urlopen
 except ImportError:
@@ -17,7 +22,11 @@ import textwrap
 
 from io import StringIO
 from collections import defaultdict, namedtuple
+from contextlib import closing
 from operator import itemgetter
+from array import array
+
+import numpy
 
 from .utils import serverfiles
 try:
@@ -40,6 +49,174 @@ def mkdir_p(path, mode=0o777):
             raise
 
 
+def _unique(seq):
+    """
+    Return a list of unique items in `seq` (in the order of appearance).
+    """
+    seen = set()
+    return [item for item in seq
+            if item not in seen and not seen.add(item)]
+
+
+def _csr_positions(indptr, rows):
+    """
+    Return the positions (in `indices`) of all entries in `rows` of a
+    CSR matrix with `indptr`.
+    """
+    starts, ends = indptr[rows], indptr[rows + 1]
+    counts = ends - starts
+    if not counts.sum():
+        return numpy.zeros(0, dtype=indptr.dtype)
+    # Offsets of the positions from the start of their row
+    offsets = numpy.arange(counts.sum()) - \
+        numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    return numpy.repeat(starts, counts) + offsets
+
+
+class Adjacency(object):
+    """
+    An in-memory adjacency (CSR) structure of a PPI network.
+
+    :param nodes: A list of protein ids (node `i` is ``nodes[i]``).
+    :param numpy.ndarray indptr: Node `i` neighbours are
+        ``indices[indptr[i]:indptr[i + 1]]``.
+    :param numpy.ndarray indices: Neighbour node indices.
+    :param numpy.ndarray weights: Edge weights (scores).
+
+    """
+    def __init__(self, nodes, indptr, indices, weights):
+        self.nodes = list(nodes)
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self._node_index = dict((id, i) for i, id in enumerate(self.nodes))
+
+    @classmethod
+    def from_edges(cls, edges, symmetric=True):
+        """
+        Construct the adjacency from (id1, id2, score) tuples. If
+        `symmetric` add the reverse of each edge. Duplicated edges are
+        only included once.
+        """
+        node_index = {}
+        # (compact arrays instead of lists of python objects)
+        rows, cols, weights = array("l"), array("l"), array("d")
+        nan = float("nan")
+        for id1, id2, score in edges:
+            rows.append(node_index.setdefault(id1, len(node_index)))
+            cols.append(node_index.setdefault(id2, len(node_index)))
+            weights.append(score if score is not None else nan)
+        rows = numpy.frombuffer(rows, dtype=numpy.dtype("l")) \
+            if rows else numpy.zeros(0, dtype=int)
+        cols = numpy.frombuffer(cols, dtype=numpy.dtype("l")) \
+            if cols else numpy.zeros(0, dtype=int)
+        weights = numpy.frombuffer(weights, dtype=float) \
+            if weights else numpy.zeros(0)
+        if symmetric:
+            rows, cols = (numpy.concatenate([rows, cols]),
+                          numpy.concatenate([cols, rows]))
+            weights = numpy.concatenate([weights, weights])
+
+        n = len(node_index)
+        # Sort by (row, col) and drop duplicates
+        order = numpy.lexsort((cols, rows))
+        rows, cols, weights = rows[order], cols[order], weights[order]
+        unique = numpy.ones(len(rows), dtype=bool)
+        unique[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        rows, cols, weights = rows[unique], cols[unique], weights[unique]
+
+        # The smallest index type (scipy.sparse can use without a copy)
+        itype = numpy.int32 if max(n, len(cols)) < 2 ** 31 else numpy.int64
+        indptr = numpy.zeros(n + 1, dtype=itype)
+        numpy.cumsum(numpy.bincount(rows, minlength=n), out=indptr[1:])
+        nodes = [None] * n
+        for id, i in node_index.items():
+            nodes[i] = id
+        return cls(nodes, indptr, cols.astype(itype), weights)
+
+    _FILES = ["indptr", "indices", "weights"]
+
+    def save(self, path):
+        """
+        Save the node ids (`nodes.txt`) and the CSR arrays (`indptr.npy`,
+        `indices.npy` and `weights.npy`) in the `path` directory.
+        """
+        mkdir_p(path)
+        with io.open(os.path.join(path, "nodes.txt"), "w",
+                     encoding="utf-8") as f:
+            for id in self.nodes:
+                f.write(u"%s\n" % id)
+        for name in self._FILES:
+            numpy.save(os.path.join(path, name + ".npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """
+        Load an adjacency saved in `path` (by :func:`save`). The arrays
+        are memory-mapped (see :func:`numpy.load`) unless `mmap_mode` is
+        ``None``.
+        """
+        with io.open(os.path.join(path, "nodes.txt"), encoding="utf-8") as f:
+            nodes = [line.rstrip("\n") for line in f]
+        return cls(nodes, *[numpy.load(os.path.join(path, name + ".npy"),
+                                       mmap_mode=mmap_mode)
+                            for name in cls._FILES])
+
+    def tocsr(self):
+        """
+        Return the adjacency as a :class:`scipy.sparse.csr_matrix`
+        (sharing the possibly memory-mapped arrays).
+        """
+        import scipy.sparse
+        n = len(self.nodes)
+        return scipy.sparse.csr_matrix(
+            (self.weights, self.indices, self.indptr), shape=(n, n),
+            copy=False)
+
+    def node_indices(self, ids):
+        """
+        Return an array of node indices for `ids` (unknown ids are skipped).
+        """
+        get = self._node_index.get
+        return numpy.array([i for i in map(get, ids) if i is not None],
+                           dtype=numpy.int64)
+
+    def neighbourhood(self, ids, depth=1):
+        """
+        Return a sorted array of indices of nodes at most `depth`
+        edges away from `ids`.
+        """
+        visited = numpy.zeros(len(self.nodes), dtype=bool)
+        frontier = numpy.unique(self.node_indices(ids))
+        visited[frontier] = True
+        for _ in range(depth):
+            if not len(frontier):
+                break
+            neighbours = self.indices[_csr_positions(self.indptr, frontier)]
+            frontier = numpy.unique(neighbours[~visited[neighbours]])
+            visited[frontier] = True
+        return numpy.flatnonzero(visited)
+
+    def subnetwork(self, ids, depth=1):
+        """
+        Return the nodes at most `depth` edges away from `ids` and the
+        edges between them (listed in both directions) as a
+        (list of ids, list of (id1, id2, score) tuples) pair.
+        """
+        nodes = self.neighbourhood(ids, depth)
+        members = numpy.zeros(len(self.nodes), dtype=bool)
+        members[nodes] = True
+        positions = _csr_positions(self.indptr, nodes)
+        sources = numpy.repeat(nodes, numpy.diff(self.indptr)[nodes])
+        targets = self.indices[positions]
+        mask = members[targets]
+        names = self.nodes
+        edges = [(names[i], names[j], w) for i, j, w in
+                 zip(sources[mask].tolist(), targets[mask].tolist(),
+                     self.weights[positions][mask].tolist())]
+        return [names[i] for i in nodes.tolist()], edges
+
+
 class PPIDatabase(object):
     """
     A general interface for protein-protein interaction database access.
@@ -98,6 +275,142 @@ class PPIDatabase(object):
         """
         raise NotImplementedError
 
+    def edges_many(self, ids):
+        """
+        Return a list of all edges (3-tuples (id1, id2, score)) of
+        all proteins in `ids` (with a single query where supported).
+        """
+        edges = []
+        for id in _unique(ids):
+            edges.extend(self.edges(id))
+        return edges
+
+    def synonyms_many(self, ids):
+        """
+        Return a dictionary mapping primary `ids` to lists of their synonyms.
+        """
+        return dict((id, self.synonyms(id)) for id in ids)
+
+    def subnetwork(self, ids, depth=1, adjacency=None):
+        """
+        Return the proteins at most `depth` interactions away from `ids`
+        and the interactions between them as a (list of ids, list of
+        (id1, id2, score) tuples) pair. The neighbourhood is expanded
+        with one :func:`edges_many` query per level, or in memory if
+        an :class:`Adjacency` (see :func:`adjacency`) is given.
+
+        """
+        if adjacency is not None:
+            return adjacency.subnetwork(ids, depth)
+
+        nodes = set(ids)
+        frontier = nodes
+        edges = []
+        for level in range(depth + 1):
+            if not frontier:
+                break
+            level_edges = self.edges_many(frontier)
+            edges.extend(level_edges)
+            if level < depth:
+                neighbours = set(id for edge in level_edges
+                                 for id in edge[:2])
+                frontier = neighbours - nodes
+                nodes.update(frontier)
+        edges = [e for e in _unique(edges) if e[0] in nodes and e[1] in nodes]
+        return sorted(nodes), edges
+
+    def _query_ids(self, ids):
+        """
+        Fill a temporary `query_ids` table (in `self.db`) with `ids`
+        for joins in bulk queries (use a 'cross join' to make it the
+        outer loop, otherwise SQLite can choose to scan the joined table).
+        """
+        self.db.execute("""\
+            create temp table if not exists query_ids
+                (id text primary key)""")
+        self.db.execute("delete from query_ids")
+        self.db.executemany("insert or ignore into query_ids values (?)",
+                            ((id,) for id in ids))
+
+    def _iter_all_edges(self, taxid=None):
+        """
+        Return an iterator over all edges (like :func:`all_edges`).
+        """
+        return iter(self.all_edges(taxid))
+
+    def _data_version(self):
+        return self.VERSION
+
+    def _data_revision(self):
+        """
+        Return a revision string of the database file (changes when the
+        database is rebuilt) or None for a database without a file.
+        """
+        filename = getattr(self, "filename", None)
+        if filename is None:
+            return None
+        stat = os.stat(filename)
+        return "%r-%i" % (stat.st_mtime, stat.st_size)
+
+    def adjacency(self, taxid=None):
+        """
+        Return an in-memory :class:`Adjacency` of all edges (for the
+        organism `taxid`).
+
+        .. note:: This may take some time (and memory).
+
+        """
+        return Adjacency.from_edges(self._iter_all_edges(taxid),
+                                    symmetric=True)
+
+    def export_adjacency(self, path=None, taxid=None):
+        """
+        Save the :func:`adjacency` (for the organism `taxid`) in a
+        subdirectory of `path` for this database version and file
+        revision (if not already saved) and remove the older exports.
+        Return the subdirectory.
+
+        `path` defaults to a directory next to the database file. A
+        database without a file is exported on every call.
+        """
+        if path is None:
+            if getattr(self, "filename", None) is None:
+                raise ValueError("'path' is required for an in-memory "
+                                 "database")
+            path = os.path.splitext(self.filename)[0] + ".adjacency"
+        version = "".join(c if c.isalnum() or c in "._-" else "_"
+                          for c in str(self._data_version()))
+        revision = self._data_revision()
+        prefix = "{0}_".format(taxid or "all")
+        dirname = os.path.join(path, prefix + version)
+        if revision is not None:
+            dirname += "_" + hashlib.md5(
+                revision.encode("ascii")).hexdigest()[:12]
+        if revision is None or not os.path.isdir(dirname):
+            mkdir_p(path)
+            tmpdir = tempfile.mkdtemp(prefix=prefix, suffix=".tmp", dir=path)
+            try:
+                self.adjacency(taxid).save(tmpdir)
+                # Remove the stale exports
+                for name in os.listdir(path):
+                    if name.startswith(prefix) and not name.endswith(".tmp"):
+                        shutil.rmtree(os.path.join(path, name),
+                                      ignore_errors=True)
+                os.rename(tmpdir, dirname)
+            except Exception:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+                raise
+        return dirname
+
+    def load_adjacency(self, path=None, taxid=None, mmap_mode="r"):
+        """
+        Return the memory-mapped :class:`Adjacency` (for the organism
+        `taxid`) exported in `path` (see :func:`export_adjacency`).
+        Use :func:`Adjacency.tocsr` for a :class:`scipy.sparse.csr_matrix`.
+        """
+        return Adjacency.load(self.export_adjacency(path, taxid),
+                              mmap_mode=mmap_mode)
+
     def all_edges_annotated(self, taxid=None):
         """
         Return a list of all edges annotated. If taxid is not None
@@ -129,14 +442,12 @@ class PPIDatabase(object):
         from Orange import network
 
         graph = network.Graph()
+        synonyms = self.synonyms_many(ids)
         for id in ids:
-            graph.add_node(id, synonyms=",".join(self.synonyms(id)))
-
-        for id in ids:
-            edges = self.edges(id)
+            graph.add_node(id, synonyms=",".join(synonyms[id]))
 
-            for id1, id2, score in edges:
-                graph.add_edge(id1, id2, weight=score)
+        for id1, id2, score in self.edges_many(ids):
+            graph.add_edge(id1, id2, weight=score)
 
         return graph
 
@@ -239,9 +550,11 @@ class BioGRID(PPIDatabase):
         "31033": None
     }
 
-    def __init__(self):
-        self.filename = serverfiles.localpath_download(
-            self.DOMAIN, self.SERVER_FILE)
+    def __init__(self, database=None):
+        if database is None:
+            database = serverfiles.localpath_download(
+                self.DOMAIN, self.SERVER_FILE)
+        self.filename = database
 
         # assert version matches
         self.db = sqlite3.connect(self.filename)
@@ -286,21 +599,47 @@ class BioGRID(PPIDatabase):
             (id,))
         rec = cur.fetchone()
         if rec:
-            synonyms = list(rec[:-1]) + \
-                       (rec[-1].split("|") if rec[-1] is not None else [])
-            return [s for s in synonyms if s is not None]
+            return self._synonyms(rec)
         else:
             return []
 
+    @staticmethod
+    def _synonyms(rec):
+        synonyms = list(rec[:-1]) + \
+                   (rec[-1].split("|") if rec[-1] is not None else [])
+        return [s for s in synonyms if s is not None]
+
+    def synonyms_many(self, ids):
+        """
+        Return a dictionary mapping primary `ids` to lists of their synonyms.
+        """
+        self._query_ids(ids)
+        cur = self.db.execute("""\
+            select biogrid_id_interactor,
+                   entrez_gene_interactor,
+                   systematic_name_interactor,
+                   official_symbol_interactor,
+                   synonyms_interactor
+            from query_ids cross join proteins on biogrid_id_interactor=id""")
+        synonyms = dict((id, []) for id in ids)
+        for rec in cur:
+            if not synonyms[rec[0]]:
+                synonyms[rec[0]] = self._synonyms(rec[1:])
+        return synonyms
+
     def all_edges(self, taxid=None):
         """
         Return a list of all edges. If taxid is not None return the
         edges for this organism only.
 
         """
+        edges = self._iter_all_edges(taxid).fetchall()
+        return edges
+
+    def _iter_all_edges(self, taxid=None):
         if taxid is not None:
             cur = self.db.execute("""\
-                select biogrid_id_interactor_a, biogrid_id_interactor_a, score
+                select biogrid_id_interactor_a, biogrid_id_interactor_b, score
                 from links left join proteins on
                     biogrid_id_interactor_a=biogrid_id_interactor or
                     biogrid_id_interactor_b=biogrid_id_interactor
@@ -308,11 +647,10 @@ class BioGRID(PPIDatabase):
             """, (taxid,))
         else:
             cur = self.db.execute("""\
-                select biogrid_id_interactor_a, biogrid_id_interactor_a, score
+                select biogrid_id_interactor_a, biogrid_id_interactor_b, score
                 from links
             """)
-        edges = cur.fetchall()
-        return edges
+        return cur
 
     def edges(self, id):
         """
@@ -320,12 +658,33 @@ class BioGRID(PPIDatabase):
         (a list of 3-tuples (id_a, id_b, score)).
 
         """
-
+        # (a union can use an index for each endpoint, unlike 'a=? or b=?')
         cur = self.db.execute("""\
             select biogrid_id_interactor_a, biogrid_id_interactor_b, score
             from links
-            where biogrid_id_interactor_a=? or biogrid_id_interactor_b=?
-        """, (id, id))
+            where biogrid_id_interactor_a=?
+            union all
+            select biogrid_id_interactor_a, biogrid_id_interactor_b, score
+            from links
+            where biogrid_id_interactor_b=? and biogrid_id_interactor_a!=?
+        """, (id, id, id))
+        return cur.fetchall()
+
+    def edges_many(self, ids):
+        """
+        Return a list of all interactions where any of `ids` is
+        a participant (a list of 3-tuples (id_a, id_b, score)).
+
+        """
+        self._query_ids(ids)
+        cur = self.db.execute("""\
+            select biogrid_id_interactor_a, biogrid_id_interactor_b, score
+            from query_ids cross join links on biogrid_id_interactor_a=id
+            union all
+            select biogrid_id_interactor_a, biogrid_id_interactor_b, score
+            from query_ids cross join links on biogrid_id_interactor_b=id
+            where biogrid_id_interactor_a not in (select id from query_ids)
+        """)
         return cur.fetchall()
 
     def all_edges_annotated(self, taxid=None):
@@ -492,13 +851,21 @@ class BioGRID(PPIDatabase):
         for faster searching by primary ids.
 
         """
+        # Covering indexes on both interactors (for edge queries)
+        self.db.execute("""\
+        create index if not exists index_on_biogrid_id_interactor_a_b
+           on links (biogrid_id_interactor_a, biogrid_id_interactor_b, score)
+        """)
+        self.db.execute("""\
+        create index if not exists index_on_biogrid_id_interactor_b_a
+           on links (biogrid_id_interactor_b, biogrid_id_interactor_a, score)
+        """)
+        # Made redundant by the above
         self.db.execute("""\
-        create index if not exists index_on_biogrid_id_interactor_a
-           on links (biogrid_id_interactor_a)
+        drop index if exists index_on_biogrid_id_interactor_a
         """)
         self.db.execute("""\
-        create index if not exists index_on_biogrid_id_interactor_b
-           on links (biogrid_id_interactor_b)
+        drop index if exists index_on_biogrid_id_interactor_b
         """)
         self.db.execute("""\
         create index if not exists index_on_biogrid_id_interactor
@@ -506,6 +873,68 @@ class BioGRID(PPIDatabase):
         """)
 
 
+def _string_batches(kind, filename, chunk_size=2 ** 22):
+    """
+    Parse a STRING flat file (of `kind` 'links', 'actions' or 'aliases')
+    and yield batches of rows (with the position in the compressed file).
+    """
+    # Intern the (repeated) protein ids
+    intern = {}.setdefault
+    sep = " " if kind == "links" else "\t"
+    with open(filename, "rb") as fileobj:
+        lines = io.TextIOWrapper(
+            io.BufferedReader(gzip.GzipFile(fileobj=fileobj)),
+            encoding="utf-8", errors="ignore")
+        lines.readline()  # read the header line
+        rest = ""
+        while True:
+            data = lines.read(chunk_size)
+            if not data:
+                break
+            # Split all complete lines of the chunk at once
+            end = data.rfind("\n") + 1
+            chunk, rest = rest + data[:end], data[end:]
+            if not chunk:
+                continue
+            nlines = chunk.count("\n")
+            ncols = chunk[:chunk.index("\n")].count(sep) + 1
+            fields = chunk.replace("\n", sep).split(sep)[:-1]
+            if len(fields) != ncols * nlines:
+                raise ValueError("Inconsistent number of columns in %r" %
+                                 filename)
+            columns = [fields[i::ncols] for i in range(ncols)]
+            if kind == "links":
+                p1, p2, score = columns
+                rows = zip(map(intern, p1, p1), map(intern, p2, p2),
+                           map(int, score))
+            elif kind == "actions":
+                p1, p2, mode, action = columns[:4]
+                rows = zip(map(intern, p1, p1), map(intern, p2, p2),
+                           mode, action, map(int, columns[-1]))
+            else:
+                taxid, name, alias, source = columns
+                ids = [t + "." + n for t, n in zip(taxid, name)]
+                rows = zip(map(intern, ids, ids), alias, source)
+            yield list(rows), fileobj.tell()
+        if rest.strip():
+            raise ValueError("Incomplete last line in %r" % filename)
+
+
+def _read_string_file(kind, filename, queue):
+    """
+    Put the batches of :func:`_string_batches` on the `queue` followed
+    by a ``(kind, None, None)`` message (or ``(kind, None, traceback)``
+    on error). Meant to run in a worker process (see :func:`STRING.init_db`).
+    """
+    try:
+        for rows, position in _string_batches(kind, filename):
+            queue.put((kind, rows, position))
+        queue.put((kind, None, None))
+    except Exception:
+        import traceback
+        queue.put((kind, None, traceback.format_exc()))
+
+
 STRINGInteraction = namedtuple(
     "STRINGInteraciton",
     ["protein_id1",
@@ -639,6 +1068,20 @@ class STRING(PPIDatabase):
         res = cur.fetchall()
         return [r[0] for r in res]
 
+    def synonyms_many(self, ids):
+        """
+        Return a dictionary mapping primary `ids` to lists of their synonyms.
+        """
+        self._query_ids(ids)
+        cur = self.db.execute("""\
+            select protein_id, alias
+            from query_ids cross join aliases on protein_id=id
+            """)
+        synonyms = dict((id, []) for id in ids)
+        for id, alias in cur:
+            synonyms[id].append(alias)
+        return synonyms
+
     def synonyms_with_source(self, id):
         """
         Return a list of synonyms for primary `id` along with its
@@ -662,6 +1105,9 @@ class STRING(PPIDatabase):
         .. note:: This may take some time (and memory).
 
         """
+        return self._iter_all_edges(taxid).fetchall()
+
+    def _iter_all_edges(self, taxid=None):
         if taxid is not None:
             cur = self.db.execute("""\
                 select links.protein_id1, links.protein_id2, score
@@ -671,10 +1117,18 @@ class STRING(PPIDatabase):
                 """, (taxid,))
         else:
             cur = self.db.execute("""\
-                select protein_id1, protein_id1, score
+                select protein_id1, protein_id2, score
                 from links
                 """)
-        return cur.fetchall()
+        return cur
+
+    def _data_version(self):
+        try:
+            version = self.db.execute(
+                "select string_version, api_version from version").fetchone()
+        except sqlite3.OperationalError:
+            version = None
+        return "-".join(version) if version else self.VERSION
 
     def edges(self, id):
         """
@@ -687,6 +1141,23 @@ class STRING(PPIDatabase):
             """, (id,))
         return cur.fetchall()
 
+    def edges_many(self, ids):
+        """
+        Return a list of all edges of `ids` (a list of 3-tuples
+        (id1, id2, score)).
+        """
+        self._query_ids(ids)
+        cur = self.db.execute("""\
+            select protein_id1, protein_id2, score
+            from query_ids cross join links on protein_id1=id
+            """)
+        return cur.fetchall()
+
+    def adjacency(self, taxid=None):
+        # Links are already stored in both directions
+        return Adjacency.from_edges(self._iter_all_edges(taxid),
+                                    symmetric=False)
+
     def all_edges_annotated(self, taxid=None):
         res = []
         for id in self.ids(taxid):
@@ -732,7 +1203,19 @@ class STRING(PPIDatabase):
             cls.init_db(version, taxid)
 
     @classmethod
-    def init_db(cls, version, taxid, cache_dir=None, dbfilename=None):
+    def init_db(cls, version, taxid, cache_dir=None, dbfilename=None,
+                progress_callback=None, processes=None):
+        """
+        Download the STRING `version` flat files for `taxid` (if not
+        already in `cache_dir`) and build the database in `dbfilename`.
+        If `processes` is true (by default if there are multiple CPUs)
+        the files are decompressed and parsed in worker processes, while
+        the rows are inserted into the database (with indexes created
+        at the end). If the database already contains other organisms
+        only the data for `taxid` is replaced. Return the numbers of
+        inserted rows.
+
+        """
         if cache_dir is None:
             cache_dir = serverfiles.localpath(cls.DOMAIN)
 
@@ -770,95 +1253,94 @@ class STRING(PPIDatabase):
             if not os.path.exists(pjoin(cache_dir, fname)):
                 download(fname, url)
 
-        links_fileobj = open(pjoin(cache_dir, links_filename), "rb")
-        actions_fileobj = open(pjoin(cache_dir, actions_filename), "rb")
-        aliases_fileobj = open(pjoin(cache_dir, aliases_filename), "rb")
-
-        links_file = gzip.GzipFile(fileobj=links_fileobj)
-        actions_file = gzip.GzipFile(fileobj=actions_fileobj)
-        aliases_file = gzip.GzipFile(fileobj=aliases_fileobj)
-
-        progress = ConsoleProgressBar("Processing {}:".format(links_filename))
-        progress(0.0)
+        kinds = [("links", links_filename, "INSERT INTO links VALUES (?, ?, ?)"),
+                 ("actions", actions_filename,
+                  "INSERT INTO actions VALUES (?, ?, ?, ?, ?)"),
+                 ("aliases", aliases_filename,
+                  "INSERT INTO aliases VALUES (?, ?, ?)")]
 
         def st_size(filename):
             return os.stat(pjoin(cache_dir, filename)).st_size
 
-        filesize = st_size(links_filename)
+        filesize = sum(st_size(filename) for _, filename, _ in kinds)
 
         con = sqlite3.connect(dbfilename)
+        con.execute("PRAGMA cache_size=-262144")
+        con.execute("PRAGMA temp_store=MEMORY")
+        replace = bool(cls._other_taxids(con, taxid))
+        if not replace:
+            # Faster bulk inserts into a new database (a failed build
+            # must be restarted anyway)
+            con.execute("PRAGMA journal_mode=OFF")
+            con.execute("PRAGMA synchronous=OFF")
+        else:
+            # The other organisms' data must survive a failed update
+            con.execute("PRAGMA journal_mode=TRUNCATE")
 
-        with con:
-            cls.clear_db(con)
-
-            links_file.readline()  # read the header line
-
-            reader = csv.reader(links_file, delimiter=" ")
-
-            def read_links(reader, progress):
-                for i, (p1, p2, score) in enumerate(reader):
-                    yield p1, p2, int(score)
-
-                    if i % 100000 == 0:
-                        # Update the progress every 100000 lines
-                        progress(100.0 * links_fileobj.tell() / filesize)
-
-            con.executemany("INSERT INTO links VALUES (?, ?, ?)",
-                            read_links(reader, progress))
-
-            progress.finish()
-
-            def part(string, sep, part):
-                return string.split(sep)[part]
-
-            con.create_function("part", 3, part)
-            con.execute("""
-                INSERT INTO proteins
-                SELECT protein_id1, part(protein_id1, '.', 0)
-                FROM (SELECT DISTINCT(protein_id1)
-                     FROM links
-                     ORDER BY protein_id1)
-            """)
-
-            filesize = st_size(actions_filename)
-
-            actions_file.readline()  # read header line
-
-            progress = ConsoleProgressBar("Processing actions:")
-            reader = csv.reader(actions_file, delimiter="\t")
-
-            def read_actions(reader):
-                for i, (p1, p2, mode, action, a_is_acting, score) in \
-                        enumerate(reader):
-                    yield p1, p2, mode, action, int(score)
-
-                    if i % 10000 == 0:
-                        progress(100.0 * actions_fileobj.tell() / filesize)
-
-            con.executemany("INSERT INTO actions VALUES (?, ?, ?, ?, ?)",
-                            read_actions(reader))
-
-            progress.finish()
-
-            filesize = st_size(aliases_filename)
-            aliases_file.readline()  # read header line
-
-            progress = ConsoleProgressBar("Processing aliases:")
-
-            reader = csv.reader(aliases_file, delimiter="\t")
-
-            def read_aliases(reader, progress):
-                for i, (taxid, name, alias, source) in enumerate(reader):
-                    yield (".".join([taxid, name]),
-                           alias.decode("utf-8", errors="ignore"),
-                           source.decode("utf-8", errors="ignore"))
-                    if i % 10000 == 0:
-                        progress(100.0 * aliases_fileobj.tell() / filesize)
-
-            con.executemany("INSERT INTO aliases VALUES (?, ?, ?)",
-                            read_aliases(reader, progress))
+        if processes is None:
+            processes = multiprocessing.cpu_count() > 1
 
-            progress.finish()
+        start = time.time()
+        counts = dict((kind, 0) for kind, _, _ in kinds)
+        with con:
+            if replace:
+                # Only replace this organism's data (indexes are kept)
+                cls.clear_taxid(con, taxid)
+            else:
+                cls.clear_db(con)
+
+            def batches():
+                if not processes:
+                    for kind, filename, _ in kinds:
+                        for rows, position in _string_batches(
+                                kind, pjoin(cache_dir, filename)):
+                            yield kind, rows, position
+                    return
+
+                # The files are parsed in worker processes while the
+                # rows are inserted in this one.
+                queue = multiprocessing.Queue(maxsize=8)
+                workers = [multiprocessing.Process(
+                               target=_read_string_file,
+                               args=(kind, pjoin(cache_dir, filename), queue))
+                           for kind, filename, _ in kinds]
+                for worker in workers:
+                    worker.daemon = True
+                    worker.start()
+                running = len(workers)
+                try:
+                    while running:
+                        kind, rows, error = queue.get()
+                        if rows is not None:
+                            yield kind, rows, error
+                        elif error is not None:
+                            raise RuntimeError(
+                                "Error parsing {}:\n{}".format(kind, error))
+                        else:
+                            running -= 1
+                finally:
+                    for worker in workers:
+                        if worker.is_alive():
+                            worker.terminate()
+                        worker.join()
+
+            inserts = dict((kind, sql) for kind, _, sql in kinds)
+            positions = {}
+            proteins = set()
+            with closing(batches()) as rows_iter:
+                for kind, rows, position in rows_iter:
+                    con.executemany(inserts[kind], rows)
+                    counts[kind] += len(rows)
+                    if kind == "links":
+                        proteins.update(map(itemgetter(0), rows))
+                    positions[kind] = position
+                    if progress_callback is not None:
+                        progress_callback(
+                            100.0 * sum(positions.values()) / filesize)
+
+            con.executemany("INSERT INTO proteins VALUES (?, ?)",
+                            ((protein_id, protein_id.split(".", 1)[0])
+                             for protein_id in sorted(proteins)))
 
             print("Indexing the database")
             cls.create_db_index(con)
@@ -874,6 +1356,39 @@ class STRING(PPIDatabase):
                 INSERT INTO version
                 VALUES (?, ?)""", (version, cls.VERSION))
 
+        elapsed = time.time() - start
+        print("Inserted {} links, {} actions and {} aliases in {:.1f} s "
+              "({:.0f} rows/s)".format(
+                  counts["links"], counts["actions"], counts["aliases"],
+                  elapsed, sum(counts.values()) / max(elapsed, 1e-6)))
+        con.close()
+        return counts
+
+    @classmethod
+    def _other_taxids(cls, dbcon, taxid):
+        try:
+            cur = dbcon.execute("""\
+                SELECT DISTINCT taxid FROM proteins WHERE taxid!=?
+                """, (taxid,))
+        except sqlite3.OperationalError:
+            # No proteins table
+            return []
+        return [r[0] for r in cur.fetchall()]
+
+    @classmethod
+    def clear_taxid(cls, dbcon, taxid):
+        """
+        Remove all data for the organism `taxid` from the database.
+        """
+        for table, column in [("links", "protein_id1"),
+                              ("actions", "protein_id1"),
+                              ("aliases", "protein_id")]:
+            dbcon.execute("""\
+                DELETE FROM {0} WHERE {1} IN
+                    (SELECT protein_id FROM proteins WHERE taxid=?)
+                """.format(table, column), (taxid,))
+        dbcon.execute("DELETE FROM proteins WHERE taxid=?", (taxid,))
+
     @classmethod
     def clear_db(cls, dbcon):
         dbcon.executescript(textwrap.dedent("""
@@ -901,8 +1416,8 @@ class STRING(PPIDatabase):
     @classmethod
     def create_db_index(cls, dbcon):
         dbcon.executescript(textwrap.dedent("""
-            CREATE INDEX IF NOT EXISTS index_link_protein_id1
-                ON links (protein_id1);
+            CREATE INDEX IF NOT EXISTS index_link_protein_id1_id2
+                ON links (protein_id1, protein_id2, score);
 
             CREATE INDEX IF NOT EXISTS index_action_protein_id1
                 ON actions (protein_id1);
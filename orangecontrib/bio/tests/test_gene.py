@@ -0,0 +1,235 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from orangecontrib.bio import gene
+
+
+class TestMatchMany(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(0)
+
+        def name():
+            return "".join(rnd.choice("abcABC012xyz")
+                           for _ in range(rnd.randint(1, 4)))
+
+        self.groups1 = [set(name() for _ in range(rnd.randint(1, 4)))
+                        for _ in range(500)]
+        self.groups2 = [set(name() for _ in range(rnd.randint(1, 3)))
+                        for _ in range(300)]
+        self.targets = [name() for _ in range(400)] + [u"\xe9A"]
+        self.genes = [name() for _ in range(1000)] + \
+            [u"\xe9a", u"\xc9A", "", "unknown"]
+
+    def assertMatchMany(self, matcher):
+        matches = matcher.match_many(self.genes)
+        self.assertEqual(len(matches), len(self.genes))
+        for g, m in zip(self.genes, matches):
+            self.assertEqual(sorted(m), sorted(matcher.match(g)))
+        self.assertEqual(matcher.umatch_many(self.genes),
+                         [matcher.umatch(g) for g in self.genes])
+
+    def test_aliases(self):
+        for ignore_case in [True, False]:
+            m = gene.MatcherAliases(self.groups1, ignore_case=ignore_case)
+            m.set_targets(self.targets)
+            self.assertMatchMany(m)
+
+    def test_sequence(self):
+        for ignore_case in [True, False]:
+            m = gene.matcher([
+                gene.MatcherAliases(self.groups1, ignore_case=ignore_case),
+                gene.MatcherAliases(self.groups2, ignore_case=ignore_case)],
+                ignore_case=ignore_case)
+            m.set_targets(self.targets)
+            self.assertMatchMany(m)
+
+    def test_alias_index(self):
+        index = gene.AliasIndex.from_groups(
+            [set(["A", "b"]), set(["a", "C"]), set()], ignore_case=True)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.to_ids("A"), set([0, 1]))
+        self.assertEqual(index.to_ids("c"), set([1]))
+        self.assertEqual(index.to_ids("d"), set())
+        self.assertEqual(index.lookup(["B", "x", "a"]).tolist(), [1, -1, 0])
+
+        index = gene.AliasIndex.from_groups([], ignore_case=False)
+        self.assertEqual(index.lookup(["A"]).tolist(), [-1])
+
+
+class TestAliasCache(unittest.TestCase):
+    groups = [set(["A", "b", "C"]), set(["d", "E"]), set(["c", "X"]),
+              set([u"\xe9"])]
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.created = []
+        groups = self.groups
+        created = self.created
+
+        class Matcher(gene.MatcherAliasesPickled):
+            version = "v1"
+
+            def filename(self):
+                return "test"
+
+            def create_aliases_version(self):
+                return self.version
+
+            def create_aliases(self):
+                created.append(self.version)
+                return groups
+
+        self.Matcher = Matcher
+        self.old_path = gene.gene_matcher_path
+        gene.gene_matcher_path = self.path
+
+    def tearDown(self):
+        gene.gene_matcher_path = self.old_path
+        shutil.rmtree(self.path)
+
+    def test_cache(self):
+        for _ in range(2):
+            m = self.Matcher()
+            m.set_targets(["a", "x", "E", u"\xc9"])
+            self.assertEqual(sorted(m.match("C")), ["a", "x"])
+            self.assertEqual(m.match_many(["e", "B", "z", u"\xe9"]),
+                             [["E"], ["a"], [], [u"\xc9"]])
+            self.assertEqual(m.aliases, self.groups)
+        self.assertEqual(self.created, ["v1"])
+
+        self.Matcher.version = "v2"
+        m = self.Matcher()
+        self.assertEqual(m.aliases, self.groups)
+        self.assertEqual(self.created, ["v1", "v2"])
+
+    def test_shared_aliases(self):
+        m1, m2 = self.Matcher(), self.Matcher()
+        self.assertIs(m1.alias_cache(), m2.alias_cache())
+        m1.set_targets(["a"])
+        m2.set_targets(["x", "d"])
+        self.assertEqual(m1.match("C"), ["a"])
+        self.assertEqual(sorted(m2.match("C")), ["x"])
+        self.assertEqual(self.created, ["v1"])
+
+    def test_auto_pickle(self):
+        filename = os.path.join(self.path, "test")
+        gene.auto_pickle(filename, "v1", lambda: self.groups)
+        self.assertEqual(
+            gene.auto_pickle(filename, "v1", lambda: None), self.groups)
+        # Existing pickled aliases are converted
+        m = self.Matcher()
+        m.set_targets(["a"])
+        self.assertEqual(m.match("b"), ["a"])
+        self.assertEqual(self.created, [])
+        self.assertTrue(os.path.isdir(filename + ".cache"))
+
+    def test_source_file_changes(self):
+        filename = os.path.join(self.path, "aliases")
+        gene.auto_pickle(filename, None, lambda: [set(["A", "a1"])])
+        m = gene.MatcherAliasesFile(filename)
+        m.set_targets(["A"])
+        self.assertEqual(m.match("a1"), ["A"])
+
+        os.remove(filename)
+        gene.auto_pickle(filename, None, lambda: [set(["A", "c1"])])
+        os.utime(filename, (0, 0))
+        m = gene.MatcherAliasesFile(filename)
+        m.set_targets(["A"])
+        self.assertEqual(m.match("c1"), ["A"])
+        self.assertEqual(m.match("a1"), [])
+
+
+GENE_INFO = """\
+#Format: tax_id GeneID Symbol LocusTag Synonyms dbXrefs ...
+9606\t1\tA1BG\t-\tA1B|ABG|GAB\tMIM:138670\t19\t19q13.4\talpha-1-B glycoprotein\tprotein-coding\tA1BG\talpha-1-B glycoprotein\tO\t-\t20150329
+9606\t10\tNAT2\t-\tAAC2|NAT-2\tMIM:612182\t8\t8p22\tN-acetyltransferase 2\tprotein-coding\tNAT2\tN-acetyltransferase 2\tO\t-\t20150330
+
+9606\t2\tA2M\t-\tA2MD|CPAMD5\tMIM:103950\t12\t12p13.31\talpha-2-macroglobulin\tprotein-coding\tA2M\talpha-2-macroglobulin\tO\t-\t20150329
+9606\t3\tA2MP1\t-\tA2MP\t-\t12\t12p13.31\tpseudogene\tpseudo\tA2MP1\t-\tO\t-\t20150329
+9606\t11\tNAT2\t-\t-\t-\t8\t8p22\tN-acetyltransferase 2b\tpseudo\t-\t-\t-\t-\t20150329
+9606\t3\tA2MP1\t-\tA2MP\t-\t12\t12p13.31\tupdated\tpseudo\tA2MP1\t-\tO\t-\t20150401
+"""
+
+
+class TestNCBIGeneInfo(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, "gene_info.9606.db")
+        with open(self.filename, "w") as f:
+            f.write(GENE_INFO)
+        self.localpath_download = gene.serverfiles.localpath_download
+        gene.serverfiles.localpath_download = \
+            lambda domain, filename: os.path.join(self.path, filename)
+        self.GMNCBI = gene.GMNCBI
+        gene.NCBIGeneInfo._default_matches.clear()
+
+    def tearDown(self):
+        gene.NCBIGeneInfo._default_matches.clear()
+        gene.GMNCBI = self.GMNCBI
+        gene.serverfiles.localpath_download = self.localpath_download
+        shutil.rmtree(self.path)
+
+    def test_info(self):
+        for _ in range(2):
+            info = gene.NCBIGeneInfo("9606", genematcher=gene.GMDirect())
+            self.assertTrue(os.path.isdir(self.filename + ".cache"))
+            self.assertEqual(len(info), 5)
+            self.assertEqual(sorted(info.keys()),
+                             ["1", "10", "11", "2", "3"])
+            self.assertEqual(info["1"].symbol, "A1BG")
+            self.assertEqual(info["1"].synonyms, ["A1B", "ABG", "GAB"])
+            self.assertEqual(info["3"].description, "updated")
+            self.assertEqual(info["3"].modification_date, "20150401")
+            self.assertIn("10", info)
+            self.assertNotIn("4", info)
+            self.assertRaises(KeyError, lambda: info["4"])
+            self.assertIsNone(info.get("4"))
+            self.assertEqual(info.get_info("a1bg"), None)
+            self.assertEqual(info.get_info("1").symbol, "A1BG")
+            self.assertEqual(sorted(g.gene_id for g in
+                                    info.get_by_symbol("NAT2")),
+                             ["10", "11"])
+            self.assertEqual(info.get_by_symbol("XYZ"), [])
+            self.assertEqual([key for key, _ in info.items()],
+                             ["1", "10", "2", "11", "3"])
+            self.assertEqual(repr(info["2"]), GENE_INFO.splitlines()[4])
+
+        info["5"] = info["2"]
+        self.assertEqual(len(info), 6)
+        self.assertEqual(info["5"].symbol, "A2M")
+        self.assertEqual(sorted(info)[-1], "5")
+
+    def test_default_matcher(self):
+        gene.GMNCBI = lambda taxid: gene.GMDirect()
+        info1 = gene.NCBIGeneInfo("9606")
+        info2 = gene.NCBIGeneInfo("9606")
+        self.assertIsNot(info1.matcher, info2.matcher)
+        info1.matcher.set_targets(["x"])
+        self.assertEqual(info2.matcher.umatch("1"), "1")
+        self.assertEqual(info2.get_info("2").symbol, "A2M")
+
+    def test_shared_targets(self):
+        built = []
+
+        class GMRecorded(gene.GMDirect):
+            def set_targets(self, targets):
+                built.append(list(targets))
+                return gene.GMDirect.set_targets(self, targets)
+        gene.GMNCBI = lambda taxid: GMRecorded()
+        info1 = gene.NCBIGeneInfo("9606")
+        self.assertEqual(info1.get_info("1").symbol, "A1BG")
+        self.assertEqual(len(built), 1)
+        info2 = gene.NCBIGeneInfo("9606")
+        self.assertEqual(info2.get_info("2").symbol, "A2M")
+        self.assertEqual(len(built), 1)
+        self.assertIs(info1.matcher.matcho, info2.matcher.matcho)
+
+        # A modified instance sets its own targets
+        info3 = gene.NCBIGeneInfo("9606")
+        info3["5"] = info3["2"]
+        self.assertEqual(info3.matcher.umatch("5"), "5")
+        self.assertIsNone(info1.matcher.umatch("5"))
+        self.assertEqual(len(built), 2)
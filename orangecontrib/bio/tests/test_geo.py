@@ -0,0 +1,184 @@
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from orangecontrib.bio import geo
+
+SOFT_HEADER = """\
+^DATABASE = Geo
+!Database_name = Gene Expression Omnibus (GEO)
+^DATASET = {name}
+!dataset_title = Test
+!dataset_sample_organism = Homo sapiens
+!dataset_sample_count = 6
+!dataset_feature_count = {features}
+^SUBSET = {name}_1
+!subset_dataset_id = {name}
+!subset_description = control
+!subset_sample_id = GSM1,GSM2,GSM3
+!subset_type = agent
+^SUBSET = {name}_2
+!subset_dataset_id = {name}
+!subset_description = treated
+!subset_sample_id = GSM4,GSM5,GSM6
+!subset_type = agent
+^DATASET = {name}
+!dataset_id = {name}
+!dataset_table_begin
+ID_REF\tIDENTIFIER\tGSM1\tGSM2\tGSM3\tGSM4\tGSM5\tGSM6
+"""
+
+
+def soft_rows(n_spots, n_genes, seed=0):
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n_spots):
+        values = [("null" if rnd.random() < 0.2 else
+                   "%.3f" % rnd.uniform(-5, 5)) for _ in range(6)]
+        rows.append(["S%i" % i, "G%i" % rnd.randrange(n_genes)] + values)
+    return rows
+
+
+def write_soft(filename, name, rows):
+    with gzip.open(filename, "wb") as f:
+        f.write((SOFT_HEADER.format(name=name, features=len(rows)) +
+                 "".join("\t".join(row) + "\n" for row in rows) +
+                 "!dataset_table_end\n").encode("utf-8"))
+
+
+class TestGDS(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.rows = soft_rows(400, 150)
+        write_soft(os.path.join(self.path, "GDS1.soft.gz"), "GDS1", self.rows)
+        self.localpath = geo.serverfiles.localpath
+        self.search = geo.taxonomy.search
+        geo.serverfiles.localpath = \
+            lambda domain, filename="": os.path.join(self.path, filename)
+        geo.taxonomy.search = lambda name, exact=False: ["9606"]
+
+    def tearDown(self):
+        geo.serverfiles.localpath = self.localpath
+        geo.taxonomy.search = self.search
+        shutil.rmtree(self.path)
+
+    def expected(self, merge_function):
+        genes = {}
+        for row in self.rows:
+            values = [float(v) if v != "null" else float("nan")
+                      for v in row[2:]]
+            genes.setdefault(row[1], []).append(values)
+        return [(gene, [merge_function(list(column))
+                        for column in zip(*genes[gene])])
+                for gene in sorted(genes)]
+
+    def test_read_table(self):
+        filename = os.path.join(self.path, "GDS1.soft.gz")
+        ids, X = geo._read_soft_table(filename)
+        self.assertEqual(ids.tolist(), [row[:2] for row in self.rows])
+        self.assertEqual(X.dtype, float)
+        numpy.testing.assert_array_equal(
+            X, [[float(v) if v != "null" else float("nan")
+                 for v in row[2:]] for row in self.rows])
+
+        # Chunks smaller than a row, a few rows and an uneven split
+        for chunk_size in [1, 24, 8 * 7]:
+            chunked_ids, chunked_X = geo._read_soft_table(
+                filename, chunk_size=chunk_size)
+            numpy.testing.assert_array_equal(chunked_ids, ids)
+            numpy.testing.assert_array_equal(chunked_X, X)
+
+        write_soft(filename, "GDS1", [])
+        ids, X = geo._read_soft_table(filename)
+        self.assertEqual((ids.shape, X.shape), ((0, 2), (0, 6)))
+
+        write_soft(filename, "GDS1", self.rows[:3] + [["S9", "G9", "1.0"]])
+        self.assertRaises(ValueError, geo._read_soft_table, filename)
+
+    def test_getdata(self):
+        gds = geo.GDS("GDS1")
+        self.assertEqual(gds.info["samples"],
+                         ["GSM%i" % i for i in range(1, 7)])
+        self.assertTrue(os.path.exists(os.path.join(self.path, "GDS1.npy")))
+        self.assertEqual(gds.genes, sorted(set(r[1] for r in self.rows)))
+
+        for merge_function in [geo.spots_mean, geo.spots_median,
+                               geo.spots_min, geo.spots_max,
+                               lambda x: float(len(x))]:
+            data = gds.getdata(merge_function=merge_function)
+            expected = self.expected(merge_function)
+            self.assertEqual([str(d["gene"]) for d in data],
+                             [gene for gene, _ in expected])
+            numpy.testing.assert_allclose(
+                data.X, [values for _, values in expected])
+            self.assertEqual(data.domain.attributes[3].attributes,
+                             {"agent": "treated"})
+
+        data = gds.getdata(report_genes=False, transpose=True)
+        spots = sorted(self.rows)
+        self.assertEqual([a.name for a in data.domain.attributes],
+                         [row[0] for row in spots])
+        numpy.testing.assert_allclose(
+            data.X[1], [float(row[3]) if row[3] != "null" else numpy.nan
+                        for row in spots])
+        self.assertEqual([str(d.get_class()) for d in data],
+                         ["control"] * 3 + ["treated"] * 3)
+
+        data = gds.getdata(report_genes=False, remove_unknown=0.1)
+        self.assertEqual(
+            [str(d["spot"]) for d in data],
+            sorted(row[0] for row in self.rows if "null" not in row))
+
+    def test_cache(self):
+        ids, X = geo.GDS("GDS1")._load_table()
+        read = geo._read_soft_table
+        geo._read_soft_table = None
+        try:
+            cached = geo.GDS("GDS1")._load_table()
+        finally:
+            geo._read_soft_table = read
+        self.assertEqual(cached[0].tolist(), ids.tolist())
+        numpy.testing.assert_array_equal(cached[1], X)
+        self.assertEqual(ids[:2].tolist(), [row[:2] for row in self.rows[:2]])
+
+    def test_load_many(self):
+        write_soft(os.path.join(self.path, "GDS2.soft.gz"), "GDS2",
+                   soft_rows(300, 200, seed=1))
+        gds_info = {"GDS2": dict(geo.GDS("GDS2").info, title="Second")}
+        progress = []
+        genes, tables = geo.load_many(
+            ["GDS2", "GDS1", "GDS2"], workers=2, gds_info=gds_info,
+            progress_callback=lambda *args: progress.append(args))
+        self.assertEqual(sorted(gds_id for gds_id, _ in progress),
+                         ["GDS1", "GDS2"])
+        self.assertEqual([p for _, p in progress], [50.0, 100.0])
+        self.assertIs(tables[0], tables[2])
+
+        expected = [geo.GDS(gds_id).getdata() for gds_id in ["GDS2", "GDS1"]]
+        expected_genes = [set(str(d["gene"]) for d in data)
+                          for data in expected]
+        self.assertEqual(genes, sorted(expected_genes[0] | expected_genes[1]))
+        for data, table in zip(expected, tables):
+            self.assertEqual([str(d["gene"]) for d in table], genes)
+            index = dict((str(d["gene"]), i) for i, d in enumerate(data))
+            for i, gene in enumerate(genes):
+                if gene in index:
+                    numpy.testing.assert_array_equal(table.X[i],
+                                                     data.X[index[gene]])
+                else:
+                    self.assertTrue(numpy.isnan(table.X[i]).all())
+
+        common, _ = geo.load_many(["GDS1", "GDS2"], gds_info=gds_info,
+                                  join="inner")
+        self.assertEqual(common, sorted(expected_genes[0] & expected_genes[1]))
+
+        # The data set information is reused
+        geo.taxonomy.search = None
+        _, tables = geo.load_many(["GDS2"], gds_info=gds_info, transpose=True)
+        self.assertEqual([a.name for a in tables[0].domain.attributes],
+                         sorted(expected_genes[0]))
@@ -0,0 +1,411 @@
+import os
+import gzip
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from six import StringIO
+
+from orangecontrib.bio import go
+from orangecontrib.bio.utils import stats
+
+
+ONTOLOGY = """\
+format-version: 1.2
+subsetdef: goslim_generic "Generic GO slim"
+
+[Term]
+id: GO:0000001
+name: root
+namespace: biological_process
+subset: goslim_generic
+
+[Term]
+id: GO:0000002
+name: a
+namespace: biological_process
+is_a: GO:0000001 ! root
+
+[Term]
+id: GO:0000003
+name: b
+namespace: biological_process
+is_a: GO:0000001 ! root
+subset: goslim_generic
+
+[Term]
+id: GO:0000004
+name: c
+namespace: biological_process
+is_a: GO:0000002 ! a
+relationship: part_of GO:0000003 ! b
+
+[Term]
+id: GO:0000005
+name: d
+namespace: biological_process
+is_a: GO:0000004 ! c
+
+"""
+
+ANNOTATIONS = [
+    # gene, term, evidence, aspect
+    ("G1", "GO:0000004", "IDA", "P"),
+    ("G1", "GO:0000002", "IEA", "P"),
+    ("G2", "GO:0000005", "IEA", "P"),
+    ("G3", "GO:0000003", "TAS", "P"),
+    ("G4", "GO:0000002", "IDA", "F"),
+    ("G5", "GO:0000001", "IBA", "P"),
+    ("G6", "GO:0000005", "IMP", "P"),
+    ("G6", "GO:0000099", "IMP", "P"),
+]
+
+
+def annotation_file(records):
+    lines = ["!gaf-version: 2.0"]
+    for gene, term, evidence, aspect in records:
+        lines.append("\t".join(
+            ["DB", "ID" + gene, gene, "", term, "ref", evidence, "", aspect,
+             gene + " name", gene.lower(), "protein", "taxon:9606",
+             "20140101", "DB", "", ""]))
+    return StringIO("\n".join(lines) + "\n")
+
+
+class TestOntology(unittest.TestCase):
+    def setUp(self):
+        self.ontology = go.Ontology(StringIO(ONTOLOGY))
+
+    def test_graph(self):
+        ont = self.ontology
+        self.assertEqual(ont.extract_super_graph("GO:0000005"),
+                         set(["GO:0000001", "GO:0000002", "GO:0000003",
+                              "GO:0000004", "GO:0000005"]))
+        self.assertEqual(ont.extract_super_graph(["GO:0000002",
+                                                  "GO:0000003"]),
+                         set(["GO:0000001", "GO:0000002", "GO:0000003"]))
+        self.assertEqual(ont.extract_sub_graph(["GO:0000003"]),
+                         set(["GO:0000003", "GO:0000004", "GO:0000005"]))
+        self.assertEqual(ont.extract_sub_graph("GO:0000005"),
+                         set(["GO:0000005"]))
+        self.assertRaises(KeyError, ont.extract_super_graph, ["GO:1"])
+
+    def test_depth(self):
+        depths = [self.ontology.term_depth("GO:000000%i" % i)
+                  for i in range(1, 6)]
+        self.assertEqual(depths, [1, 2, 2, 3, 4])
+
+    def test_slims(self):
+        ont = self.ontology
+        ont.set_slims_subset("goslim_generic")
+        self.assertEqual(ont.slims_for_term("GO:0000005"),
+                         set(["GO:0000001", "GO:0000003"]))
+        self.assertEqual(ont.slims_for_term("GO:0000003"),
+                         set(["GO:0000003"]))
+        ont.set_slims_subset(["GO:0000002", "GO:0000004"])
+        self.assertEqual(ont.slims_for_term("GO:0000005"),
+                         set(["GO:0000004"]))
+        self.assertEqual(ont.slims_for_term("GO:0000003"), set())
+
+
+class TestOntologyCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "gene_ontology_edit.obo")
+        with open(self.filename, "w") as f:
+            f.write(ONTOLOGY)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_cache(self):
+        parsed = go.Ontology(StringIO(ONTOLOGY))
+        go._compiled_ontology(self.filename)
+        self.assertTrue(os.path.isdir(self.filename + ".cache"))
+
+        compiled = go._compiled_ontology(self.filename)
+        self.assertIn("index_stanzas", compiled.arrays)
+        cached = go.Ontology(compiled)
+        # Terms are only created on access
+        self.assertEqual(len(cached.terms._terms), 0)
+        self.assertIsNotNone(cached._index)
+
+        self.assertEqual(sorted(cached), sorted(parsed))
+        self.assertEqual(cached.header, parsed.header)
+        self.assertEqual(cached.defined_slims_subsets(), ["goslim_generic"])
+        for term in parsed:
+            self.assertEqual(cached[term].values, parsed[term].values)
+            self.assertEqual(cached[term].related, parsed[term].related)
+            self.assertEqual(cached[term].related_to,
+                             parsed[term].related_to)
+            self.assertEqual(cached.extract_super_graph(term),
+                             parsed.extract_super_graph(term))
+            self.assertEqual(cached.term_depth(term),
+                             parsed.term_depth(term))
+        self.assertEqual(cached["GO:0000003"].related_to,
+                         set([("part_of", "GO:0000004")]))
+        self.assertEqual(len(cached.terms._terms), len(parsed))
+
+    def test_unknown_parent(self):
+        text = ONTOLOGY + "[Term]\nid: GO:0000006\nname: e\n" \
+                          "is_a: GO:0000005 ! d\nis_a: GO:0000099\n"
+        with open(self.filename, "w") as f:
+            f.write(text)
+        parsed = go.Ontology(StringIO(text))
+        cached = go.Ontology(go._compiled_ontology(self.filename))
+        for ont in [parsed, cached]:
+            self.assertEqual(len(ont.extract_super_graph("GO:0000006")), 6)
+            self.assertEqual(ont.term_depth("GO:0000006"), 5)
+
+    def test_modified_terms(self):
+        go._compiled_ontology(self.filename)
+        ont = go.Ontology(go._compiled_ontology(self.filename))
+        self.assertEqual(ont.term_depth("GO:0000005"), 4)
+        ont.terms["GO:0000006"] = go.Term(
+            "[Term]\nid: GO:0000006\nname: e\nis_a: GO:0000005 ! d\n", ont)
+        self.assertEqual(ont.term_depth("GO:0000006"), 5)
+        self.assertIn("GO:0000005", ont.extract_super_graph("GO:0000006"))
+        del ont.terms["GO:0000006"]
+        self.assertRaises(KeyError, ont.extract_super_graph, ["GO:0000006"])
+
+    def test_tar(self):
+        tar = os.path.join(self.tmpdir, "gene_ontology_edit.obo.tar.gz")
+        with tarfile.open(tar, "w:gz") as f:
+            f.add(self.filename, "gene_ontology_edit.obo")
+        ontology = go.Ontology(go._compiled_ontology(tar))
+        self.assertEqual(len(ontology), 5)
+        self.assertTrue(os.path.isdir(tar + ".cache"))
+
+
+class TestEnrichment(unittest.TestCase):
+    def setUp(self):
+        self.ontology = go.Ontology(StringIO(ONTOLOGY))
+        self.annotations = go.Annotations(annotation_file(ANNOTATIONS),
+                                          ontology=self.ontology)
+
+    def expected(self, genes, reference, evidence_codes, aspects, prob):
+        # Reference implementation working with annotation sets.
+        ann = self.annotations
+        ref_annotations = set(
+            a for g in reference for a in ann.gene_annotations[g]
+            if a.Evidence_Code in evidence_codes and a.Aspect in aspects)
+        result = {}
+        for term in self.ontology:
+            annotated = set(
+                a.geneName for a in
+                ann.get_all_annotations(term).intersection(ref_annotations))
+            mapped = genes.intersection(annotated)
+            if mapped:
+                result[term] = (sorted(mapped),
+                                prob.p_value(len(mapped), len(reference),
+                                             len(annotated), len(genes)),
+                                len(annotated))
+        return result
+
+    def assertEnrichmentEqual(self, res, expected):
+        self.assertEqual(sorted(res), sorted(expected))
+        for term, (genes, p_value, ref_count) in expected.items():
+            self.assertEqual(res[term][0], genes)
+            self.assertAlmostEqual(res[term][1], p_value, places=12)
+            self.assertEqual(res[term][2], ref_count)
+
+    def enriched(self, genes, **kwargs):
+        res = self.annotations.get_enriched_terms(genes, use_fdr=False,
+                                                  **kwargs)
+        return dict((term, (sorted(genes), p, ref))
+                    for term, (genes, p, ref) in res.items())
+
+    def test_enriched_terms(self):
+        genes = set(["G1", "G2"])
+        reference = self.annotations.gene_names
+        evidence = set(go.evidenceDict.keys())
+        res = self.enriched(genes)
+        self.assertEnrichmentEqual(
+            res, self.expected(genes, reference, evidence, "PFC",
+                               stats.Binomial()))
+        self.assertEqual(res["GO:0000003"][0], ["G1", "G2"])
+        self.assertEqual(res["GO:0000003"][2], 4)
+        # IBA is not in `evidenceDict`, so G5 is never counted
+        self.assertEqual(res["GO:0000001"][2], 5)
+
+    def test_enriched_terms_filters(self):
+        genes = set(["G1", "G2", "G4"])
+        reference = set(["G1", "G2", "G3", "G4", "G6"])
+        evidence = set(["IDA", "IMP"])
+        res = self.enriched(genes, reference=reference,
+                            evidence_codes=evidence, aspect="P",
+                            prob=stats.Hypergeometric())
+        self.assertEnrichmentEqual(
+            res, self.expected(genes, reference, evidence, "P",
+                               stats.Hypergeometric()))
+        self.assertNotIn("GO:0000005", res)
+
+    def test_slims_only(self):
+        self.ontology.set_slims_subset("goslim_generic")
+        res = self.enriched(["G1"], slims_only=True)
+        self.assertEqual(set(res), set(["GO:0000001", "GO:0000003"]))
+
+    def test_index_invalidation(self):
+        self.enriched(["G1"])
+        self.annotations.add_annotation(annotation_file(
+            [("G7", "GO:0000003", "IDA", "P")]).read().splitlines()[1])
+        res = self.enriched(["G7"])
+        self.assertEqual(res["GO:0000003"][2], 5)
+
+    def test_enriched_terms_batch(self):
+        gene_lists = [["G1"], ["G2", "G3"], ["G4", "G6", "unknown"], []]
+        expected = [self.annotations.get_enriched_terms(genes)
+                    for genes in gene_lists]
+        for workers in [None, 2]:
+            res = self.annotations.get_enriched_terms_batch(
+                gene_lists, workers=workers)
+            self.assertEqual(len(res), len(gene_lists))
+            for r, e in zip(res, expected):
+                self.assertEqual(r, e)
+
+    def test_enriched_terms_batch_reference(self):
+        # Genes outside the reference nominate (zero count) terms
+        reference = ["G1", "G3", "G4", "G5", "G6"]
+        res = self.annotations.get_enriched_terms_batch(
+            [["G2"], ["G1", "G2"]], reference=reference, use_fdr=False)
+        self.assertEqual(res[0]["GO:0000005"][0], [])
+        self.assertEqual(res[0]["GO:0000005"][2], 1)
+        self.assertEqual(res[1]["GO:0000002"][0], ["G1"])
+        self.assertEqual(set(res[1]), set(["GO:0000001", "GO:0000002",
+                                           "GO:0000003", "GO:0000004",
+                                           "GO:0000005"]))
+
+
+class TestAnnotationsCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "gene_association")
+        with open(self.filename, "w") as f:
+            f.write(annotation_file(ANNOTATIONS).read())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_cache(self):
+        self.assertIsNone(go._AnnotationColumns.load_cache(self.filename))
+        annotations = go.Annotations(self.filename)
+        annotations._get_columns().save_cache(self.filename)
+
+        columns = go._AnnotationColumns.load_cache(self.filename)
+        self.assertEqual(len(columns), len(annotations))
+        cached = go.Annotations(columns)
+        self.assertEqual(cached.annotations, annotations.annotations)
+        self.assertEqual(cached.header, annotations.header)
+        self.assertEqual(cached.gene_names, annotations.gene_names)
+
+        ontology = go.Ontology(StringIO(ONTOLOGY))
+        annotations.ontology = cached.ontology = ontology
+        self.assertEqual(cached.get_enriched_terms(["G1", "G2"]),
+                         annotations.get_enriched_terms(["G1", "G2"]))
+
+        # Overwrite an existing cache
+        annotations._get_columns().save_cache(self.filename)
+        self.assertIsNotNone(go._AnnotationColumns.load_cache(self.filename))
+
+        # A modified file invalidates the cache
+        with open(self.filename, "a") as f:
+            f.write("\n")
+        self.assertIsNone(go._AnnotationColumns.load_cache(self.filename))
+
+    def test_lazy_records(self):
+        parsed = go.Annotations(self.filename)
+        parsed._get_columns().save_cache(self.filename)
+        columns = go._AnnotationColumns.load_cache(self.filename)
+
+        built = []
+        records = columns.records
+
+        def spy(rows=None):
+            built.append(rows)
+            return records(rows)
+        columns.records = spy
+
+        ontology = go.Ontology(StringIO(ONTOLOGY))
+        cached = go.Annotations(columns, ontology=ontology)
+        self.assertEqual(len(cached), len(parsed))
+        self.assertEqual(cached.gene_names, parsed.gene_names)
+        self.assertEqual(cached.alias_mapper, parsed.alias_mapper)
+        parsed.ontology = ontology
+        self.assertEqual(cached.get_enriched_terms(["G1", "G2"]),
+                         parsed.get_enriched_terms(["G1", "G2"]))
+        self.assertEqual(built, [])
+
+        # Only the accessed group is created
+        self.assertEqual(cached.gene_annotations["G1"],
+                         parsed.gene_annotations["G1"])
+        self.assertEqual(len(built), 1)
+        self.assertEqual(cached.gene_annotations["unknown"], [])
+        self.assertNotIn("unknown", cached.gene_annotations)
+        self.assertEqual(cached.get_all_annotations("GO:0000002"),
+                         parsed.get_all_annotations("GO:0000002"))
+
+        record = parsed.annotations[0]._replace(DB_Object_Symbol="G7")
+        cached.add_annotation(record)
+        parsed.add_annotation(record)
+        self.assertEqual(cached.annotations, parsed.annotations)
+        self.assertEqual(cached.gene_annotations["G7"], [record])
+
+
+class TestAnnotationsParser(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.contents = annotation_file(ANNOTATIONS).read()
+        self.plain = os.path.join(self.tmpdir, "gene_association")
+        with open(self.plain, "w") as f:
+            f.write(self.contents)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_sources(self):
+        expected = go.Annotations(annotation_file(ANNOTATIONS))
+
+        gz = os.path.join(self.tmpdir, "gene_association.gz")
+        with gzip.open(gz, "wb") as f:
+            f.write(self.contents.encode("utf-8"))
+
+        tar = os.path.join(self.tmpdir, "gene_association.tar.gz")
+        with tarfile.open(tar, "w:gz") as f:
+            f.add(self.plain, "gene_association")
+
+        for source in [self.plain, gz, tar, self.tmpdir]:
+            progress = []
+            annotations = go.Annotations()
+            opened = []
+
+            def tar_open(*args, **kwargs):
+                opened.append(tar_open.open(*args, **kwargs))
+                return opened[-1]
+            tar_open.open, tarfile.open = tarfile.open, tar_open
+            try:
+                annotations.parse_file(source,
+                                       progress_callback=progress.append)
+            finally:
+                tarfile.open = tar_open.open
+            self.assertEqual(bool(opened), source == tar)
+            self.assertTrue(all(t.closed for t in opened))
+            self.assertEqual(annotations.annotations, expected.annotations)
+            self.assertEqual(annotations.header, "!gaf-version: 2.0\n")
+            self.assertTrue(progress)
+            self.assertEqual(progress, sorted(progress))
+            self.assertTrue(all(0 <= p <= 100 for p in progress))
+
+    def test_filters(self):
+        annotations = go.Annotations()
+        annotations.parse_file(self.plain, evidence_codes=["IDA", "IEA"],
+                               aspects="P")
+        self.assertEqual(
+            sorted((a.geneName, a.GO_ID) for a in annotations),
+            [("G1", "GO:0000002"), ("G1", "GO:0000004"),
+             ("G2", "GO:0000005")])
+
+        annotations = go.Annotations()
+        annotations.parse_file(self.plain, taxids=["10090"])
+        self.assertEqual(len(annotations), 0)
+        annotations.parse_file(self.plain, taxids=["9606"])
+        self.assertEqual(len(annotations), len(ANNOTATIONS))
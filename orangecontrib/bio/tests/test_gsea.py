@@ -0,0 +1,132 @@
+import random
+import unittest
+
+import numpy
+
+from orangecontrib.bio.utils import gsea_matrix as gsea
+
+
+def signal_to_noise(a, b):
+    # MA_signalToNoise for lists of known values of both classes
+    def stdevm(l):
+        m = numpy.mean(l)
+        return max(numpy.std(l, ddof=1), 0.2*abs(1.0 if m == 0 else m))
+    return (numpy.mean(a) - numpy.mean(b))/(stdevm(a) + stdevm(b))
+
+
+def shuffled_classes(classes, seed):
+    # class values after gsea.shuffleClass(data, seed)
+    locations = list(range(len(classes)))
+    random.Random(seed).shuffle(locations)
+    shuffled = [None]*len(classes)
+    for i, c in enumerate(classes):
+        shuffled[locations[i]] = c
+    return shuffled
+
+
+def enrichment_scores(lcor, subsets):
+    ordered = gsea.orderedPointersCorr(lcor)
+    return [gsea.enrichmentScoreRanked(subset, lcor, ordered)[0]
+            for subset in subsets]
+
+
+class TestEnrichmentScores(unittest.TestCase):
+    def setUp(self):
+        rand = numpy.random.RandomState(42)
+        self.ngenes = 60
+        #rounding makes ties
+        self.rankings = numpy.round(rand.randn(5, self.ngenes), 1)
+        self.subsets = [
+            list(rand.choice(self.ngenes, size, replace=False))
+            for size in [1, 2, 3, 5, 8, 13, 21, 34, 59]]
+        self.subsets.append([3, 3, 7, 11])
+        self.subsets.append([])
+
+        self.X = rand.randn(40, 12)
+        self.mask = numpy.zeros(self.X.shape, dtype=bool)
+        self.mask[[2, 5, 5, 17], [0, 3, 7, 11]] = True
+        self.classes = [0]*6 + [1]*5 + [-1]
+        rand.shuffle(self.classes)
+        self.class_subsets = [
+            list(rand.choice(40, size, replace=False))
+            for size in [1, 4, 9, 16, 25]]
+
+    def test_enrichment_scores(self):
+        scores = gsea.enrichmentScoresMatrix(self.rankings, self.subsets[:-1])
+        self.assertEqual(scores.shape, (5, len(self.subsets) - 1))
+        for lcor, row in zip(self.rankings.tolist(), scores):
+            self.assertEqual(row.tolist(),
+                             enrichment_scores(lcor, self.subsets[:-1]))
+
+        # Small blocks and chunks of rankings give the same scores
+        blocks = gsea.genesetBlocks(self.subsets[:-1], slots=16)
+        self.assertGreater(len(blocks), 1)
+        scores_small = gsea.enrichmentScoresMatrix(
+            self.rankings, self.subsets[:-1], blocks=blocks, slots=100)
+        self.assertEqual(scores_small.tolist(), scores.tolist())
+
+        # An empty set has no hits
+        scores = gsea.enrichmentScoresMatrix(self.rankings, self.subsets)
+        self.assertEqual(scores[:, -1].tolist(), [0.0]*5)
+
+    def test_class_rankings(self):
+        rankings = gsea.SignalToNoiseRankings(self.X, self.mask, self.classes)
+        seeds = [2000 + i for i in range(7)]
+        for seed, row in zip(seeds, rankings(seeds)):
+            classes = shuffled_classes(self.classes, seed)
+            expected = []
+            for values, mask in zip(self.X, self.mask):
+                a = [v for v, c, m in zip(values, classes, mask)
+                     if c == 0 and not m]
+                b = [v for v, c, m in zip(values, classes, mask)
+                     if c == 1 and not m]
+                expected.append(signal_to_noise(a, b))
+            self.assertEqual(row.tolist(), expected)
+
+    def test_class_permutation_nulls(self):
+        rankings = gsea.SignalToNoiseRankings(self.X, self.mask, self.classes)
+        seeds = [2000 + i for i in range(7)]
+        nulls = gsea.permutationNulls(rankings, seeds, self.class_subsets,
+                                      chunk=3)
+        expected = [enrichment_scores(lcor, self.class_subsets)
+                    for lcor in rankings(seeds).tolist()]
+        self.assertEqual(nulls.tolist(), expected)
+
+    def test_gene_permutation_nulls(self):
+        lcor = self.rankings[0].tolist()
+        rankings = gsea.GenePermutationRankings(lcor)
+        seeds = [2000 + i for i in range(7)]
+        nulls = gsea.permutationNulls(rankings, seeds, self.subsets[:-1],
+                                      chunk=3)
+        for seed, row in zip(seeds, nulls):
+            shuffled = list(lcor)
+            random.Random(seed).shuffle(shuffled)
+            self.assertEqual(row.tolist(),
+                             enrichment_scores(shuffled, self.subsets[:-1]))
+
+
+class TestWorkers(unittest.TestCase):
+    def test_workers(self):
+        rand = numpy.random.RandomState(0)
+        rankings = rand.randn(50).tolist()
+        subsets = [list(rand.choice(50, size, replace=False))
+                   for size in [3, 5, 10, 20]]
+        # 130 permutations are not a multiple of the chunk size (50)
+        results = [gsea.gseaR(rankings, subsets, 130, workers=workers)
+                   for workers in [None, 1, 3]]
+        self.assertEqual(len(results[0]), len(subsets))
+        self.assertEqual(results[1], results[0])
+        self.assertEqual(results[2], results[0])
+
+    def test_class_permutation_workers(self):
+        rand = numpy.random.RandomState(0)
+        X = rand.randn(30, 10)
+        rankings = gsea.SignalToNoiseRankings(
+            X, numpy.zeros(X.shape, dtype=bool), [0, 1]*5)
+        subsets = [list(range(5)), list(range(3, 15))]
+        seeds = [2000 + i for i in range(11)]
+        nulls = [gsea.permutationNulls(rankings, seeds, subsets, chunk=4,
+                                       workers=workers)
+                 for workers in [None, 1, 3]]
+        self.assertEqual(nulls[1].tolist(), nulls[0].tolist())
+        self.assertEqual(nulls[2].tolist(), nulls[0].tolist())
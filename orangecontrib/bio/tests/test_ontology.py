@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import doctest
 import unittest
 
@@ -51,6 +54,81 @@ name: bar
         seinfeld = ontology.OBOOntology(seinfeld)
 #        print(seinfeld.child_edges("001"))
 
+class TestCompiledCache(unittest.TestCase):
+    OBO = """\
+format-version: 1.2
+
+[Term]
+id: FOO:001
+name: foo
+def: "A [x] definition." [REF:1] ! comment
+
+[Term]
+id: FOO:002
+name: bar
+alt_id: FOO:003
+is_a: FOO:001 {inferred=true} ! foo
+relationship: part_of FOO:001
+
+[Typedef]
+id: part_of
+"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "foo.obo")
+        with open(self.filename, "w") as f:
+            f.write(self.OBO)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_compiled(self):
+        compiled = ontology._CompiledOBO.parse(StringIO(self.OBO))
+        self.assertEqual(len(compiled), 3)
+        self.assertEqual(compiled.header, "format-version: 1.2\n\n")
+        self.assertEqual(list(compiled.stanzas("Term")), [0, 1])
+        self.assertEqual(compiled.stanza_id(1), "FOO:002")
+        self.assertEqual(compiled.stanza_lines(1)[3],
+                         ("is_a", "FOO:001", "inferred=true", "foo"))
+        self.assertEqual(compiled.tag_values("alt_id"), [(1, "FOO:003")])
+        source, rel_type, target = compiled.arrays["relations"]
+        self.assertEqual(
+            [(s, compiled.string(r), compiled.string(t))
+             for s, r, t in zip(source, rel_type, target)],
+            [(1, "is_a", "FOO:001"), (1, "part_of", "FOO:001")])
+
+    def test_cache(self):
+        cache = self.filename + ".cache"
+        parsed = ontology.OBOOntology(StringIO(self.OBO))
+        for i in range(2):
+            # The first load creates the cache, the second reads it.
+            cached = ontology.OBOOntology()
+            cached.load(self.filename, use_cache=True)
+            self.assertTrue(os.path.isdir(cache))
+            self.assertEqual(cached.header_tags, parsed.header_tags)
+            self.assertEqual([obj.tag_values for obj in cached.objects],
+                             [obj.tag_values for obj in parsed.objects])
+
+        # A modified file invalidates the cache
+        with open(self.filename, "a") as f:
+            f.write("\n[Term]\nid: FOO:004\n")
+        cached = ontology.OBOOntology()
+        cached.load(self.filename, use_cache=True)
+        self.assertIn("FOO:004", cached)
+
+    def test_header(self):
+        progress = []
+        obo = ontology.OBOOntology()
+        obo.load(StringIO("format-version:1.2\nbare-tag\n"
+                          "remark: a: b\n" + self.OBO),
+                 progress_callback=progress.append)
+        self.assertEqual(obo.header_tags[:4],
+                         [("format-version", "1.2"), ("bare-tag", ""),
+                          ("remark", "a: b"), ("format-version", "1.2")])
+        self.assertTrue(progress)
+
+
 def load_tests(loader, tests, ignore):
     stanza = '''[Term]
 id: FOO:001
@@ -0,0 +1,297 @@
+import gzip
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import numpy
+
+from orangecontrib.bio import ppi
+
+
+def random_edges(n_nodes, n_edges, seed=0):
+    rnd = random.Random(seed)
+    edges = set()
+    while len(edges) < n_edges:
+        a, b = rnd.randrange(n_nodes), rnd.randrange(n_nodes)
+        if a != b:
+            edges.add((min(a, b), max(a, b)))
+    return [("9606.P%i" % a, "9606.P%i" % b, rnd.randint(150, 999))
+            for a, b in sorted(edges)]
+
+
+class TestSTRING(unittest.TestCase):
+    def setUp(self):
+        con = sqlite3.connect(":memory:")
+        ppi.STRING.clear_db(con)
+        self.edges = random_edges(300, 600)
+        # STRING stores links in both directions
+        con.executemany("INSERT INTO links VALUES (?, ?, ?)",
+                        self.edges + [(b, a, s) for a, b, s in self.edges])
+        proteins = sorted(set(e[0] for e in self.edges) |
+                          set(e[1] for e in self.edges))
+        con.executemany("INSERT INTO proteins VALUES (?, '9606')",
+                        [(p,) for p in proteins])
+        con.executemany("INSERT INTO aliases VALUES (?, ?, 'test')",
+                        [(p, p.split(".")[1] + suffix) for p in proteins
+                         for suffix in ["", "_alias"]])
+        ppi.STRING.create_db_index(con)
+        self.string = ppi.STRING(database=con)
+        self.ids = proteins[:20] + ["9606.unknown"]
+
+    def test_edges_many(self):
+        edges = self.string.edges_many(self.ids * 2)
+        expected = sum((self.string.edges(id) for id in self.ids), [])
+        self.assertEqual(sorted(edges), sorted(expected))
+        synonyms = self.string.synonyms_many(self.ids)
+        self.assertEqual(synonyms, dict((id, self.string.synonyms(id))
+                                        for id in self.ids))
+        self.assertEqual(synonyms["9606.unknown"], [])
+
+    def test_subnetwork(self):
+        neighbours = {}
+        for a, b, _ in self.edges:
+            neighbours.setdefault(a, set()).add(b)
+            neighbours.setdefault(b, set()).add(a)
+        adjacency = self.string.adjacency("9606")
+        for depth in [0, 1, 2]:
+            expected = set(self.ids[:-1])
+            for _ in range(depth):
+                expected |= set(n for id in expected for n in neighbours[id])
+            nodes, edges = self.string.subnetwork(self.ids, depth=depth)
+            self.assertEqual(nodes, sorted(expected | set(self.ids[-1:])))
+            self.assertEqual(
+                sorted(edges),
+                sorted((a, b, s) for a, b, s in self.string.all_edges()
+                       if a in expected and b in expected))
+
+            nodes_mem, edges_mem = self.string.subnetwork(
+                self.ids, depth=depth, adjacency=adjacency)
+            self.assertEqual(sorted(nodes_mem), sorted(expected))
+            self.assertEqual(sorted(edges_mem), sorted(edges))
+
+    def test_export_adjacency(self):
+        path = tempfile.mkdtemp()
+        try:
+            self.assertRaises(ValueError, self.string.export_adjacency)
+            adjacency = self.string.load_adjacency(path, taxid="9606")
+            self.assertEqual(os.listdir(path),
+                             ["9606_%s" % self.string.VERSION])
+            self.assertIsInstance(adjacency.indices, numpy.memmap)
+            expected = self.string.adjacency("9606")
+            self.assertEqual(adjacency.nodes, expected.nodes)
+            for name in ["indptr", "indices", "weights"]:
+                numpy.testing.assert_array_equal(getattr(adjacency, name),
+                                                 getattr(expected, name))
+            matrix = adjacency.tocsr()
+            n = len(expected.nodes)
+            self.assertEqual(matrix.shape, (n, n))
+            self.assertEqual(matrix.nnz, 2 * len(self.edges))
+            a, b, score = self.edges[0]
+            i, j = adjacency.node_indices([a, b])
+            self.assertEqual(matrix[i, j], score)
+            self.assertTrue(numpy.may_share_memory(matrix.indices,
+                                                   adjacency.indices))
+
+            # A database without a file is exported on every call
+            self.string.db.execute("DELETE FROM links")
+            adjacency = self.string.load_adjacency(path, taxid="9606")
+            self.assertEqual(adjacency.tocsr().nnz, 0)
+            self.assertEqual(len(os.listdir(path)), 1)
+            del matrix, adjacency
+        finally:
+            shutil.rmtree(path)
+
+
+class TestBioGRID(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        filename = os.path.join(self.path, "biogrid.sqlite")
+        con = sqlite3.connect(filename)
+        for table, schema in ppi.BioGRID.SCHEMA:
+            con.execute("create table %s (%s)" %
+                        (table, schema.strip().rstrip(",")))
+        edges = [(a.split(".")[1], b.split(".")[1])
+                 for a, b, _ in random_edges(50, 100)] + [("P1", "P1")]
+        con.executemany("insert into links (biogrid_interaction_id, "
+                        "biogrid_id_interactor_a, biogrid_id_interactor_b) "
+                        "values (?, ?, ?)",
+                        [(str(i), a, b) for i, (a, b) in enumerate(edges)])
+        con.executemany("insert into proteins values (?, ?, ?, ?, ?, ?)",
+                        [("P%i" % i, str(i), None, "S%i" % i,
+                          "A%i|B%i" % (i, i), "9606") for i in range(50)])
+        con.commit()
+        con.close()
+        self.biogrid = ppi.BioGRID(database=filename)
+
+    def tearDown(self):
+        self.biogrid.db.close()
+        shutil.rmtree(self.path)
+
+    def test_edges_many(self):
+        ids = ["P1", "P2", "P3", "P4", "unknown"]
+        edges = self.biogrid.edges_many(ids)
+        self.assertEqual(len(edges), len(set(edges)))
+        self.assertEqual(
+            sorted(edges),
+            sorted(set(e for id in ids for e in self.biogrid.edges(id))))
+        self.assertEqual(len(self.biogrid.edges("P1")),
+                         len([e for e in self.biogrid.all_edges()
+                              if "P1" in e[:2]]))
+        self.assertEqual(self.biogrid.synonyms_many(ids[-2:]),
+                         {"P4": ["4", "S4", "A4", "B4"], "unknown": []})
+
+        nodes, edges = self.biogrid.subnetwork(["P1"], depth=1)
+        self.assertEqual(
+            nodes, sorted(set(["P1"]) | set(
+                id for e in self.biogrid.edges("P1") for id in e[:2])))
+        nodes_mem, _ = self.biogrid.subnetwork(
+            ["P1"], depth=1, adjacency=self.biogrid.adjacency())
+        self.assertEqual(sorted(nodes_mem), nodes)
+
+        # Covering indexes on both interactors are used
+        plan = self.biogrid.db.execute(
+            "explain query plan select biogrid_id_interactor_a, score "
+            "from links where biogrid_id_interactor_b=?", ("P1",)).fetchall()
+        self.assertIn("COVERING INDEX", " ".join(str(r) for r in plan))
+
+
+class TestAdjacency(unittest.TestCase):
+    def test_adjacency(self):
+        adj = ppi.Adjacency.from_edges(
+            [("a", "b", 1), ("b", "c", 2), ("a", "b", 1), ("d", "d", 3)])
+        self.assertEqual(adj.nodes, ["a", "b", "c", "d"])
+        self.assertEqual(adj.indptr.tolist(), [0, 1, 3, 4, 5])
+        self.assertEqual(adj.indices.tolist(), [1, 0, 2, 1, 3])
+        self.assertEqual(adj.weights.tolist(), [1, 1, 2, 2, 3])
+        self.assertEqual(adj.neighbourhood(["a", "x"], 1).tolist(), [0, 1])
+        self.assertEqual(adj.neighbourhood(["a"], 5).tolist(), [0, 1, 2])
+        self.assertEqual(adj.neighbourhood([], 5).tolist(), [])
+        nodes, edges = adj.subnetwork(["c"], 1)
+        self.assertEqual(nodes, ["b", "c"])
+        self.assertEqual(edges, [("b", "c", 2.0), ("c", "b", 2.0)])
+
+
+class TestSTRINGBuild(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.dbfilename = os.path.join(self.path, "string.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, flatfile, taxid, header, lines):
+        filename = os.path.join(self.path, "%s.%s.v10.txt.gz" %
+                                (taxid, flatfile))
+        with gzip.open(filename, "wb") as f:
+            f.write(("\n".join([header] + lines) + "\n").encode("utf-8"))
+
+    def write_files(self, taxid, edges):
+        self.write("protein.links", taxid, "protein1 protein2 combined_score",
+                   ["%s %s %i" % e for e in edges])
+        self.write("protein.actions", taxid,
+                   "item_id_a\titem_id_b\tmode\taction\ta_is_acting\tscore",
+                   ["%s\t%s\tbinding\t\t0\t%i" % e for e in edges[:10]])
+        proteins = sorted(set(e[0] for e in edges))
+        self.write("protein.aliases", taxid,
+                   "## string_protein_id ## alias ## source ##",
+                   [u"%s\t%s\t%s_alias\xe9\tTest" %
+                    (taxid, p.split(".", 1)[1], p) for p in proteins])
+
+    def edges(self, taxid, n_nodes, n_edges, seed=0):
+        edges = [(a.replace("9606", taxid), b.replace("9606", taxid), s)
+                 for a, b, s in random_edges(n_nodes, n_edges, seed)]
+        return edges + [(b, a, s) for a, b, s in edges]
+
+    def test_build(self):
+        human = self.edges("9606", 200, 1000)
+        self.write_files("9606", human)
+        progress = []
+        counts = ppi.STRING.init_db("v10", "9606", cache_dir=self.path,
+                                    dbfilename=self.dbfilename,
+                                    progress_callback=progress.append,
+                                    processes=True)
+        self.assertEqual(counts, {"links": 2000, "actions": 10,
+                                  "aliases": 200})
+        self.assertAlmostEqual(progress[-1], 100.0)
+
+        string = ppi.STRING(database=self.dbfilename)
+        self.assertEqual(string.organisms(), ["9606"])
+        self.assertEqual(sorted(string.all_edges("9606")), sorted(human))
+        self.assertEqual(len(string.ids("9606")), 200)
+        self.assertEqual(string.synonyms("9606.P1"),
+                         [u"9606.P1_alias\xe9"])
+        self.assertEqual(len(list(string.edges_annotated(human[0][0]))),
+                         len(string.edges(human[0][0])))
+        string.db.close()
+
+        # Add a second organism and rebuild the first one
+        mouse = self.edges("10090", 100, 300)
+        self.write_files("10090", mouse)
+        ppi.STRING.init_db("v10", "10090", cache_dir=self.path,
+                           dbfilename=self.dbfilename, processes=False)
+        human = self.edges("9606", 200, 500, seed=1)
+        self.write_files("9606", human)
+        ppi.STRING.init_db("v10", "9606", cache_dir=self.path,
+                           dbfilename=self.dbfilename)
+
+        string = ppi.STRING(database=self.dbfilename)
+        self.assertEqual(sorted(string.organisms()), ["10090", "9606"])
+        self.assertEqual(sorted(string.all_edges("9606")), sorted(human))
+        self.assertEqual(sorted(string.all_edges("10090")), sorted(mouse))
+        self.assertEqual(len(string.synonyms("9606.P1")), 1)
+        indexes = string.db.execute(
+            "SELECT name FROM sqlite_master WHERE type='index'").fetchall()
+        self.assertIn(("index_link_protein_id1_id2",), indexes)
+        string.db.close()
+
+    def test_export_adjacency(self):
+        self.write_files("9606", self.edges("9606", 100, 300))
+        ppi.STRING.init_db("v10", "9606", cache_dir=self.path,
+                           dbfilename=self.dbfilename)
+        string = ppi.STRING(database=self.dbfilename)
+        dirname = string.export_adjacency(taxid="9606")
+        self.assertEqual(string.load_adjacency(taxid="9606").tocsr().nnz, 600)
+        # Exported once for a database file
+        self.assertEqual(string.export_adjacency(taxid="9606"), dirname)
+        string.db.close()
+
+        # Rebuilt database
+        self.write_files("9606", self.edges("9606", 20, 10, seed=1))
+        ppi.STRING.init_db("v10", "9606", cache_dir=self.path,
+                           dbfilename=self.dbfilename)
+        string = ppi.STRING(database=self.dbfilename)
+        self.assertEqual(string.load_adjacency(taxid="9606").tocsr().nnz, 20)
+        self.assertEqual(os.listdir(os.path.dirname(dirname)),
+                         [os.path.basename(string.export_adjacency(
+                             taxid="9606"))])
+        string.db.close()
+
+    def test_error(self):
+        self.write_files("9606", self.edges("9606", 20, 30))
+        self.write("protein.links", "9606", "header", ["a b not-a-score"])
+        for processes, error in [(True, RuntimeError), (False, ValueError)]:
+            with self.assertRaises(error):
+                ppi.STRING.init_db("v10", "9606", cache_dir=self.path,
+                                   dbfilename=self.dbfilename,
+                                   processes=processes)
+
+    def test_failed_update(self):
+        human = self.edges("9606", 50, 100)
+        mouse = self.edges("10090", 30, 60)
+        for taxid, edges in [("9606", human), ("10090", mouse)]:
+            self.write_files(taxid, edges)
+            ppi.STRING.init_db("v10", taxid, cache_dir=self.path,
+                               dbfilename=self.dbfilename, processes=False)
+
+        # A failed update of one organism is rolled back
+        self.write("protein.links", "9606", "header", ["a b not-a-score"])
+        with self.assertRaises(ValueError):
+            ppi.STRING.init_db("v10", "9606", cache_dir=self.path,
+                               dbfilename=self.dbfilename, processes=False)
+        string = ppi.STRING(database=self.dbfilename)
+        self.assertEqual(sorted(string.all_edges("9606")), sorted(human))
+        self.assertEqual(sorted(string.all_edges("10090")), sorted(mouse))
+        string.db.close()
@@ -0,0 +1,357 @@
+import bz2
+import gzip
+import hashlib
+import io
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs
+
+from orangecontrib.bio.utils import serverfiles
+
+
+def gzip_bytes(data):
+    f = io.BytesIO()
+    with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+        gz.write(data)
+    return f.getvalue()
+
+
+def tar_bytes(files, mode="w:gz"):
+    f = io.BytesIO()
+    with tarfile.open(fileobj=f, mode=mode) as tar:
+        for name, data in files:
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = len(data)
+            tar.addfile(tarinfo, io.BytesIO(data))
+    return f.getvalue()
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """A stand-in for the server file repository (public access only)."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if isinstance(body, bytes):
+            body = body.decode("ascii")
+        args = dict((k, v[0]) for k, v in parse_qs(body).items())
+        command = self.path.rsplit("/", 1)[-1]
+        server = self.server
+        server.log(self, command)
+        key = args.get("domain"), args.get("filename")
+        if command == "download":
+            self.download(server.files[key][0])
+        elif command == "info":
+            self.send(server.files[key][1])
+        elif command == "allinfo":
+            self.send("".join(
+                "[[[[[%s=====%s" % (fn, info)
+                for (dom, fn), (_, info) in server.files.items()
+                if dom == args["domain"]))
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        self.server.log(self, self.path.rsplit("/", 1)[-1])
+        if self.path.endswith("/listdomains"):
+            self.send("|||||".join(set(d for d, _ in self.server.files)))
+        else:
+            self.send_error(404)
+
+    def send(self, text):
+        data = text.encode("utf-8")
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            with self.server.lock:
+                self.server.not_modified += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def download(self, data):
+        server = self.server
+        match = re.match(r"bytes=(\d+)-", self.headers.get("Range") or "")
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        if_range = self.headers.get("If-Range")
+        with server.lock:
+            server.requests.append(self.headers.get("Range"))
+            fail_after, server.fail_after = server.fail_after, None
+        if match and server.ranges and if_range in (None, etag):
+            start = int(match.group(1))
+            if start >= len(data):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %i-%i/%i" %
+                             (start, len(data) - 1, len(data)))
+        else:
+            start = 0
+            self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(data) - start))
+        self.end_headers()
+        if fail_after is not None:
+            # Drop the connection midway
+            self.wfile.write(data[start:start + fail_after])
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(2)
+        else:
+            self.wfile.write(data[start:])
+
+
+class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), Handler)
+        self.lock = threading.Lock()
+        self.files = {}
+        self.requests = []
+        self.commands = []
+        self.not_modified = 0
+        self.connections = set()
+        self.fail_after = None
+        self.ranges = True
+
+    def log(self, handler, command):
+        with self.lock:
+            self.commands.append(command)
+            self.connections.add(handler.client_address)
+
+    def add(self, domain, filename, data, tags=(),
+            date="2015-01-01 00:00:00"):
+        self.files[domain, filename] = (data, "%i|||||%s|||||%s|||||%s" % (
+            len(data), date, filename, ";".join(tags)))
+
+
+class TestServerFiles(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.buffer_dir = serverfiles.environ.buffer_dir
+        serverfiles.environ.buffer_dir = self.path
+
+        self.server = Server()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.sf = serverfiles.ServerFiles(
+            server="127.0.0.1:%i/" % self.server.server_address[1])
+
+        self.data = os.urandom(300000)
+        self.text = "".join("line %i\n" % i
+                            for i in range(50000)).encode("ascii")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        serverfiles.environ.buffer_dir = self.buffer_dir
+        shutil.rmtree(self.path)
+
+    def read(self, domain, filename):
+        with open(serverfiles.localpath(domain, filename), "rb") as f:
+            return f.read()
+
+    def test_download(self):
+        self.server.add("test", "data", self.data, tags=["a", "b"])
+        calls = []
+        serverfiles.download("test", "data", self.sf,
+                             callback=lambda: calls.append(1))
+        self.assertEqual(self.read("test", "data"), self.data)
+        self.assertEqual(len(calls), 100)
+        self.assertEqual(serverfiles.listfiles("test"), ["data"])
+        self.assertEqual(serverfiles.info("test", "data")["tags"], ["a", "b"])
+        self.assertEqual(sorted(os.listdir(serverfiles.localpath("test"))),
+                         ["data", "data.info"])
+
+    def test_decompress(self):
+        # Concatenated streams are decompressed as a whole
+        half = len(self.text) // 2
+        self.server.add("test", "text.gz",
+                        gzip_bytes(self.text[:half]) +
+                        gzip_bytes(self.text[half:]),
+                        tags=["#compression:gz"])
+        self.server.add("test", "text.bz2",
+                        bz2.compress(self.text[:half]) +
+                        bz2.compress(self.text[half:]),
+                        tags=["#compression:bz2"])
+        for filename in ["text.gz", "text.bz2"]:
+            serverfiles.download("test", filename, self.sf)
+            self.assertEqual(self.read("test", filename), self.text)
+
+        serverfiles.download("test", "text.gz", self.sf, extract=False)
+        self.assertEqual(gzip.GzipFile(
+            serverfiles.localpath("test", "text.gz")).read(), self.text)
+
+    def test_extract(self):
+        files = [("a.txt", self.text), ("b.dat", self.data)]
+        archive = tar_bytes(files, "w:bz2")
+        self.server.add("test", "files.tar.bz2", archive,
+                        tags=["#compression:tar.bz2", "#files:a.txt!@b.dat"])
+        serverfiles.download("test", "files.tar.bz2", self.sf)
+        self.assertEqual(self.read("test", "a.txt"), self.text)
+        self.assertEqual(self.read("test", "b.dat"), self.data)
+        self.assertEqual(self.read("test", "files.tar.bz2"), archive)
+
+        self.server.add("test", "dir.tar.gz", tar_bytes(files),
+                        tags=["#compression:tar.gz"])
+        serverfiles.download("test", "dir.tar.gz", self.sf)
+        self.assertEqual(self.read("test", os.path.join("dir.tar.gz", "a.txt")),
+                         self.text)
+
+    def test_resume(self):
+        compressed = gzip_bytes(self.text)
+        self.server.add("test", "text.gz", compressed,
+                        tags=["#compression:gz"])
+        # The transfer is interrupted and resumed with a Range request
+        self.server.fail_after = 10000
+        calls = []
+        serverfiles.download("test", "text.gz", self.sf,
+                             callback=lambda: calls.append(1))
+        self.assertEqual(self.read("test", "text.gz"), self.text)
+        self.assertEqual(self.server.requests, [None, "bytes=10000-"])
+        self.assertEqual(len(calls), 100)
+
+        # Continue a download interrupted in an earlier session
+        self.server.add("test", "data", self.data)
+        part = serverfiles.localpath("test", "data.part")
+        self.interrupt("data", part, 12345)
+        del self.server.requests[:]
+        serverfiles.download("test", "data", self.sf)
+        self.assertEqual(self.read("test", "data"), self.data)
+        self.assertEqual(self.server.requests, ["bytes=12345-"])
+        self.assertFalse(os.path.exists(part + ".version"))
+
+        # Stale part is larger than the file
+        self.interrupt("data", part, 12345)
+        with open(part, "ab") as f:
+            f.write(self.data)
+        serverfiles.download("test", "data", self.sf)
+        self.assertEqual(self.read("test", "data"), self.data)
+
+        # A part without the file version is not used
+        with open(part, "wb") as f:
+            f.write(b"x" * 100)
+        del self.server.requests[:]
+        serverfiles.download("test", "data", self.sf)
+        self.assertEqual(self.read("test", "data"), self.data)
+        self.assertEqual(self.server.requests, [None])
+
+    def interrupt(self, filename, part, fail_after):
+        self.server.fail_after = fail_after
+        with self.assertRaises(serverfiles._retry_errors()):
+            for _ in self.sf.download_iter("test", filename, part,
+                                           retries=0):
+                pass
+        self.assertEqual(os.path.getsize(part), fail_after)
+
+    def test_resume_changed_file(self):
+        part = serverfiles.localpath("test", "data.part")
+        self.server.add("test", "data", self.data)
+        self.interrupt("data", part, 10000)
+
+        # A new version in the repository (the part is discarded)
+        new = os.urandom(len(self.data))
+        self.server.add("test", "data", new, date="2016-01-01 00:00:00")
+        self.sf.invalidate_index()
+        del self.server.requests[:]
+        serverfiles.download("test", "data", self.sf)
+        self.assertEqual(self.read("test", "data"), new)
+        self.assertEqual(self.server.requests, [None])
+
+        # Changed contents with the same repository info (If-Range)
+        self.interrupt("data", part, 10000)
+        self.server.add("test", "data", self.data, date="2016-01-01 00:00:00")
+        del self.server.requests[:]
+        serverfiles.download("test", "data", self.sf)
+        self.assertEqual(self.read("test", "data"), self.data)
+        self.assertEqual(self.server.requests, ["bytes=10000-"])
+
+    def test_resume_without_ranges(self):
+        self.server.ranges = False
+        self.server.add("test", "data", self.data)
+        self.server.fail_after = 100000
+        serverfiles.download("test", "data", self.sf)
+        self.assertEqual(self.read("test", "data"), self.data)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_update_by_tags(self):
+        for i in range(6):
+            self.server.add("test", "file%i" % i, self.data[i:],
+                            tags=["essential"] if i % 3 else ["other"])
+        serverfiles.update_by_tags(["essential"], verbose=False, workers=3,
+                                   serverfiles=self.sf)
+        self.assertEqual(sorted(serverfiles.listfiles("test")),
+                         ["file1", "file2", "file4", "file5"])
+        self.assertEqual(self.read("test", "file5"), self.data[5:])
+
+        del self.server.requests[:]
+        serverfiles.update_by_tags(["essential"], verbose=False, workers=3,
+                                   serverfiles=self.sf)
+        self.assertEqual(self.server.requests, [])
+
+        self.server.add("test", "file4", self.data[:10],
+                        date="2016-01-01 00:00:00")
+        serverfiles.update_local_files(verbose=False, workers=3,
+                                       serverfiles=self.sf)
+        self.assertEqual(self.read("test", "file4"), self.data[:10])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_index(self):
+        for i in range(100):
+            self.server.add("dom%i" % (i % 2), "file%i" % i, self.data[:i],
+                            tags=["t%i" % i])
+        for i in range(0, 100, 10):
+            serverfiles.download("dom%i" % (i % 2), "file%i" % i, self.sf)
+        self.server.add("dom0", "file20", b"new",
+                        date="2016-01-01 00:00:00")
+        self.sf.invalidate_index()
+        del self.server.commands[:]
+        self.server.connections.clear()
+
+        updates = [serverfiles.needs_update("dom%i" % (i % 2), "file%i" % i,
+                                            self.sf)
+                   for i in range(100)]
+        self.assertEqual([i for i in range(100) if not updates[i]],
+                         [i for i in range(0, 100, 10) if i != 20])
+        self.assertEqual(self.sf.info("dom1", "file11")["tags"], ["t11"])
+        self.assertEqual(sorted(self.sf.listdomains()), ["dom0", "dom1"])
+        self.assertEqual(len(self.sf.listfiles("dom1")), 50)
+        self.assertEqual(len(self.sf.search(["t1"])), 11)
+        # One listing of domains and of each domain's files,
+        # all over a single kept alive connection
+        self.assertEqual(sorted(self.server.commands),
+                         ["allinfo", "allinfo", "listdomains"])
+        self.assertEqual(len(self.server.connections), 1)
+
+        # Revalidation transfers only changed domains
+        self.sf.index_max_age = 0
+        self.server.not_modified = 0
+        self.server.add("dom1", "file11", b"new", tags=["new"])
+        self.assertEqual(self.sf.info("dom1", "file11")["tags"], ["new"])
+        self.assertEqual(self.server.not_modified, 2)
+        self.assertEqual(self.sf.info("dom0", "file0")["tags"], ["t0"])
+        self.assertEqual(self.server.not_modified, 5)
+
+        # Files missing from the index are requested directly
+        self.server.add("dom1", "extra", b"x")
+        self.sf.index_max_age = 60
+        del self.server.commands[:]
+        self.assertEqual(self.sf.info("dom1", "extra")["size"], "1")
+        self.assertEqual(self.server.commands, ["info"])
@@ -0,0 +1,105 @@
+import random
+import unittest
+
+import numpy
+
+from orangecontrib.bio.utils import stats
+
+
+class TestPValues(unittest.TestCase):
+    def arguments(self, count=500, seed=0):
+        rnd = random.Random(seed)
+        args = []
+        for _ in range(count):
+            N = rnd.choice([10, 100, 1000, 5000])
+            m = rnd.randint(0, N)
+            n = rnd.randint(0, N)
+            args.append((rnd.randint(0, min(n, m) + 1), N, m, n))
+        # p = 0 and p = 1 (binomial), k outside the support
+        args += [(0, 10, 0, 5), (1, 10, 0, 5), (5, 10, 10, 5),
+                 (3, 10, 10, 5), (6, 10, 3, 5), (0, 1, 1, 0)]
+        return args
+
+    def assertParity(self, prob, args):
+        expected = [prob.p_value(*a) for a in args]
+        k, N, m, n = map(list, zip(*args))
+        result = prob.p_values(k, N, m, n)
+        self.assertEqual(result.shape, (len(args),))
+        numpy.testing.assert_allclose(result, expected, rtol=1e-9,
+                                      atol=1e-300)
+
+    def test_parity(self):
+        for prob in [stats.Binomial(), stats.Hypergeometric()]:
+            self.assertParity(prob, self.arguments())
+
+    def test_chunks(self):
+        for prob in [stats.Binomial(), stats.Hypergeometric()]:
+            prob._chunk_size = 7
+            self.assertParity(prob, self.arguments(100, seed=1))
+
+    def test_broadcast(self):
+        prob = stats.Hypergeometric()
+        res = prob.p_values([[1, 2], [3, 4]], 100, 20, 10)
+        self.assertEqual(res.shape, (2, 2))
+        self.assertAlmostEqual(res[1, 0], prob.p_value(3, 100, 20, 10),
+                               places=12)
+        self.assertEqual(prob.p_values(5, 100, 20, 10).shape, ())
+        self.assertEqual(prob.p_values([], 100, 20, 10).shape, (0,))
+
+    def test_lookup_table(self):
+        # entries above 1000 are computed with the gamma function
+        table = stats.LogBin._lookup_table(3000)
+        self.assertGreaterEqual(len(table), 3000)
+        self.assertEqual(table[:len(stats.LogBin._lookup)].tolist(),
+                         stats.LogBin._lookup[:len(table)])
+        self.assertAlmostEqual(table[2000], stats._lngamma(2001),
+                               delta=1e-9)
+
+
+def fdr_reference(p_values, dependent=False):
+    m = float(len(p_values))
+    if dependent:
+        m *= sum(1.0 / i for i in range(1, len(p_values) + 1))
+    order = sorted(range(len(p_values)), key=p_values.__getitem__)
+    fdrs = [None] * len(p_values)
+    cmin = float("inf")
+    for rank in reversed(range(len(order))):
+        i = order[rank]
+        cmin = min(cmin, p_values[i] * m / (rank + 1))
+        fdrs[i] = cmin
+    return fdrs
+
+
+class TestCorrections(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(0)
+        self.p_values = [round(rnd.random() ** 3, 3) for _ in range(200)]
+
+    def test_fdr(self):
+        for dependent in [False, True]:
+            expected = fdr_reference(self.p_values, dependent)
+            res = stats.FDR(self.p_values, dependent=dependent)
+            self.assertIsInstance(res, list)
+            numpy.testing.assert_allclose(res, expected, rtol=1e-12)
+
+            res = stats.FDR(numpy.array(self.p_values), dependent=dependent)
+            self.assertIsInstance(res, numpy.ndarray)
+            numpy.testing.assert_allclose(res, expected, rtol=1e-12)
+
+        ordered = sorted(self.p_values)
+        numpy.testing.assert_allclose(
+            stats.FDR(ordered, ordered=True), fdr_reference(ordered),
+            rtol=1e-12)
+        self.assertEqual(stats.FDR([]), [])
+        self.assertEqual(stats.FDR([0.5], m=4), [2.0])
+
+    def test_bonferroni(self):
+        numpy.testing.assert_allclose(
+            stats.Bonferroni([0.01, 0.2, 0.001]), [0.03, 0.6, 0.003])
+        numpy.testing.assert_allclose(
+            stats.Bonferroni(numpy.array([0.01, 0.5]), m=10), [0.1, 1.0])
+        self.assertEqual(stats.Bonferroni([]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
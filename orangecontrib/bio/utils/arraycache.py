@@ -0,0 +1,96 @@
+"""
+Compiled on disk caches.
+
+A cache is a directory holding a pickled metadata dictionary
+(``meta.pickle``) and a set of numpy arrays (``<name>.npy``) which are
+memory mapped when loaded. A cache is always written to a temporary
+directory first and then renamed into place, so concurrent readers
+never see a partially written cache.
+
+"""
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import numpy
+
+from . import serverfiles
+
+
+def file_revision(filename):
+    """
+    Return a revision string for a (downloaded) file.
+
+    For files in the local serverfiles repository this is the datetime
+    from the file's info, otherwise the file modification time and size.
+
+    """
+    try:
+        return serverfiles._open_file_info(filename + ".info")["datetime"]
+    except (IOError, OSError, IndexError):
+        stat = os.stat(filename)
+        return "%r-%i" % (stat.st_mtime, stat.st_size)
+
+
+def cache_path(filename):
+    """
+    Return the default cache path for `filename`.
+    """
+    return filename + ".cache"
+
+
+def save(path, meta, arrays):
+    """
+    Save the `meta` dictionary and a dictionary of numpy `arrays` to a
+    cache directory `path` (replacing an existing cache).
+    """
+    dirname = os.path.dirname(path) or None
+    prefix = os.path.basename(path) + "."
+    tmpdir = tempfile.mkdtemp(prefix=prefix, dir=dirname)
+    try:
+        for name, array in arrays.items():
+            numpy.save(os.path.join(tmpdir, name + ".npy"), array)
+        meta = dict(meta, arrays=sorted(arrays))
+        with open(os.path.join(tmpdir, "meta.pickle"), "wb") as f:
+            pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        if os.path.exists(path):
+            stale = tempfile.mkdtemp(prefix=prefix, dir=dirname)
+            os.rename(path, os.path.join(stale, "cache"))
+            shutil.rmtree(stale, ignore_errors=True)
+        os.rename(tmpdir, path)
+    except (IOError, OSError):
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        # A concurrent writer might have won the race.
+        if not os.path.isdir(path):
+            raise
+
+
+def load(path, mmap_mode="r", **expected):
+    """
+    Load a cache saved with :func:`save`. Return a (meta, arrays) tuple
+    or `None` if the cache does not exist, is damaged or any of the
+    `expected` keyword arguments does not match the stored metadata.
+    """
+    try:
+        with open(os.path.join(path, "meta.pickle"), "rb") as f:
+            meta = pickle.load(f)
+        if any(meta.get(key) != value for key, value in expected.items()):
+            return None
+        # Plain ndarray views of the mapped files (indexing numpy.memmap
+        # instances has a large overhead).
+        arrays = dict((name, numpy.asarray(numpy.load(
+                           os.path.join(path, name + ".npy"),
+                           mmap_mode=mmap_mode)))
+                      for name in meta["arrays"])
+    except (IOError, OSError, EOFError, KeyError, ValueError, TypeError,
+            AttributeError, ImportError, pickle.UnpicklingError):
+        return None
+    return meta, arrays
@@ -0,0 +1,568 @@
+"""
+Gene set enrichment analysis computations on NumPy arrays: enrichment
+scores of many gene sets for many (permuted) rankings at once, the
+permutation null distributions and their significance. The functions
+working with Orange data tables are in orangecontrib.bio.gsea.
+"""
+from __future__ import absolute_import
+
+import random
+import warnings
+from functools import reduce
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import numpy
+
+def mean(l):
+    return float(sum(l))/len(l)
+
+def nth(l,n): return [ a[n] for a in l ]
+
+def orderedPointersCorr(lcor):
+    """
+    Return a list of integers: indexes in original
+    lcor. Elements in the list are ordered by
+    their lcor[i] value. Higher correlations first.
+    """
+    ordered = [ (i,a) for i,a in enumerate(lcor) ] #original pos + correlation
+    ordered.sort(key=lambda x: -x[1]) #sort by correlation, descending
+    ordered = nth(ordered, 0) #contains positions in the original list
+    return ordered
+
+def enrichmentScoreRanked(subset, lcor, ordered, p=1.0, rev2=None):
+    """
+    Input data and subset. 
+    
+    subset: list of attribute indices of the input data belonging
+        to the same set.
+    lcor: correlations with class for each attribute in a list. 
+
+    Returns enrichment score on given data.
+
+    This implementation efficiently handles "sparse" genesets (that
+    cover only a small subset of all genes in the dataset).
+    """
+
+    #print lcor
+
+    subset = set(subset)
+
+    if rev2 == None:
+        def rev(l):
+            return numpy.argsort(l)
+        rev2 = rev(ordered)
+
+    #add if gene is not in the subset
+    notInA = -(1. / (len(lcor)-len(subset)))
+    #base for addition if gene is in the subset
+
+    cors = [ abs(lcor[i])**p for i in subset ] #belowe in numpy
+    sumcors = sum(cors)
+
+    #this should not happen
+    if sumcors == 0.0:
+        return (0.0, None)
+    
+    inAb = 1./sumcors
+
+    ess = [0.0]
+    
+    map = {}
+    for i in subset:
+        orderedpos = rev2[i]
+        map[orderedpos] = inAb*abs(lcor[i]**p)
+        
+    last = 0
+
+    maxSum = minSum = csum = 0.0
+
+    for a,b in sorted(map.items()):
+        diff = a-last
+        csum += notInA*diff
+        last = a+1
+        
+        if csum < minSum:
+            minSum = csum
+        
+        csum += b
+
+        if csum > maxSum:
+            maxSum = csum
+
+    #finish it
+    diff = (len(ordered))-last
+    csum += notInA*diff
+
+    if csum < minSum:
+        minSum = csum
+
+    #print "MY", (maxSum if abs(maxSum) > abs(minSum) else minSum)
+
+    """
+    #BY DEFINITION
+    print "subset", subset
+
+    for i in ordered:
+        ess.append(ess[-1] + \
+            (inAb*abs(lcor[i]**p) if i in subset else notInA)
+        )
+        if i in subset:
+            print ess[-2], ess[-1]
+            print i, (inAb*abs(lcor[i]**p))
+
+    maxEs = max(ess)
+    minEs = min(ess)
+    
+    print "REAL", (maxEs if abs(maxEs) > abs(minEs) else minEs, ess[1:])
+
+    """
+    return (maxSum if abs(maxSum) > abs(minSum) else minSum, [])
+
+def rankPositions(rankings):
+    """
+    Return positions of attributes in the descending order of their
+    rankings, one row for each row of rankings. Ties keep their original
+    order (as in orderedPointersCorr).
+    """
+    rankings = numpy.atleast_2d(numpy.asarray(rankings, dtype=float))
+    order = numpy.argsort(-rankings, axis=1, kind="mergesort")
+    positions = numpy.empty_like(order)
+    rows = numpy.arange(order.shape[0])[:, None]
+    positions[rows, order] = numpy.arange(order.shape[1])
+    return positions
+
+def genesetBlocks(subsets, slots=2**14):
+    """
+    Group gene sets into blocks of similarly sized sets for
+    enrichmentScoresMatrix. Returns a list of (indices of sets, member
+    matrix) pairs. Rows of member matrices are padded with -1 at the
+    beginning.
+
+    Members are listed in the iteration order of set(subset), the order
+    in which enrichmentScoreRanked sums their correlations.
+    """
+    members = [ list(set(subset)) for subset in subsets ]
+    bysize = sorted(range(len(members)), key=lambda i: len(members[i]))
+
+    blocks = []
+    start = 0
+    while start < len(bysize):
+        #sets are sorted by size, so the last one is the largest
+        stop = start + 1
+        while stop < len(bysize) and \
+                (stop - start + 1)*len(members[bysize[stop]]) <= slots:
+            stop += 1
+        indices = bysize[start:stop]
+        width = max(1, len(members[indices[-1]]))
+        matrix = numpy.full((len(indices), width), -1, dtype=int)
+        for row, i in zip(matrix, indices):
+            if members[i]:
+                row[width-len(members[i]):] = members[i]
+        blocks.append((numpy.array(indices), matrix))
+        start = stop
+    return blocks
+
+def enrichmentScoresMatrix(rankings, subsets, p=1.0, blocks=None,
+        slots=2**22):
+    """
+    Compute enrichment scores of all subsets for each row of rankings
+    at once. Returns a (number of rankings) x (number of subsets) array.
+
+    The results are identical to enrichmentScoreRanked. Running sums
+    are computed with cumulative sums over the interleaved steps between
+    the hits of each gene set, in the same order as enrichmentScoreRanked
+    adds them.
+
+    blocks: gene sets grouped with genesetBlocks.
+    slots: maximum number of running sum elements computed at once.
+    """
+    rankings = numpy.atleast_2d(numpy.asarray(rankings, dtype=float))
+    if blocks is None:
+        blocks = genesetBlocks(subsets)
+
+    nrankings, ngenes = rankings.shape
+    positions = rankPositions(rankings)
+    weights = numpy.abs(rankings)**p
+
+    scores = numpy.zeros((nrankings, len(subsets)))
+
+    for indices, members in blocks:
+        valid = members >= 0
+        sizes = valid.sum(axis=1)
+        width = members.shape[1]
+
+        with numpy.errstate(divide="ignore"):
+            notInA = -(1. / (ngenes - sizes))
+
+        step = max(1, slots // (len(members)*(2*width + 1)))
+        for start in range(0, nrankings, step):
+            rows = slice(start, start + step)
+
+            cors = numpy.where(valid, weights[rows][:, members], 0.0)
+            sumcors = numpy.cumsum(cors, axis=2)[:, :, -1]
+
+            #hits in ranked order, padding (-1) first
+            hits = numpy.where(valid, positions[rows][:, members], -1)
+            order = numpy.argsort(hits, axis=2)
+            ind = numpy.ogrid[tuple(slice(0, s) for s in hits.shape)]
+            hits = hits[ind[0], ind[1], order]
+            cors = cors[ind[0], ind[1], order]
+
+            previous = numpy.concatenate(
+                [ numpy.full(hits.shape[:2] + (1,), -1, dtype=int),
+                  hits[:, :, :-1] ], axis=2)
+            misses = numpy.where(hits >= 0, hits - previous - 1, 0)
+
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                inAb = (1. / sumcors)[:, :, None]
+
+                steps = numpy.empty(hits.shape[:2] + (2*width + 1,))
+                steps[:, :, 0:-1:2] = notInA[:, None]*misses
+                steps[:, :, 1::2] = inAb*cors
+                steps[:, :, -1] = notInA*(ngenes - hits[:, :, -1] - 1)
+
+                csum = numpy.cumsum(steps, axis=2)
+
+                maxSum = numpy.maximum(0.0, csum[:, :, 1::2].max(axis=2))
+                minSum = numpy.minimum(0.0, csum[:, :, 0::2].min(axis=2))
+
+                es = numpy.where(numpy.abs(maxSum) > numpy.abs(minSum),
+                    maxSum, minSum)
+            es[sumcors == 0.0] = 0.0 #this should not happen
+            scores[rows, indices] = es
+
+    return scores
+
+def shuffledLocations(size, seed):
+    """
+    Return the shuffled locations that gsea.shuffleClass(data, seed) uses
+    for a data set with size examples. The same list also shuffles a list
+    as shuffleList(l, random.Random(seed)) does: l2[i] = l[locations[i]].
+    """
+    locations = list(range(size))
+    random.Random(seed).shuffle(locations)
+    return locations
+
+def signalToNoiseMatrix(Xa, Xb):
+    """
+    Signal to noise ratios (MA_signalToNoise) of groups of values Xa
+    and Xb. Values are on the last axis and ratios are computed for all
+    other indices at once.
+    """
+    def stdevm(X):
+        m = X.mean(axis=-1)
+        std = X.std(axis=-1, ddof=1)
+        #return minmally 0.2*|mi|, where mi=0 is adjusted to mi=1
+        m2 = 0.2*numpy.where(m == 0, 1.0, numpy.abs(m))
+        return m, numpy.where(m2 > std, m2, std)
+
+    ma, sa = stdevm(Xa)
+    mb, sb = stdevm(Xb)
+    return (ma - mb)/(sa + sb)
+
+class SignalToNoiseRankings(object):
+    """
+    Signal to noise rankings of attributes (as MA_signalToNoise) for
+    class permutations of gsea.shuffleClass. Rankings for all the
+    permutations are computed at once.
+
+    X: attributes x examples array of values.
+    mask: a boolean array of unknown values in X.
+    classes: class value indices of examples (-1 if unknown).
+    """
+
+    def __init__(self, X, mask, classes):
+        #the first and the second class value
+        self.a, self.b = 0, 1
+        self.classes = numpy.asarray(classes, dtype=int).ravel()
+        self.X = numpy.ascontiguousarray(X, dtype=float)
+        self.mask = numpy.ascontiguousarray(mask, dtype=bool)
+        self.special = numpy.flatnonzero(self.mask.any(axis=1))
+
+    def permutedClasses(self, seeds):
+        classes = numpy.empty((len(seeds), len(self.classes)), dtype=int)
+        for row, seed in zip(classes, seeds):
+            row[shuffledLocations(len(self.classes), seed)] = self.classes
+        return classes
+
+    def rankings(self, classes=None):
+        """
+        Rankings for rows of class values (default: the original classes).
+        """
+        if classes is None:
+            classes = self.classes[None, :]
+
+        ia = numpy.array([ numpy.flatnonzero(c == self.a) for c in classes ])
+        ib = numpy.array([ numpy.flatnonzero(c == self.b) for c in classes ])
+
+        #take() keeps the values of each group contiguous, so they
+        #are summed in the same order as with MA_signalToNoise
+        res = signalToNoiseMatrix(self.X.take(ia, axis=1),
+            self.X.take(ib, axis=1)).T
+
+        #attributes with unknown values
+        for i in self.special:
+            known = ~self.mask[i]
+            for r, c in enumerate(classes):
+                res[r, i] = signalToNoiseMatrix(
+                    self.X[i, (c == self.a) & known],
+                    self.X[i, (c == self.b) & known])
+        return res
+
+    def __call__(self, seeds):
+        return self.rankings(self.permutedClasses(seeds))
+
+class GenePermutationRankings(object):
+    """
+    Rankings shuffled as with gsea.shuffleList.
+    """
+
+    def __init__(self, rankings):
+        self.r = numpy.asarray(rankings, dtype=float)
+
+    def __call__(self, seeds):
+        return numpy.array([ self.r[shuffledLocations(len(self.r), seed)]
+            for seed in seeds ]).reshape(len(seeds), len(self.r))
+
+def _permutationNullsChunk(args):
+    permutationRankings, seeds, subsets, blocks = args
+    return enrichmentScoresMatrix(permutationRankings(seeds), subsets,
+        blocks=blocks)
+
+def permutationNulls(permutationRankings, seeds, subsets, callback=None,
+        chunk=50, workers=None):
+    """
+    Enrichment scores of subsets for permuted rankings, one row for
+    each seed. permutationRankings(seeds) returns rankings for a list
+    of permutation seeds.
+
+    Permutations are computed in chunks of chunk seeds. With workers,
+    the chunks are distributed to a pool of worker processes. Each
+    permutation is generated from its own seed, so the results do not
+    depend on the number of workers.
+    """
+    blocks = genesetBlocks(subsets)
+    chunks = [ seeds[start:start+chunk]
+        for start in range(0, len(seeds), chunk) ]
+    tasks = [ (permutationRankings, chunkseeds, subsets, blocks)
+        for chunkseeds in chunks ]
+
+    if workers and len(chunks) > 1:
+        try:
+            pickle.dumps(permutationRankings, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            warnings.warn("Permutation rankings can not be sent to worker "
+                "processes (a custom rankingf?). Permutations are computed "
+                "in a single process.", UserWarning)
+            workers = None
+
+    nulls = numpy.zeros((len(seeds), len(subsets)))
+
+    def merge(results):
+        start = 0
+        for chunkseeds, res in zip(chunks, results):
+            nulls[start:start+len(chunkseeds)] = res
+            start += len(chunkseeds)
+            for _ in chunkseeds:
+                runOptCallbacks(callback)
+
+    if workers and len(chunks) > 1:
+        from multiprocessing import Pool
+        from contextlib import closing
+        with closing(Pool(workers)) as pool:
+            merge(pool.imap(_permutationNullsChunk, tasks))
+    else:
+        merge(_permutationNullsChunk(task) for task in tasks)
+    return nulls
+
+def gseapval(es, esnull):
+    """
+    From article (PNAS):
+    estimate nominal p-value for S from esnull by using the positive
+    or negative portion of the distribution corresponding to the sign 
+    of the observed ES(S).
+    """
+    
+    try:
+        if es < 0:
+            return float(len([ a for a in esnull if a <= es ]))/ \
+                len([ a for a in esnull if a < 0])    
+        else: 
+            return float(len([ a for a in esnull if a >= es ]))/ \
+                len([ a for a in esnull if a >= 0])
+    except:
+        return 1.0
+
+def runOptCallbacks(callback):
+    if callback is not None:
+        try:
+            [ a() for a in callback ]
+        except:
+            callback()            
+
+def gseaR(rankings, subsets, n, callback=None, workers=None):
+    """
+    """
+    enrichmentScores = enrichmentScoresMatrix(rankings, subsets)[0].tolist()
+    
+    runOptCallbacks(callback)
+
+    seeds = [ 2000+i for i in range(n) ] #fixed permutations
+    nulls = permutationNulls(GenePermutationRankings(rankings), seeds,
+        subsets, callback=callback, workers=workers)
+
+    return gseaSignificance(enrichmentScores, nulls.T.tolist())
+
+def gseaSignificance(enrichmentScores, enrichmentNulls):
+
+    #print enrichmentScores
+
+    import time
+
+    tb1 = time.time()
+
+    enrichmentPVals = []
+    nEnrichmentScores = []
+    nEnrichmentNulls = []
+
+    for i in range(len(enrichmentScores)):
+        es = enrichmentScores[i]
+        enrNull = enrichmentNulls[i]
+        #print es, enrNull
+
+        enrichmentPVals.append(gseapval(es, enrNull))
+
+        #normalize the ES(S,pi) and the observed ES(S), separetely rescaling
+        #the positive and negative scores by divident by the mean of the 
+        #ES(S,pi)
+
+        #print es, enrNull
+
+        def normalize(s):
+            try:
+                if s == 0:
+                    return 0.0
+                if s >= 0:
+                    meanPos = mean([a for a in enrNull if a >= 0])
+                    #print s, meanPos
+                    return s/meanPos
+                else:
+                    meanNeg = mean([a for a in enrNull if a < 0])
+                    #print s, meanNeg
+                    return -s/meanNeg
+            except:
+                return 0.0 #return if according mean value is uncalculable
+
+
+        nes = normalize(es)
+        nEnrichmentScores.append(nes)
+        
+        nenrNull = [ normalize(s) for s in enrNull ]
+        nEnrichmentNulls.append(nenrNull)
+ 
+
+    #print "First part", time.time() - tb1
+
+    #FDR computation
+    #create a histogram of all NES(S,pi) over all S and pi
+    vals = reduce(lambda x,y: x+y, nEnrichmentNulls, [])
+
+
+    def shorten(l, p=10000):
+        """
+        Take each len(l)/p element, if len(l)/p >= 2.
+        """
+        e = len(l)//p
+        if e <= 1:
+            return l
+        else:
+            return [ l[i] for i in range(0, len(l), e) ]
+
+    #vals = shorten(vals) -> this can speed up second part. is it relevant TODO?
+
+    """
+    Use this null distribution to compute an FDR q value, for a given NES(S) =
+    NES* >= 0. The FDR is the ratio of the percantage of all (S,pi) with
+    NES(S,pi) >= 0, whose NES(S,pi) >= NES*, divided by the percentage of
+    observed S wih NES(S) >= 0, whose NES(S) >= NES*, and similarly if NES(S)
+    = NES* <= 0.
+    """
+
+    nvals = numpy.array(sorted(vals))
+    nnes = numpy.array(sorted(nEnrichmentScores))
+
+    #print "LEN VALS", len(vals), len(nEnrichmentScores)
+
+    fdrs = []
+
+    import operator
+
+    for i in range(len(enrichmentScores)):
+
+        nes = nEnrichmentScores[i]
+
+        """
+        #Strighfoward but slow implementation follows in comments.
+        #Useful as code description.
+        
+        if nes >= 0:
+            op0 = operator.ge
+            opn = operator.ge
+        else:
+            op0 = operator.lt
+            opn = operator.le
+
+        allPos = [a for a in vals if op0(a,0)]
+        allHigherAndPos = [a for a in allPos if opn(a,nes) ]
+
+        nesPos = [a for a in nEnrichmentScores if op0(a,0) ]
+        nesHigherAndPos = [a for a in nesPos if opn(a,nes) ]
+
+        top = len(allHigherAndPos)/float(len(allPos)) #p value
+        down = len(nesHigherAndPos)/float(len(nesPos))
+        
+        l1 = [ len(allPos), len(allHigherAndPos), len(nesPos), len(nesHigherAndPos)]
+
+        allPos = allHigherAndPos = nesPos =  nesHigherAndPos = 1
+
+        """
+
+        #this could be speed up twice with the same accuracy! 
+        if nes >= 0:
+            allPos = int(len(vals) - numpy.searchsorted(nvals, 0, side="left"))
+            allHigherAndPos = int(len(vals) - numpy.searchsorted(nvals, nes, side="left"))
+            nesPos = len(nnes) - int(numpy.searchsorted(nnes, 0, side="left"))
+            nesHigherAndPos = len(nnes) - int(numpy.searchsorted(nnes, nes, side="left"))
+        else:
+            allPos = int(numpy.searchsorted(nvals, 0, side="left"))
+            allHigherAndPos = int(numpy.searchsorted(nvals, nes, side="right"))
+            nesPos = int(numpy.searchsorted(nnes, 0, side="left"))
+            nesHigherAndPos = int(numpy.searchsorted(nnes, nes, side="right"))
+           
+        """
+        #Comparing results
+        l2 = [ allPos, allHigherAndPos, nesPos, nesHigherAndPos ]
+        diffs = [ l1[i]-l2[i] for i in range(len(l1)) ]
+        sumd = sum( [ abs(a) for a in diffs ] )
+        if sumd > 0:
+            print nes > 0
+            print "orig", l1
+            print "modi", l2
+        """
+
+        try:
+            top = allHigherAndPos/float(allPos) #p value
+            down = nesHigherAndPos/float(nesPos)
+
+            fdrs.append(top/down)
+        except:
+            fdrs.append(1000000000.0)
+    
+    #print "Whole part", time.time() - tb1
+
+    return list(zip(enrichmentScores, nEnrichmentScores, enrichmentPVals,
+        fdrs))
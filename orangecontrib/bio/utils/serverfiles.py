@@ -132,13 +132,13 @@ except ImportError:
 
 import time, threading
 import os
+import re
 import shutil
 import tarfile
-import gzip
+import zlib
 import bz2
 import glob
 import datetime
-import tempfile
 
 import six
 
@@ -195,6 +195,141 @@ def _create_path(target):
     except OSError:
         pass
 
+# Number of connections kept alive per host
+pool_size = 10
+
+# Commands that change the repository
+_modifying_commands = set(["upload", "createdomain", "removedomain",
+                           "remove", "protect"])
+
+def _copy_info(info):
+    info = dict(info)
+    info["tags"] = list(info["tags"])
+    return info
+
+def _replace(source, target):
+    """Rename file `source` to `target`, replacing `target` if it exists."""
+    if sys.platform == "win32" and os.path.exists(target):
+        os.remove(target)
+    os.rename(source, target)
+
+def _content_range(response):
+    """Return the position of the first byte of a (partial) download
+    response and the size of the whole file."""
+    if response.status == 206:
+        # Content-Range: bytes first-last/size
+        first, size = re.match(r"bytes\s+(\d+)-\d+/(\d+)",
+                               response.headers["content-range"]).groups()
+        return int(first), int(size)
+    elif response.status == 200:
+        return 0, int(response.headers["content-length"])
+    else:
+        raise IOError("Server responded with status %i" % response.status)
+
+def _read_part_version(part):
+    """Return the (file version, ETag) stored for a partial download."""
+    try:
+        with open(part + ".version") as f:
+            version, etag = (f.read().split("\n") + [""])[:2]
+    except (IOError, OSError):
+        return None, None
+    return version, etag or None
+
+def _save_part_version(part, version, etag):
+    with open(part + ".version", "w") as f:
+        f.write("%s\n%s" % (version, etag or ""))
+
+def _remove_part(part):
+    for fname in [part, part + ".version"]:
+        if os.path.exists(fname):
+            os.remove(fname)
+
+def _retry_errors():
+    """Errors after which an interrupted transfer is resumed."""
+    from requests.packages.urllib3.exceptions import HTTPError
+    return (EnvironmentError, socket.error, HTTPError)
+
+class _Progress(object):
+    """Call callback once for each percent of size bytes received
+    (the last call is left to the caller)."""
+    def __init__(self, callback, size):
+        self.callback = callback
+        self.size = size
+        self.reported = 0
+
+    def __call__(self, received):
+        if self.callback and self.size > 0:
+            percent = min(100 * received // self.size, 99)
+            while self.reported < percent:
+                self.reported += 1
+                self.callback()
+
+class _Decompressor(object):
+    """Decompress gz or bz2 data written in chunks to a file object.
+    Concatenated compressed streams are supported."""
+    def __init__(self, compression, fileobj):
+        self.compression = compression
+        self.fileobj = fileobj
+        self.decompressor = self._decompressor()
+
+    def _decompressor(self):
+        if self.compression == "gz":
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.compression == "bz2":
+            return bz2.BZ2Decompressor()
+        else:
+            raise ValueError("Unknown compression: %r" % self.compression)
+
+    def write(self, data):
+        while data:
+            try:
+                self.fileobj.write(self.decompressor.decompress(data))
+            except EOFError:
+                # bz2 stream ended at a chunk boundary, a new one follows
+                self.decompressor = self._decompressor()
+                continue
+            data = self.decompressor.unused_data
+            if data:
+                self.decompressor = self._decompressor()
+
+    def flush(self):
+        if hasattr(self.decompressor, "flush"):
+            self.fileobj.write(self.decompressor.flush())
+
+class _ChunkReader(object):
+    """A read only file-like object over an iterator of byte chunks."""
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b""
+
+    def read(self, size=-1):
+        parts = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            parts.append(chunk)
+            length += len(chunk)
+        data = b"".join(parts)
+        if size < 0:
+            size = len(data)
+        self.buffer = data[size:]
+        return data[:size]
+
+def _extract_tar(chunks, directory):
+    """Extract a (compressed) tar archive from chunks of bytes while they
+    are being received."""
+    reader = _ChunkReader(chunks)
+    tar = tarfile.open(fileobj=reader, mode="r|*")
+    try:
+        tar.extractall(directory)
+    finally:
+        tar.close()
+    # read any padding after the archive
+    while reader.read(2**16):
+        pass
+
 def localpath(domain=None, filename=None):
     """Return a path for the domain in the local repository. If 
     filename is given, return a path to corresponding file."""
@@ -216,8 +351,18 @@ class ServerFiles(object):
     Repository files are set as protected when first uploaded: only
     authenticated users can see them. They need to be unprotected for
     public use.
+
+    Requests to the server reuse (keep alive) connections. Information
+    on repository files (:obj:`info`, :obj:`listfiles`, :obj:`allinfo`,
+    :obj:`listdomains` and :obj:`search`) is served from an index of the
+    whole repository, which is transferred once and then revalidated
+    with conditional (ETag) requests when older than `index_max_age`
+    seconds.
     """
 
+    #: Seconds for which the repository index is used without revalidation.
+    index_max_age = 60
+
     def __init__(self, username=None, password=None, server=None, access_code=None):
         """
         Creates a ServerFiles instance. Pass your username and password
@@ -232,7 +377,12 @@ class ServerFiles(object):
         self.username = username
         self.password = password
         self.access_code = access_code
-        self.searchinfo = None
+        self._lock = threading.Lock()
+        self._session = None
+        self._index_lock = threading.Lock()
+        self._index = None
+        self._index_time = None
+        self._responses = {}
 
     def upload(self, domain, filename, file, title="", tags=[]):
         """ Uploads a file "file" to the domain where it is saved with filename
@@ -280,56 +430,129 @@ class ServerFiles(object):
     
     def listfiles(self, domain):
         """List all files in a repository domain."""
-        return _parseList(self._open('list', { 'domain': domain }))
+        return list(self.repository_index().get(domain, {}))
 
-    def listdomains(self):
-        """List all domains on repository."""
-        return _parseList(self._open('listdomains', {}))
-
-    def download(self, domain, filename, target, callback=None):
+    def download(self, domain, filename, target, callback=None,
+                 compression=None):
         """
         Downloads file from the repository to a given target name. Callback
         can be a function without arguments. It will be called once for each
         downloaded percent of file: 100 times for the whole file.
+
+        If compression ("gz" or "bz2") is given, the file is decompressed
+        while it downloads. The received data is kept in a "<target>.part"
+        file until the transfer completes, so that an interrupted download
+        continues where it stopped (see :obj:`download_iter`).
         """
         _create_path_for_file(target)
-
-        fdown = self.downloadFH(domain, filename)
-        size = int(fdown.getheader('content-length'))
-
-        f = tempfile.TemporaryFile()
- 
-        chunksize = 1024*8
-        lastchunkreport= 0.0001
-
-        readb = 0
-        # in case size == 0 skip the loop
-        while size > 0:
-            buf = fdown.read(chunksize)
-            readb += len(buf)
-
-            while float(readb) / size > lastchunkreport+0.01:
-                #print float(readb)/size, lastchunkreport + 0.01, float(readb)/size - lastchunkreport 
-                lastchunkreport += 0.01
-                if callback:
-                    callback()
-            if not buf:
-                break
-            f.write(buf)
-
-        fdown.close()
-        f.seek(0)
-
-        shutil.copyfileobj(f, open(target, "wb"))
+        part = target + ".part"
+        chunks = self.download_iter(domain, filename, part, callback=callback)
+
+        if compression in ["gz", "bz2"]:
+            with open(target + ".tmp", "wb") as f:
+                decompressor = _Decompressor(compression, f)
+                for chunk in chunks:
+                    decompressor.write(chunk)
+                decompressor.flush()
+            _replace(target + ".tmp", target)
+            os.remove(part)
+        else:
+            for _ in chunks:
+                pass
+            _replace(part, target)
 
         if callback:
             callback()
 
+    def download_iter(self, domain, filename, part, callback=None,
+                      retries=3, chunksize=2**16):
+        """
+        Iterate over the contents of a repository file in chunks of bytes.
+        All received data is also stored to the file `part`. If `part`
+        already exists (an earlier transfer was interrupted) only the
+        rest of the file is requested with an HTTP Range request, and the
+        stored part is iterated over first. Transfers that fail midway are
+        resumed in the same way up to `retries` times. When the iteration
+        finishes `part` contains the whole file.
+
+        The version of the file (its datetime and size in the repository)
+        and the server's ETag are stored in "<part>.version". A part of a
+        different version is discarded, and a resumed request carries an
+        If-Range header with the ETag. A server that ignores the Range
+        header (it is sent with the POST download command) answers with
+        the whole file, which is then stored from the start.
+
+        Callback is called as in :obj:`download`, but without the final call.
+        """
+        _create_path_for_file(part)
+        progress = None
+        received = 0  # bytes already passed on to the caller
+        failures = 0
+
+        info = self.info(domain, filename)
+        version = "%s %s" % (info.get("datetime"), info.get("size"))
+        stored_version, etag = _read_part_version(part)
+        if os.path.exists(part) and stored_version != version:
+            # a part of a different version of the file
+            _remove_part(part)
+
+        while True:
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            try:
+                fdown = self.downloadFH(domain, filename, offset=offset,
+                                        if_range=etag if offset else None)
+                try:
+                    if fdown.status == 416:
+                        # the stored part does not match the file
+                        _remove_part(part)
+                        continue
+                    start, size = _content_range(fdown)
+                    if progress is None:
+                        progress = _Progress(callback, size)
+                    if not start:
+                        new_etag = fdown.headers.get("etag")
+                        if received and etag and new_etag != etag:
+                            # already passed on data of the older file
+                            _remove_part(part)
+                            raise ValueError("%s/%s changed during the "
+                                             "download" % (domain, filename))
+                        etag = new_etag
+                        _save_part_version(part, version, etag)
+
+                    with open(part, "ab" if start else "wb") as f:
+                        if received < start:
+                            with open(part, "rb") as stored:
+                                stored.seek(received)
+                                for chunk in iter(lambda: stored.read(chunksize), b""):
+                                    received += len(chunk)
+                                    progress(received)
+                                    yield chunk
+
+                        position = start
+                        while position < size:
+                            chunk = fdown.read(chunksize)
+                            if not chunk:
+                                raise IOError("Incomplete download of %s/%s"
+                                              % (domain, filename))
+                            f.write(chunk)
+                            position += len(chunk)
+                            if position > received:
+                                chunk = chunk[len(chunk) - (position - received):]
+                                received = position
+                                progress(received)
+                                yield chunk
+                finally:
+                    fdown.close()
+                os.remove(part + ".version")
+                return
+            except _retry_errors():
+                failures += 1
+                if failures > retries:
+                    raise
+
     def _searchinfo(self):
-        domains = self.listdomains()
         infos = {}
-        for dom in domains:
-            dominfo = self.allinfo(dom)
+        for dom, dominfo in self.repository_index().items():
             for a,b in dominfo.items():
                 infos[(dom, a)] = b
         return infos
@@ -339,35 +562,76 @@ class ServerFiles(object):
         Search for files on the repository where all substrings in a list
         are contained in at least one choosen field (tag, title, name). Return
         a list of tuples: first tuple element is the file's domain, second its
-        name. As for now the search is performed locally, therefore
-        information on files in repository is transfered on first call of
-        this function. 
+        name. As for now the search is performed locally on the
+        repository index.
         """
-        if not self.searchinfo:
-            self.searchinfo = self._searchinfo()
-        return _search(self.searchinfo, sstrings, **kwargs)
+        return _search(self._searchinfo(), sstrings, **kwargs)
 
     def info(self, domain, filename):
         """Return a dictionary containing repository file info. 
         Keys: title, tags, size, datetime."""
+        dominfo = self.repository_index().get(domain, {})
+        if filename in dominfo:
+            return _copy_info(dominfo[filename])
+        # not (yet) in the index
         return _parseFileInfo(self._open('info', { 'domain': domain, 'filename': filename }))
 
-    def downloadFH(self, domain, filename):
-        """Return a file handle to the file that we would like to download."""
-        return self._handle('download', { 'domain': domain, 'filename': filename }, raw=True)
+    def downloadFH(self, domain, filename, offset=0, if_range=None):
+        """Return a file handle to the file that we would like to download.
+        If offset is given, only the file contents from that byte on are
+        requested (the whole file if it no longer matches the `if_range`
+        ETag)."""
+        headers = None
+        if offset:
+            headers = {"Range": "bytes=%i-" % offset}
+            if if_range:
+                headers["If-Range"] = if_range
+        return self._handle('download', { 'domain': domain, 'filename': filename },
+                            raw=True, headers=headers)
 
     def list(self, domain):
         return _parseList(self._open('list', { 'domain': domain }))
 
     def listdomains(self):
         """List all domains on repository."""
-        return _parseList(self._open('listdomains', {}))
+        return list(self.repository_index())
 
     def allinfo(self, domain):
         """Go through all accessible files in a given domain and return a
         dictionary, where key is file's name and value its info.
         """
-        return _parseAllFileInfo(self._open('allinfo', { 'domain': domain }))
+        return dict((filename, _copy_info(info)) for filename, info in
+                    self.repository_index().get(domain, {}).items())
+
+    def repository_index(self):
+        """
+        Return a dictionary of all accessible domains, which maps domain
+        names to dictionaries of infos of their files (as in
+        :obj:`allinfo`). The returned index is shared and should not be
+        modified.
+
+        The index is rebuilt when older than `index_max_age` seconds. As
+        the server has no single index request, it is composed from a
+        listing of domains and file infos of each domain; their earlier
+        responses are revalidated with their ETags, so that only the
+        changed parts are transferred again.
+        """
+        with self._index_lock:
+            if self._index is None or \
+                    time.time() - self._index_time > self.index_max_age:
+                index = {}
+                for dom in self._open_cached('listdomains', {}, _parseList):
+                    if dom:
+                        index[dom] = self._open_cached(
+                            'allinfo', { 'domain': dom }, _parseAllFileInfo)
+                self._index = index
+                self._index_time = time.time()
+            return self._index
+
+    def invalidate_index(self):
+        """Rebuild the repository index on its next use."""
+        with self._index_lock:
+            self._index = None
 
     def index(self):
         return self._open('index', {})
@@ -381,12 +645,22 @@ class ServerFiles(object):
         else:
             return False
 
-    def _server_request(self, root, command, data, files, repeat=2, raw=False):
-        import requests
-        req = requests.Session()
-        a = requests.adapters.HTTPAdapter(max_retries=repeat)
-        req.mount('https://', a)
-        req.mount('http://', a)
+    def _requests_session(self, repeat=2):
+        """Return a requests session, which keeps connections alive and
+        pools them (up to `pool_size` per host) between requests."""
+        with self._lock:
+            if self._session is None:
+                import requests
+                req = requests.Session()
+                a = requests.adapters.HTTPAdapter(max_retries=repeat,
+                                                  pool_maxsize=pool_size)
+                req.mount('https://', a)
+                req.mount('http://', a)
+                self._session = req
+            return self._session
+
+    def _request(self, root, command, data, files, repeat=2, headers=None):
+        req = self._requests_session(repeat)
 
         auth = None
         if self._authen():
@@ -394,24 +668,52 @@ class ServerFiles(object):
 
         try:
             if data:
-                ans = req.post(root+command, data=data, files=files, auth=auth, verify=False, timeout=timeout, stream=True)
+                ans = req.post(root+command, data=data, files=files, auth=auth, verify=False, timeout=timeout, stream=True, headers=headers)
             else:
-                ans = req.get(root+command, auth=auth, verify=False, timeout=timeout, stream=True)
+                ans = req.get(root+command, auth=auth, verify=False, timeout=timeout, stream=True, headers=headers)
         except:
             raise ConnectionError
 
+        return ans
+
+    def _server_request(self, root, command, data, files, repeat=2, raw=False,
+                        headers=None):
+        ans = self._request(root, command, data, files, repeat=repeat,
+                            headers=headers)
         return str(ans.text) if not raw else ans.raw
-    
-    def _handle(self, command, data, files=None, raw=False):
-        data2 = self._addAccessCode(data)
-        addr = self.publicroot
+
+    def _root(self):
         if self._authen():
-            addr = self.secureroot
-        return self._server_request(addr, command, data, files, raw=raw)
+            return self.secureroot
+        return self.publicroot
+
+    def _handle(self, command, data, files=None, raw=False, headers=None):
+        data2 = self._addAccessCode(data)
+        if command in _modifying_commands:
+            self.invalidate_index()
+        return self._server_request(self._root(), command, data, files, raw=raw,
+                                    headers=headers)
 
     def _open(self, command, data, files=None):
         return self._handle(command, data, files)
 
+    def _open_cached(self, command, data, parse):
+        """Return the parsed response to a command. The parsed response is
+        cached and reused while the server responds with the same ETag."""
+        key = (command,) + tuple(sorted(data.items()))
+        etag, parsed = self._responses.get(key, (None, None))
+        headers = {"If-None-Match": etag} if etag else None
+        ans = self._request(self._root(), command, data, None,
+                            headers=headers)
+        text = str(ans.text)  # also releases the connection
+        if ans.status_code == 304 and etag:
+            return parsed
+        parsed = parse(text)
+        etag = ans.headers.get("ETag")
+        if etag:
+            self._responses[key] = (etag, parsed)
+        return parsed
+
     def _addAccessCode(self, data):
         if self.access_code != None:
             data = data.copy()
@@ -497,6 +799,19 @@ def _locked(f):
     return func
 
 
+_shared = None
+_shared_lock = threading.Lock()
+
+def _shared_serverfiles():
+    """Return a ServerFiles instance for anonymous access to the default
+    server, shared so that its connections and index are reused."""
+    global _shared
+    with _shared_lock:
+        if _shared is None or _shared.server != defserver:
+            _shared = ServerFiles()
+        return _shared
+
+
 @_locked
 def download(domain, filename, serverfiles=None, callback=None,
              extract=True, verbose=True):
@@ -504,10 +819,15 @@ def download(domain, filename, serverfiles=None, callback=None,
     To download files as an authenticated user you should also pass an
     instance of ServerFiles class. Callback can be a function without
     arguments. It will be called once for each downloaded percent of
-    file: 100 times for the whole file."""
+    file: 100 times for the whole file.
+
+    Compressed files are decompressed (and archives extracted) while they
+    download. The data received by an interrupted download is kept and
+    the next download of the same file only transfers the rest.
+    """
 
     if not serverfiles:
-        serverfiles = ServerFiles()
+        serverfiles = _shared_serverfiles()
 
     info = serverfiles.info(domain, filename)
     specialtags = dict([tag.split(":") for tag in info["tags"] if tag.startswith("#") and ":" in tag])
@@ -515,33 +835,29 @@ def download(domain, filename, serverfiles=None, callback=None,
     target = localpath(domain, filename)
     if ConsoleProgressBar:
         callback = DownloadProgress(filename, int(info["size"])) if verbose and not callback else callback    
-    serverfiles.download(domain, filename, target + ".tmp" if extract else target, callback=callback)
-    
+    compression = specialtags.get("#compression") if extract else None
+
+    # Archives are extracted and other files decompressed as they download
+    if compression in ["tar.gz", "tar.bz2"] and specialtags.get("#files"):
+        chunks = serverfiles.download_iter(domain, filename, target + ".part", callback=callback)
+        _extract_tar(chunks, localpath(domain))
+        _replace(target + ".part", target)
+        if callback:
+            callback()
+    elif extract and filename.endswith(".tar.gz"):
+        _create_path(target)
+        chunks = serverfiles.download_iter(domain, filename, target + ".part", callback=callback)
+        _extract_tar(chunks, target)
+        os.remove(target + ".part")
+        if callback:
+            callback()
+    else:
+        serverfiles.download(domain, filename, target, callback=callback,
+                             compression=compression)
+
     #file saved, now save info file
 
     _save_file_info(target + '.info', info)
-    
-    if extract:
-        if specialtags.get("#compression") in ["tar.gz", "tar.bz2"] and \
-                specialtags.get("#files"):
-            f = tarfile.open(target + ".tmp")
-            f.extractall(localpath(domain))
-            shutil.copyfile(target + ".tmp", target)
-        elif filename.endswith(".tar.gz"):
-            f = tarfile.open(target + ".tmp")
-            try:
-                os.mkdir(target)
-            except Exception:
-                pass
-            f.extractall(target)
-        elif specialtags.get("#compression") == "gz":
-            f = gzip.open(target + ".tmp")
-            shutil.copyfileobj(f, open(target, "wb"))
-        elif specialtags.get("#compression") == "bz2":
-            f = bz2.BZ2File(target + ".tmp", "r")
-            shutil.copyfileobj(f, open(target, "wb"))
-        f.close()
-        os.remove(target + ".tmp")
 
     if ConsoleProgressBar and type(callback) == DownloadProgress:
         callback.finish()
@@ -640,12 +956,16 @@ def allinfo(domain):
 def needs_update(domain, filename, serverfiles=None):
     """True if a file does not exist in the local repository
     or if there is a newer version on the server."""
-    if serverfiles == None: serverfiles = ServerFiles()
-    if filename not in listfiles(domain):
+    if serverfiles == None: serverfiles = _shared_serverfiles()
+    try:
+        if not os.path.exists(localpath(domain, filename)):
+            return True
+        local_info = info(domain, filename)
+    except Exception:
         return True
     dt_fmt = "%Y-%m-%d %H:%M:%S"
     dt_local = datetime.datetime.strptime(
-        info(domain, filename)["datetime"][:19], dt_fmt)
+        local_info["datetime"][:19], dt_fmt)
     dt_server = datetime.datetime.strptime(
         serverfiles.info(domain, filename)["datetime"][:19], dt_fmt)
     return dt_server > dt_local
@@ -656,7 +976,7 @@ def update(domain, filename, serverfiles=None, **kwargs):
     or the local copy does not exist. An optional  :class:`ServerFiles` object
     can be passed for authenticated access.
     """
-    if serverfiles == None: serverfiles = ServerFiles()
+    if serverfiles == None: serverfiles = _shared_serverfiles()
     if needs_update(domain, filename, serverfiles=serverfiles):
         download(domain, filename, serverfiles=serverfiles, **kwargs)
         
@@ -857,33 +1177,62 @@ def consoleupdate(domains=None, searchstr="essential"):
         except Exception as ex:
             print("Error occured:", ex)
 
-def update_local_files(verbose=True):
-    sf = ServerFiles()
-    for domain, filename in search(""):
+def _update_files(files, needs_update, serverfiles, verbose, workers):
+    """Download files (a list of (domain, filename) pairs) for which
+    needs_update(domain, filename) is true with a pool of worker threads.
+    """
+    def update(args):
+        domain, filename = args
+        uptodate = not needs_update(domain, filename)
+        if not uptodate:
+            # Progress bars of concurrent downloads would mix
+            download(domain, filename, serverfiles,
+                     verbose=verbose and workers == 1)
+        return filename, uptodate
+
+    from multiprocessing.pool import ThreadPool
+    from contextlib import closing
+    with closing(ThreadPool(max(1, min(workers, len(files) or 1)))) as pool:
+        for filename, uptodate in pool.imap_unordered(update, files):
+            if verbose:
+                print(filename, "Ok" if uptodate else "Updated")
+
+def update_local_files(verbose=True, workers=4, serverfiles=None):
+    """Update all files in the local repository that have a newer
+    version on the server. Up to `workers` files are downloaded
+    at the same time."""
+    sf = serverfiles or _shared_serverfiles()
+    sf.invalidate_index()
+
+    def needs_update(domain, filename):
         try:
             dateserver = sf.info(domain, filename)["datetime"]
-        except:
-            dateserver = None
-        uptodate = dateserver <= info(domain, filename)["datetime"]
-        if dateserver and not uptodate:
-            download(domain, filename, sf)
-        if verbose:
-            print(filename, "Ok" if uptodate else "Updated")
-
-def update_by_tags(tags=["essential"], domains=[], verbose=True):
-    sf = ServerFiles()
-    for domain, filename in sf.search(tags + domains, inTitle=False, inName=False):
-        if domains and domain not in domain:
-            continue
+        except Exception:
+            return False
+        return dateserver > info(domain, filename)["datetime"]
+
+    _update_files(search(""), needs_update, sf, verbose, workers)
+
+def update_by_tags(tags=["essential"], domains=[], verbose=True, workers=4,
+                   serverfiles=None):
+    """Download the server files with the given tags (from the given
+    domains only, if specified) that are missing from the local
+    repository or have a newer version on the server. Up to `workers`
+    files are downloaded at the same time."""
+    sf = serverfiles or _shared_serverfiles()
+    sf.invalidate_index()
+
+    def needs_update(domain, filename):
         if os.path.exists(localpath(domain, filename)+".info"):
-            uptodate = sf.info(domain, filename)["datetime"] <= info(domain, filename)["datetime"]
+            return sf.info(domain, filename)["datetime"] > info(domain, filename)["datetime"]
         else:
-            uptodate = False
-        if not uptodate:
-            download(domain, filename, sf)
-        if verbose:
-            print(filename, "Ok" if uptodate else "Updated")
-            
+            return True
+
+    files = [(domain, filename)
+             for domain, filename in sf.search(tags + domains, inTitle=False, inName=False)
+             if not domains or domain in domains]
+    _update_files(files, needs_update, sf, verbose, workers)
+
 def _example(myusername, mypassword):
 
     locallist = listfiles('test')
@@ -2,6 +2,8 @@ import math
 import threading
 import six
 
+import numpy
+
 
 def _lngamma(z):
     x = 0
@@ -16,14 +18,36 @@ def _lngamma(z):
     x += 0.9999999999995183
     
     return math.log(x) - 5.58106146679532777 - z + (z - 0.5) * math.log(z + 6.5)
-        
+
+
+def _lngamma_array(z):
+    """ A vectorized :func:`_lngamma`. """
+    z = numpy.asarray(z, dtype=float)
+    x = 0
+    x += 0.1659470187408462e-06 / (z + 7)
+    x += 0.9934937113930748e-05 / (z + 6)
+    x -= 0.1385710331296526 / (z + 5)
+    x += 12.50734324009056 / (z + 4)
+    x -= 176.6150291498386 / (z + 3)
+    x += 771.3234287757674 / (z + 2)
+    x -= 1259.139216722289 / (z + 1)
+    x += 676.5203681218835 / (z)
+    x += 0.9999999999995183
+
+    return numpy.log(x) - 5.58106146679532777 - z + (z - 0.5) * numpy.log(z + 6.5)
+
 
 class LogBin(object):
     _max = 2
     _lookup = [0.0, 0.0]
+    _lookup_array = numpy.array(_lookup)
     _max_factorial = 1
     _lock = threading.Lock()
 
+    #: Maximum number of distribution values evaluated at once by the
+    #: vectorized `p_values` (limits the memory use).
+    _chunk_size = 2 ** 20
+
     def __init__(self, max=1000):
         self._extend(max)
 
@@ -32,12 +56,14 @@ class LogBin(object):
         with LogBin._lock:
             if max <= LogBin._max:
                 return
-            for i in range(LogBin._max, max):
-                if i > 1000: ## an arbitrary cuttof
-                    LogBin._lookup.append(LogBin._logfactorial(i))
-                else:
-                    LogBin._max_factorial *= i
-                    LogBin._lookup.append(math.log(LogBin._max_factorial))
+            for i in range(LogBin._max, min(max, 1001)):
+                LogBin._max_factorial *= i
+                LogBin._lookup.append(math.log(LogBin._max_factorial))
+            if max > 1001:
+                ## above an arbitrary cutoff use the gamma function
+                start = LogBin._max if LogBin._max > 1001 else 1001
+                i = numpy.arange(start, max)
+                LogBin._lookup.extend(_lngamma_array(i + 1.0).tolist())
             LogBin._max = max
 
     def _logbin(self, n, k):
@@ -48,6 +74,86 @@ class LogBin(object):
         else:
             return 0.0
 
+    @staticmethod
+    def _lookup_table(size):
+        """ Return the log factorial lookup table (as an array) with at
+        least `size` entries. """
+        if size > LogBin._max:
+            LogBin._extend(max(size, 2 * LogBin._max))
+        with LogBin._lock:
+            if len(LogBin._lookup_array) != LogBin._max:
+                LogBin._lookup_array = numpy.array(LogBin._lookup[:LogBin._max])
+            return LogBin._lookup_array
+
+    @staticmethod
+    def _logbin_array(table, n, k):
+        """ A vectorized :func:`_logbin` using the lookup `table`. """
+        valid = (k < n) & (k >= 0)
+        n, k = numpy.where(valid, n, 0), numpy.where(valid, k, 0)
+        return table[n] - table[n - k] - table[k]
+
+    def _tail_sums(self, table, start, stop, *args):
+        """ Return the sums of `self._pmf(table, i, *args)` for `i` in
+        `range(start, stop)` for all elements of the `start`, `stop` and
+        `args` arrays. The values are summed in order, as in the scalar
+        `p_value` methods. """
+        lengths = numpy.maximum(stop - start, 0)
+        result = numpy.zeros(len(lengths))
+        ends = numpy.cumsum(lengths)
+        lo = 0
+        while lo < len(lengths):
+            # Split the elements into chunks with at most _chunk_size values
+            # (but at least one element).
+            base = ends[lo] - lengths[lo]
+            hi = max(lo + 1, int(numpy.searchsorted(
+                ends, base + self._chunk_size, side="right")))
+            counts = lengths[lo:hi]
+            owner = numpy.repeat(numpy.arange(hi - lo), counts)
+            i = start[lo:hi][owner] + \
+                (numpy.arange(base, base + len(owner)) -
+                 (ends[lo:hi] - counts)[owner])
+            values = self._pmf(table, i, *[a[lo:hi][owner] for a in args])
+            result[lo:hi] = numpy.bincount(owner, weights=values,
+                                           minlength=hi - lo)
+            lo = hi
+        return result
+
+    def _p_values(self, table, k, N, m, n, top):
+        """ The vectorized `p_value` with `top` the largest possible
+        number of positive tests. """
+        result = numpy.zeros(len(k))
+        upper = top - k + 1 <= k
+        lower = ~upper
+        result[upper] = self._tail_sums(
+            table, k[upper], top[upper] + 1, N[upper], m[upper], n[upper])
+        zeros = numpy.zeros_like(k[lower])
+        value = 1.0 - self._tail_sums(table, zeros, k[lower], N[lower], m[lower],
+                                      n[lower])
+        #if the value is small it is probably inexact due to the limited
+        #precision of floats; if so, compute the result without substraction
+        inexact = value < 1e-3
+        lower[lower] = inexact
+        value[inexact] = self._tail_sums(
+            table, k[lower], top[lower] + 1, N[lower], m[lower], n[lower])
+        result[~upper] = value
+        return result
+
+    def p_values(self, k, N, m, n):
+        """ A vectorized `p_value`. The arguments can be arrays (or
+        scalars) which are broadcast against each other. Return an array
+        of p-values.
+
+        """
+        k, N, m, n = numpy.broadcast_arrays(
+            *[numpy.asarray(a, dtype=numpy.int64) for a in (k, N, m, n)])
+        shape = k.shape
+        k, N, m, n = [a.ravel() for a in (k, N, m, n)]
+        if not len(k):
+            return numpy.zeros(shape)
+        table = self._lookup_table(int(max(N.max(), m.max(), n.max())) + 2)
+        return self._p_values(table, k, N, m, n,
+                              self._top(N, m, n)).reshape(shape)
+
     @staticmethod
     def _logfactorial(n):
         if (n <= 1):
@@ -86,6 +192,20 @@ class Binomial(LogBin):
             raise
 ##        return math.exp(self._logbin(n, k) + math.log((p**k) * (1.0 - p)**(n - k)))
 
+    def _pmf(self, table, k, N, m, n):
+        """ A vectorized `__call__`. """
+        p = 1.0 * m / N
+        with numpy.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            value = numpy.exp(self._logbin_array(table, n, k) +
+                              k * numpy.log(p) + (n - k) * numpy.log(1.0 - p))
+        value = numpy.minimum(value, 1.0)
+        value = numpy.where(p == 0.0, k == 0, value)
+        return numpy.where(p == 1.0, n == k, value)
+
+    @staticmethod
+    def _top(N, m, n):
+        return n
+
     def p_value(self, k, N, m, n):
         """ The probability that k or more tests are positive. """
         if n - k + 1 <= k:
@@ -125,6 +245,21 @@ class Hypergeometric(LogBin):
             print(k, N, m, n)
             raise
 
+    def _pmf(self, table, k, N, m, n):
+        """ A vectorized `__call__`. """
+        logbin = self._logbin_array
+        with numpy.errstate(over="ignore"):
+            value = numpy.exp(logbin(table, m, k) +
+                              logbin(table, N - m, n - k) -
+                              logbin(table, N, n))
+        value = numpy.minimum(value, 1.0)
+        outside = (k < numpy.maximum(0, n + m - N)) | (k > numpy.minimum(n, m))
+        return numpy.where(outside, 0.0, value)
+
+    @staticmethod
+    def _top(N, m, n):
+        return numpy.minimum(n, m)
+
     def p_value(self, k, N, m, n):
         """ 
         The probability that k or more tests are positive.
@@ -152,60 +287,71 @@ for m in range(2, 100000):
 def is_sorted(l):
     return all(l[i] <= l[i+1] for i in range(len(l)-1))
 
+def _harmonic(m):
+    """ Return sum([1.0/i for i in range(1, m+1)]). """
+    return c[m-1] if m <= len(c) else math.log(m) + 0.57721566490153286060651209008240243104215933593992
+
 def FDR(p_values, dependent=False, m=None, ordered=False):
     """
     `False Discovery Rate <http://en.wikipedia.org/wiki/False_discovery_rate>`_ correction on a list of p-values.
 
+    The correction is computed with array operations and the adjusted
+    p-values are returned in the input order. If `p_values` is a numpy
+    array the result is also an array, otherwise a list.
+
     :param p_values: a list of p-values.
-    :param dependent: use correction for dependent hypotheses (default False).
+    :param dependent: use the Benjamini-Yekutieli correction for dependent hypotheses (default False).
     :param m: number of hypotheses tested (default ``len(p_values)``).
     :param ordered: prevent sorting of p-values if they are already sorted (default False).
     """
-
-    if not ordered:
-        ordered = is_sorted(p_values)
-
-    if not ordered:
-        joined = [ (v,i) for i,v in enumerate(p_values) ]
-        joined.sort()
-        p_values = [ p[0] for p in joined ]
-        indices = [ p[1] for p in joined ]
+    as_array = isinstance(p_values, numpy.ndarray)
+    p_values = numpy.asarray(p_values, dtype=float)
 
     if not m:
         m = len(p_values)
-    if m <= 0 or not p_values:
-        return []
+    if m <= 0 or not len(p_values):
+        return p_values[:0] if as_array else []
 
     if dependent: # correct q for dependent tests
-        k = c[m-1] if m <= len(c) else math.log(m) + 0.57721566490153286060651209008240243104215933593992
-        m = m * k
+        m = m * _harmonic(m)
+
+    if not ordered:
+        ordered = bool(numpy.all(p_values[1:] >= p_values[:-1]))
 
-    tmp_fdrs = [p*m/(i+1.0) for (i, p) in enumerate(p_values)]
-    fdrs = []
-    cmin = tmp_fdrs[-1]
-    for f in reversed(tmp_fdrs):
-        cmin = min(f, cmin)
-        fdrs.append( cmin)
-    fdrs.reverse()
+    if ordered:
+        sorted_p = p_values
+    else:
+        # tied p-values end up with the same adjusted value, so the sort
+        # does not need to be stable
+        indices = numpy.argsort(p_values)
+        sorted_p = p_values[indices]
+
+    fdrs = sorted_p * m / numpy.arange(1.0, len(sorted_p) + 1)
+    fdrs = numpy.minimum.accumulate(fdrs[::-1])[::-1]
 
     if not ordered:
-        new = [ None ] * len(fdrs)
-        for v,i in zip(fdrs, indices):
-            new[i] = v
-        fdrs = new
+        unsorted = numpy.empty_like(fdrs)
+        unsorted[indices] = fdrs
+        fdrs = unsorted
 
-    return fdrs
+    return fdrs if as_array else fdrs.tolist()
 
 def Bonferroni(p_values, m=None):
     """
     `Bonferroni correction <http://en.wikipedia.org/wiki/Bonferroni_correction>`_ correction on a list of p-values.
 
+    The adjusted p-values (``min(1, p * m)``) are returned in the input
+    order. If `p_values` is a numpy array the result is also an array,
+    otherwise a list.
+
     :param p_values: a list of p-values.
     :param m: number of hypotheses tested (default ``len(p_values)``).
     """
+    as_array = isinstance(p_values, numpy.ndarray)
+    p_values = numpy.asarray(p_values, dtype=float)
     if not m:
         m = len(p_values)
     if m == 0:
-        return []
-    m = float(m)
-    return [p/m for p in p_values]
+        return p_values[:0] if as_array else []
+    adjusted = numpy.minimum(p_values * float(m), 1.0)
+    return adjusted if as_array else adjusted.tolist()
@@ -0,0 +1,56 @@
+"""
+A micro-benchmark of the scalar (`p_value`) and the vectorized
+(`p_values`) Binomial and Hypergeometric p-values from
+`orangecontrib.bio.utils.stats`.
+
+Usage: python benchmark_stats.py [number of tests]
+
+The test arguments mimic a GO enrichment analysis: a reference of
+20000 genes, a cluster of 500 genes and one test per term.
+
+"""
+from __future__ import print_function
+
+import sys
+import time
+
+import numpy
+
+from orangecontrib.bio.utils import stats
+
+
+def arguments(count, N=20000, n=500, seed=0):
+    rng = numpy.random.RandomState(seed)
+    m = numpy.minimum(rng.geometric(0.01, size=count), N)
+    k = numpy.minimum(rng.binomial(n, 1.5 * m / float(N)), m)
+    k = numpy.maximum(k, 1)
+    return k, N, m, n
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 20000
+    k, N, m, n = arguments(count)
+    for prob in [stats.Binomial(), stats.Hypergeometric()]:
+        # Make sure the lookup tables are allocated
+        prob.p_value(1, N, 1, n)
+        prob.p_values(1, N, 1, n)
+
+        start = time.time()
+        scalar = [prob.p_value(ki, N, mi, n)
+                  for ki, mi in zip(k.tolist(), m.tolist())]
+        t_scalar = time.time() - start
+
+        start = time.time()
+        vector = prob.p_values(k, N, m, n)
+        t_vector = time.time() - start
+
+        error = numpy.max(numpy.abs(vector - scalar) /
+                          numpy.maximum(scalar, 1e-300))
+        print("%-15s %i tests: p_value %.3f s, p_values %.3f s "
+              "(%.1fx faster, max. relative difference %.1e)" %
+              (type(prob).__name__, count, t_scalar, t_vector,
+               t_scalar / max(t_vector, 1e-9), error))
+
+
+if __name__ == "__main__":
+    main(sys.argv)